@@ -2,7 +2,9 @@ import os
 import logging
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
-from extensions import db, Base
+from extensions import db, Base, engine_options
+from history_writer import history_writer
+from services import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -14,15 +16,52 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///smart_converter.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 
 # File upload configuration
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Request size limits: MAX_CONTENT_LENGTH applies to every route without its
+# own entry in UPLOAD_LIMITS_MB. Uploads are streamed to disk as they
+# arrive, so large limits do not cost memory.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_CONTENT_LENGTH_MB", 16)) * 1024 * 1024
+app.config['UPLOAD_LIMITS_MB'] = {
+    endpoint: int(os.environ.get(f"UPLOAD_LIMIT_{endpoint.upper()}_MB", default))
+    for endpoint, default in {
+        'upload_file': 500,
+        'split_pdf': 500,
+        'merge_pdf': 500,
+        'pdf_to_images': 200,
+        'images_to_pdf': 200,
+        'run_batch': 500,
+        # These hold the whole input and its rendered pages in memory or
+        # send it to Vision
+        'run_pipeline': 100,
+        'compress_pdf': 100,
+        'extract_text': 50,
+    }.items()
+}
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['PROCESSED_FOLDER'] = 'static/processed'
+app.config['LISTING_PAGE_SIZE'] = int(os.environ.get("LISTING_PAGE_SIZE", 50))
+
+# Download configuration: 'direct' streams files from the worker, 'x-sendfile'
+# and 'x-accel-redirect' let the front-end web server (Apache/nginx) serve them
+app.config['DOWNLOAD_MODE'] = os.environ.get("DOWNLOAD_MODE", "direct")
+app.config['USE_X_SENDFILE'] = app.config['DOWNLOAD_MODE'] == 'x-sendfile'
+app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get("X_ACCEL_REDIRECT_PREFIX", "/protected")
+app.config['DOWNLOAD_CACHE_MAX_AGE'] = 365 * 24 * 60 * 60  # UUID-named outputs never change
+# Cloud Storage files: 'redirect' to a signed URL, or 'stream' them through
+# the worker (for buckets clients cannot reach directly)
+app.config['CLOUD_DOWNLOAD_MODE'] = os.environ.get("CLOUD_DOWNLOAD_MODE", "redirect")
+
+# Outputs of the PDF tools are reused for identical input and parameters;
+# the least recently used entries are evicted beyond this size (0 disables)
+app.config['RESULT_CACHE_MAX_MB'] = int(os.environ.get("RESULT_CACHE_MAX_MB", 1024))
+
+# Batch API: files processed concurrently per worker process, files per batch,
+# uncompressed size of a file inside an uploaded ZIP (each is read into memory)
+app.config['BATCH_WORKERS'] = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+app.config['BATCH_MAX_FILES'] = int(os.environ.get("BATCH_MAX_FILES", 500))
+app.config['BATCH_MAX_MEMBER_MB'] = int(os.environ.get("BATCH_MAX_MEMBER_MB", 100))
 
 # Google Cloud configuration
 app.config['GOOGLE_CLOUD_PROJECT'] = os.environ.get("GOOGLE_CLOUD_PROJECT")
@@ -31,27 +70,30 @@ app.config['GOOGLE_CLOUD_STORAGE_BUCKET'] = os.environ.get("GOOGLE_CLOUD_STORAGE
 # Initialize the app with the extension
 db.init_app(app)
 
-# Import models after db initialization
-from models import ConversionHistory, ExtractedText, AppSettings
+# History rows are written behind the request by default; set
+# HISTORY_WRITE_MODE=sync to commit them before responding (e.g. in tests)
+app.config['HISTORY_WRITE_MODE'] = os.environ.get("HISTORY_WRITE_MODE", "deferred")
+app.config['HISTORY_FLUSH_INTERVAL_MS'] = int(os.environ.get("HISTORY_FLUSH_INTERVAL_MS", 200))
+app.config['HISTORY_FLUSH_ROWS'] = int(os.environ.get("HISTORY_FLUSH_ROWS", 500))
+app.config['HISTORY_FLUSH_RETRIES'] = int(os.environ.get("HISTORY_FLUSH_RETRIES", 3))
+app.config['HISTORY_SPOOL_DIR'] = os.environ.get("HISTORY_SPOOL_DIR", os.path.join(app.instance_path, 'history_spool'))
+app.config['HISTORY_SPOOL_FSYNC'] = os.environ.get("HISTORY_SPOOL_FSYNC", "").lower() in ("1", "true", "yes")
+history_writer.init_app(app)
 
-# Create tables if they don't exist
-with app.app_context():
-    # Check if tables exist before creating them
-    inspector = db.inspect(db.engine)
-    existing_tables = inspector.get_table_names()
-    
-    # Get all table names from models
-    table_names = [table.__tablename__ for table in [ConversionHistory, ExtractedText, AppSettings] 
-                  if hasattr(table, '__tablename__')]
-    
-    # Create only missing tables
-    missing_tables = [table for table in table_names if table not in existing_tables]
-    
-    if missing_tables:
-        print(f"Creating missing tables: {', '.join(missing_tables)}")
-        db.create_all()
-    else:
-        print("All tables already exist")
+# Opt-in request profiling: send "X-Profile: <PROFILE_TOKEN>" or sample a
+# fraction of conversion requests. Profiles are written as folded stacks.
+app.config['PROFILE_TOKEN'] = os.environ.get("PROFILE_TOKEN")
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+app.config['PROFILE_DIR'] = os.environ.get("PROFILE_DIR", os.path.join(app.instance_path, 'profiles'))
+
+# Request latency and per-stage timings, exposed at /metrics
+metrics.init_app(app)
+
+# Import models after db initialization. The schema is managed by versioned
+# migrations run once per deploy (python migrations.py), so importing the app
+# performs no database I/O.
+import models
 
 # Import routes after db initialization
 import routes
@@ -61,5 +103,10 @@ if __name__ == '__main__':
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
     
+    # Bring the development database up to date
+    from migrations import upgrade
+    with app.app_context():
+        upgrade(db.engine)
+    
     # Run the app in debug mode
     app.run(host='0.0.0.0', port=5000, debug=True)
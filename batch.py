@@ -0,0 +1,244 @@
+import os
+import json
+import logging
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from models import ConversionHistory
+from history_writer import history_writer
+from services import metrics, pdf_tools
+
+# Operations a batch can apply to each of its files, as pipeline steps
+BATCH_OPERATIONS = {
+    'compress': ['compress'],
+    'split': ['split'],
+    'pdf_to_images': ['rasterize'],
+    'ocr': ['ocr'],
+}
+
+SUPPORTED_EXTENSIONS = ('.pdf',) + pdf_tools.IMAGE_EXTENSIONS
+
+
+class BatchError(Exception):
+    """The batch as a whole cannot be run"""
+
+
+class BatchItem:
+    """One input file of a batch: a file on disk, a member of an uploaded ZIP or bytes in memory"""
+
+    def __init__(self, name, path=None, member=None, data=None):
+        self.name = name
+        self.path = path
+        self.member = member
+        self.data = data
+
+    def load(self):
+        name = os.path.basename(self.name)
+        if self.data is not None:
+            return pdf_tools.Document.from_bytes(name, self.data)
+        if self.member is None:
+            return pdf_tools.Document.open(self.path, name)
+        # A ZipFile per item, so items of one archive can be read concurrently
+        with zipfile.ZipFile(self.path) as archive:
+            return pdf_tools.Document.from_bytes(name, archive.read(self.member))
+
+
+def collect_items(files, storage, max_files, max_member_bytes=None):
+    """Save the uploaded files and list the batch items they contain.
+
+    Returns ``(items, saved_paths)``; uploaded ZIPs are expanded into their
+    supported members without extracting them. Each member is read into
+    memory when processed, so members larger than ``max_member_bytes``
+    uncompressed are refused up front.
+    """
+    items = []
+    saved = []
+    try:
+        for file in files:
+            lower = file.filename.lower()
+            if not (lower.endswith('.zip') or lower.endswith(SUPPORTED_EXTENSIONS)):
+                continue
+            _, path = storage.save(file)
+            saved.append(path)
+            if not lower.endswith('.zip'):
+                items.append(BatchItem(file.filename, path))
+            else:
+                try:
+                    with zipfile.ZipFile(path) as archive:
+                        for info in archive.infolist():
+                            if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                                continue
+                            if not info.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                                continue
+                            if max_member_bytes is not None and info.file_size > max_member_bytes:
+                                raise BatchError(f"{info.filename} in {file.filename} is larger than "
+                                                 f"{max_member_bytes // (1024 * 1024)} MB uncompressed")
+                            items.append(BatchItem(info.filename, path, member=info.filename))
+                except zipfile.BadZipFile:
+                    raise BatchError(f"{file.filename} is not a valid ZIP archive")
+            if len(items) > max_files:
+                raise BatchError(f"A batch can contain at most {max_files} files")
+    except BatchError:
+        for path in saved:
+            os.remove(path)
+        raise
+    return items, saved
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor(workers):
+    """Thread pool shared by all batches of this process, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+        return _executor
+
+
+def process_item(item, operations, ocr_service):
+    """Run the operations on one item; returns its output files.
+
+    Several outputs go in a folder named after the item; a single one is
+    named after the item (``a_page_1.pdf`` for a one-page split of
+    ``a.pdf``), so outputs of different items do not collide.
+    """
+    documents = pdf_tools.run([item.load()], operations, ocr_service=ocr_service)
+    files = list(pdf_tools.output_files(documents))
+    folder = os.path.dirname(item.name)
+    stem = os.path.splitext(os.path.basename(item.name))[0]
+    if len(files) > 1:
+        folder = os.path.join(folder, stem)
+    elif not files[0][0].startswith(stem):
+        files = [(f"{stem}_{files[0][0]}", files[0][1])]
+    return [(os.path.join(folder, name) if folder else name, data) for name, data in files]
+
+
+def _unique(name, used):
+    """``name``, or ``name`` with a counter if the archive already has it"""
+    root, extension = os.path.splitext(name)
+    candidate, number = name, 2
+    while candidate in used:
+        candidate = f"{root}_{number}{extension}"
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+class _ZipSink:
+    """Write-only stream collecting what ZipFile writes between drains"""
+
+    def __init__(self, copy_to=None):
+        self.chunks = []
+        self.copy_to = copy_to
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        if self.copy_to is not None:
+            self.copy_to.write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _results(items, operations, ocr_service, workers):
+    """Yield ``(item, files, error)`` as items complete.
+
+    At most twice the pool size is in flight, so results wait in memory only
+    as long as the client takes to read the previous ones.
+    """
+    pool = executor(workers)
+    pending = deque(items)
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < workers * 2:
+                item = pending.popleft()
+                running[pool.submit(process_item, item, operations, ocr_service)] = item
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = running.pop(future)
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    logging.error(f"Batch item {item.name} failed: {str(e)}")
+                    yield item, None, e
+    finally:
+        # Closed early (the client went away): drop queued work and let the
+        # items already running finish before their inputs are deleted
+        for future in running:
+            future.cancel()
+        wait(running)
+
+
+def stream(items, operation, ocr_service, storage, output_key, workers, cleanup=()):
+    """Stream a ZIP of the results as items complete, keeping a stored copy.
+
+    The archive ends with ``summary.json`` listing every item's outputs or
+    error. Once it is complete, one history row is recorded for the whole
+    batch, pointing at the stored copy.
+    """
+    operations = BATCH_OPERATIONS[operation]
+    output_path = storage.path(output_key, 'processed')
+    summary = []
+    used_names = {'summary.json'}
+    started = datetime.utcnow()
+    results = _results(items, operations, ocr_service, workers)
+    try:
+        with open(output_path, 'wb') as stored:
+            sink = _ZipSink(copy_to=stored)
+            with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+                for item, files, error in results:
+                    if error is not None:
+                        summary.append({'file': item.name, 'status': 'failed', 'error': str(error)})
+                        continue
+                    # Two uploads may share a name
+                    files = [(_unique(name, used_names), data) for name, data in files]
+                    with metrics.stage('archive'):
+                        for name, data in files:
+                            archive.writestr(name, data)
+                    summary.append({'file': item.name, 'status': 'completed',
+                                    'outputs': [name for name, _ in files]})
+                    yield sink.drain()
+                failed = sum(1 for entry in summary if entry['status'] == 'failed')
+                archive.writestr('summary.json', json.dumps({
+                    'operation': operation,
+                    'files': len(summary),
+                    'completed': len(summary) - failed,
+                    'failed': failed,
+                    'seconds': (datetime.utcnow() - started).total_seconds(),
+                    'items': summary,
+                }, indent=2))
+            yield sink.drain()
+    except GeneratorExit:
+        # The client went away; nothing to keep or record
+        os.remove(output_path)
+        raise
+    finally:
+        results.close()
+        for path in cleanup:
+            if os.path.exists(path):
+                os.remove(path)
+
+    failed = sum(1 for entry in summary if entry['status'] == 'failed')
+    conversion = ConversionHistory(
+        filename=output_key,
+        original_filename=f'batch of {len(items)} files',
+        file_type='zip',
+        conversion_type=f'batch_{operation}',
+        file_size=os.path.getsize(output_path),
+        status='failed' if failed == len(summary) and summary else 'completed',
+        error_message=f'{failed} of {len(summary)} files failed' if failed else None,
+        processed_at=datetime.utcnow()
+    )
+    history_writer.record(conversion)
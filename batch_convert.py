@@ -0,0 +1,271 @@
+"""Convert or OCR large numbers of files outside the web server.
+
+Walks a local directory or a Cloud Storage prefix and runs the same
+pdf_tools stages as the routes and /api/batch on a process pool. Files are
+handed to the pool as the listing pages arrive, so conversion starts
+without waiting for a large prefix to be listed in full. Outputs
+go to the processed area like route outputs, and each file gets a history
+row, so results show up in My Files. Rows are written through the
+deferred history writer, which inserts them in bulk.
+
+Progress is appended to a checkpoint file (one JSON line per finished
+file). Running the same command again skips files already completed.
+
+    python batch_convert.py ocr --input /archive/scans
+    python batch_convert.py compress --gcs-prefix archive/2023/ --workers 8
+"""
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import zipfile
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime
+from app import app
+from batch import BATCH_OPERATIONS, BatchItem, SUPPORTED_EXTENSIONS, process_item
+from history_writer import history_writer
+from models import ConversionHistory
+from services.storage import FileStorage
+
+# Set in each worker process by _init_worker
+_storage = None
+_cloud = None
+_ocr = None
+
+
+def _init_worker():
+    global _storage, _cloud, _ocr
+    # The parent handles Ctrl-C and stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from services.cloud_storage import CloudStorageService
+    from services.ocr_service import OCRService
+    _storage = FileStorage(app.config['UPLOAD_FOLDER'], app.config['PROCESSED_FOLDER'])
+    _cloud = CloudStorageService()
+    _ocr = OCRService()
+
+
+def _store_outputs(name, files):
+    """Write one file's outputs to the processed area; ZIP them if there are several"""
+    if len(files) == 1:
+        output_name, data = files[0]
+        key = _storage.new_key(os.path.basename(output_name))
+        with open(_storage.path(key, 'processed'), 'wb') as f:
+            f.write(data)
+    else:
+        key = _storage.new_key(f"{os.path.splitext(os.path.basename(name))[0]}.zip")
+        with zipfile.ZipFile(_storage.path(key, 'processed'), 'w') as archive:
+            for output_name, data in files:
+                archive.writestr(output_name, data)
+    return key
+
+
+def _convert(task):
+    """Process one file in a worker; returns a checkpoint record"""
+    source, name, operation = task
+    started = time.perf_counter()
+    try:
+        if source == 'gcs':
+            # Read straight into memory; the stages work on bytes anyway
+            item = BatchItem(os.path.basename(name), data=_cloud.download_bytes(name))
+        else:
+            item = BatchItem(os.path.basename(name), name)
+        files = process_item(item, BATCH_OPERATIONS[operation], _ocr)
+        key = _store_outputs(name, files)
+        return {
+            'file': name,
+            'status': 'completed',
+            'output': key,
+            'size': os.path.getsize(_storage.path(key, 'processed')),
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+    except Exception as e:
+        return {'file': name, 'status': 'failed', 'error': str(e),
+                'seconds': round(time.perf_counter() - started, 3)}
+
+
+def list_local(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+
+def list_gcs(prefix):
+    from services.cloud_storage import CloudStorageService
+    cloud = CloudStorageService()
+    if not cloud.is_configured():
+        raise SystemExit("Cloud Storage is not configured (GOOGLE_CLOUD_PROJECT, GOOGLE_CLOUD_STORAGE_BUCKET)")
+    # list_files fetches one page of names at a time, as they are consumed
+    return (name for name in cloud.list_files(prefix=prefix) if name.lower().endswith(SUPPORTED_EXTENSIONS))
+
+
+def load_checkpoint(path):
+    """Names of files already completed by an earlier run"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if record.get('status') == 'completed':
+                done.add(record['file'])
+    return done
+
+
+def _history_row(record, operation):
+    output = record.get('output')
+    return ConversionHistory(
+        filename=output or os.path.basename(record['file']),
+        original_filename=os.path.basename(record['file'])[:255],
+        file_type=os.path.splitext(output)[1].lstrip('.') if output else 'unknown',
+        conversion_type=f'batch_{operation}',
+        file_size=record.get('size'),
+        status=record['status'],
+        error_message=record.get('error'),
+        processed_at=datetime.utcnow(),
+    )
+
+
+class _Listing:
+    """Files still to convert, read from the listing as the pool asks for them.
+
+    Names in the checkpoint are skipped as each page arrives, and the listing
+    ends after ``limit`` files. The pool's task thread drains its input as
+    fast as it can, so at most ``window`` files are handed out ahead of the
+    results; ``release`` lets the next one through.
+    """
+
+    def __init__(self, names, done, limit, window):
+        self.names = names
+        self.done = done
+        self.limit = limit
+        self.found = self.skipped = self.queued = 0
+        self.finished = False
+        self._window = threading.Semaphore(window)
+        self._stopped = False
+
+    def __iter__(self):
+        for name in self.names:
+            if self.limit and self.queued >= self.limit:
+                break
+            self.found += 1
+            if name in self.done:
+                self.skipped += 1
+                continue
+            self._window.acquire()
+            if self._stopped:
+                return
+            self.queued += 1
+            yield name
+        self.finished = True
+
+    def release(self):
+        self._window.release()
+
+    def stop(self):
+        self._stopped = True
+        self._window.release()
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def _report(listing, completed, failed, elapsed):
+    finished = completed + failed
+    rate = finished / elapsed if elapsed > 0 else 0.0
+    if listing.finished:
+        # The total is only known once the listing is exhausted
+        eta = (listing.queued - finished) / rate if rate else 0
+        progress = f"{finished}/{listing.queued} files"
+        remaining = f"ETA {_format_duration(eta)}"
+    else:
+        progress = f"{finished} files"
+        remaining = "still listing"
+    print(f"{progress} ({failed} failed), {listing.found} found, {listing.skipped} already done, "
+          f"{rate:.2f} files/s, {remaining}", file=sys.stderr)
+
+
+def run(args):
+    source = 'gcs' if args.gcs_prefix is not None else 'local'
+    names = list_gcs(args.gcs_prefix) if source == 'gcs' else list_local(args.input)
+    done = load_checkpoint(args.checkpoint)
+    listing = _Listing(names, done, args.limit, window=args.workers * 4)
+    print(f"Converting with {args.workers} workers, {len(done)} files in the checkpoint", file=sys.stderr)
+
+    # Rows are buffered and inserted in bulk, whatever the web setting
+    app.config['HISTORY_WRITE_MODE'] = 'deferred'
+    completed = failed = 0
+    started = last_report = time.monotonic()
+    # chunksize=1: idle workers take the next file as soon as they finish, so
+    # a few slow files never hold up a worker's queued share of the rest
+    pool = multiprocessing.Pool(args.workers, initializer=_init_worker)
+    try:
+        with open(args.checkpoint, 'a') as checkpoint:
+            tasks = ((source, name, args.operation) for name in listing)
+            for record in pool.imap_unordered(_convert, tasks, chunksize=1):
+                listing.release()
+                checkpoint.write(json.dumps(record) + '\n')
+                checkpoint.flush()
+                if record['status'] == 'completed':
+                    completed += 1
+                else:
+                    failed += 1
+                    logging.error(f"{record['file']}: {record['error']}")
+                if args.record_history:
+                    history_writer.record(_history_row(record, args.operation))
+
+                now = time.monotonic()
+                if now - last_report >= args.progress_interval:
+                    last_report = now
+                    _report(listing, completed, failed, now - started)
+        pool.close()
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        listing.stop()
+        pool.terminate()
+        return 130
+    except Exception:
+        # The listing failed part way; stop the pool before reporting it
+        listing.stop()
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        history_writer.close()
+    _report(listing, completed, failed, time.monotonic() - started)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('operation', choices=sorted(BATCH_OPERATIONS))
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='local directory to walk')
+    source.add_argument('--gcs-prefix', help='Cloud Storage prefix to list (CloudStorageService bucket)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--checkpoint', help='progress file (default: batch_<operation>.checkpoint.jsonl)')
+    parser.add_argument('--limit', type=int, help='convert at most this many files this run')
+    parser.add_argument('--no-history', dest='record_history', action='store_false',
+                        help='do not write ConversionHistory rows')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='seconds between progress lines')
+    args = parser.parse_args(argv)
+    args.checkpoint = args.checkpoint or f'batch_{args.operation}.checkpoint.jsonl'
+    # app.py configures DEBUG logging for the web server
+    logging.getLogger().setLevel(logging.WARNING)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Synthetic input files for the benchmarks.
+
+Everything is generated in memory from a seed, so two runs (or two
+commits) convert byte-identical inputs:
+
+- ``text_pdf(pages)``: a PDF with a text layer only, written by hand
+- ``scanned_pdf(pages)``: a PDF of page-sized raster images, like a scan
+- ``image(width, height, fmt)``: a PNG or JPEG with text-like noise
+"""
+import io
+import random
+from PIL import Image, ImageDraw
+
+WORDS = ['invoice', 'total', 'amount', 'due', 'customer', 'account', 'date', 'reference',
+         'payment', 'balance', 'order', 'shipping', 'address', 'quantity', 'price', 'tax']
+
+# A4 at 72 dpi, the unit of PDF user space
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+
+
+def _lines(rng, count, words=10):
+    return [' '.join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+
+def text_pdf(pages, lines_per_page=40, seed=0):
+    """A PDF whose pages hold Helvetica text drawn with content streams"""
+    rng = random.Random(seed)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # page tree, filled in once the page objects are numbered
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    page_ids = []
+    for _ in range(pages):
+        content = ['BT /F1 11 Tf 50 800 Td 14 TL']
+        for line in _lines(rng, lines_per_page):
+            content.append(f'({line}) Tj T*')
+        content.append('ET')
+        stream = '\n'.join(content).encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+            % (PAGE_WIDTH, PAGE_HEIGHT, content_id))
+        page_ids.append(len(objects))
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, pages)
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def _page_image(rng, width, height, lines):
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    step = max(12, height // (lines + 2))
+    for row, line in enumerate(_lines(rng, lines)):
+        draw.text((width // 12, step * (row + 1)), line, fill=0)
+    # Scanner noise, so the page does not compress to nothing
+    for _ in range(width * height // 200):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randrange(160, 255))
+    return image
+
+
+def scanned_pdf(pages, dpi=150, seed=0):
+    """A PDF of grayscale page images at ``dpi``, with no text layer"""
+    rng = random.Random(seed)
+    width, height = PAGE_WIDTH * dpi // 72, PAGE_HEIGHT * dpi // 72
+    images = [_page_image(rng, width, height, 40) for _ in range(pages)]
+    out = io.BytesIO()
+    images[0].save(out, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+    return out.getvalue()
+
+
+def image(width, height, fmt='PNG', seed=0):
+    """A text-like image of the given size, encoded as PNG or JPEG"""
+    rng = random.Random(seed)
+    page = _page_image(rng, width, height, max(1, height // 40)).convert('RGB')
+    out = io.BytesIO()
+    page.save(out, fmt, **({'quality': 85} if fmt == 'JPEG' else {}))
+    return out.getvalue()
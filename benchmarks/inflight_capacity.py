@@ -0,0 +1,133 @@
+"""Measure in-flight request capacity of gunicorn worker configurations.
+
+Starts gunicorn with each configuration against ``benchmarks.slow_ocr_app``
+(OCR replaced by a fixed-latency stand-in), fires concurrent
+``POST /extract-text`` requests and reports throughput and the effective
+number of requests in flight (throughput x OCR latency, by Little's law).
+
+    python -m benchmarks.inflight_capacity --requests 64 --concurrency 32
+"""
+import os
+import sys
+import io
+import json
+import time
+import uuid
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGURATIONS = {
+    'sync': ['--worker-class', 'sync', '--workers', '4'],
+    'gthread': ['--worker-class', 'gthread', '--workers', '4', '--threads', '8'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def sample_png():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), 'white').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def multipart_body(field, filename, content, content_type):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start listening on port {port}")
+
+
+def post(port, body, content_type):
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    try:
+        conn.request('POST', '/extract-text', body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def run_configuration(name, args, requests, concurrency, latency, workdir):
+    port = free_port()
+    env = dict(os.environ, BENCH_OCR_LATENCY=str(latency), PYTHONPATH=ROOT)
+    cmd = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+           '--log-level', 'warning'] + args + ['benchmarks.slow_ocr_app:app']
+    server = subprocess.Popen(cmd, cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        body, content_type = multipart_body('file', 'bench.png', sample_png(), 'image/png')
+        # Warm up every worker so boot time is not counted as request latency
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: post(port, body, content_type), range(concurrency)))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: post(port, body, content_type), range(requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies = sorted(duration for _, duration in results)
+    throughput = len(results) / elapsed
+    return {
+        'configuration': name,
+        'requests': len(results),
+        'errors': sum(1 for status, _ in results if status >= 500),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(throughput, 2),
+        'in_flight': round(throughput * latency, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.5, help='simulated OCR latency in seconds')
+    parser.add_argument('--config', action='append', choices=sorted(CONFIGURATIONS),
+                        help='configuration(s) to run (default: all)')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        subprocess.run([sys.executable, os.path.join(ROOT, 'migrations.py')], cwd=workdir, check=True,
+                       env=dict(os.environ, PYTHONPATH=ROOT),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for name in options.config or sorted(CONFIGURATIONS):
+            result = run_configuration(name, CONFIGURATIONS[name], options.requests,
+                                       options.concurrency, options.latency, workdir)
+            print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
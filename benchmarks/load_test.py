@@ -0,0 +1,327 @@
+"""Load test the app under gunicorn with a scenario file.
+
+A scenario (``benchmarks/scenarios/*.json``) mixes requests by weight
+(uploads, OCR, PDF tools, listings, ``/api/stats`` polling) and ramps the
+number of concurrent virtual users through a list of stages. Each virtual
+user is a coroutine with its own keep-alive connection that sends requests
+back to back (plus optional think time), so throughput stops growing once
+the server is saturated.
+
+For every stage the report has throughput, error rate and p50/p95/p99 per
+endpoint; the saturation point is the first stage where adding users no
+longer raises throughput by ``--saturation-gain``, errors exceed
+``max_error_rate`` or p99 exceeds ``slo_p99_ms``.
+
+Unless ``--url`` is given, gunicorn is started with ``gunicorn.conf.py`` on
+a fresh SQLite database, with Vision and Cloud Storage faked
+(``GCP_FAKES=1``) and the result and page caches disabled, so repeated
+fixtures measure the conversions rather than cache hits (a scenario's
+``env`` can turn them back on to measure a warm cache). Pass ``--workers`` several times to compare process
+counts before changing the Procfile:
+
+    python -m benchmarks.load_test benchmarks/scenarios/mixed.json --workers 2 --workers 4
+    python -m benchmarks.load_test benchmarks/scenarios/mixed.json --url http://127.0.0.1:5000
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from urllib.parse import urlsplit
+from benchmarks import fixtures
+from benchmarks.inflight_capacity import free_port, wait_for_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONTENT_TYPES = {'.pdf': 'application/pdf', '.png': 'image/png', '.jpg': 'image/jpeg',
+                 '.jpeg': 'image/jpeg', '.txt': 'text/plain'}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def build_file(spec, seed=0):
+    """Render a fixture spec: ``{"fixture": "text_pdf", "args": [5], "filename": "a.pdf"}``"""
+    generate = getattr(fixtures, spec['fixture'])
+    kwargs = dict(spec.get('kwargs', {}))
+    kwargs.setdefault('seed', seed)
+    return spec['filename'], generate(*spec.get('args', []), **kwargs)
+
+
+def multipart_body(fields):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, files in fields.items():
+        for filename, content in files:
+            content_type = CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream')
+            parts.append(
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + content + b'\r\n')
+    return b''.join(parts) + f'--{boundary}--\r\n'.encode('utf-8'), f'multipart/form-data; boundary={boundary}'
+
+
+class RequestTemplate:
+    """One entry of a scenario's request mix, with its body prepared up front"""
+
+    def __init__(self, spec):
+        self.name = spec['name']
+        self.weight = spec.get('weight', 1)
+        self.method = spec.get('method', 'GET')
+        self.path = spec['path']
+        # "unique": true gives every request distinct file content (a random
+        # trailer, ignored by PDF and image readers), so deduplicated uploads
+        # are stored each time instead of only bumping a reference count
+        self.unique = spec.get('unique', False)
+        self.fields = None
+        self.body, self.content_type = b'', None
+        if 'files' in spec:
+            fields = {}
+            for field, specs in spec['files'].items():
+                specs = specs if isinstance(specs, list) else [specs]
+                fields[field] = [build_file(file_spec, seed) for seed, file_spec in enumerate(specs)]
+            self.fields = fields
+            self.body, self.content_type = multipart_body(fields)
+
+    def encode(self, host):
+        body, content_type = self.body, self.content_type
+        if self.unique and self.fields:
+            body, content_type = multipart_body({
+                field: [(filename, content + b'\n%' + uuid.uuid4().hex.encode('ascii') + b'\n')
+                        for filename, content in files]
+                for field, files in self.fields.items()})
+        headers = [f'{self.method} {self.path} HTTP/1.1', f'Host: {host}',
+                   f'Content-Length: {len(body)}']
+        if content_type:
+            headers.append(f'Content-Type: {content_type}')
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client on asyncio streams"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, payload):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        else:
+            await self.reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, headers
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+
+def is_error(template, status, headers):
+    # The form views report failures by redirecting back to themselves
+    if status >= 400:
+        return True
+    location = headers.get('location')
+    return status in (301, 302, 303) and location is not None and urlsplit(location).path == template.path
+
+
+async def virtual_user(host, port, templates, weights, deadline, think_time, rng, records):
+    connection = Connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            template = rng.choices(templates, weights)[0]
+            started = time.perf_counter()
+            try:
+                status, headers = await connection.request(template.encode(f'{host}:{port}'))
+                error = is_error(template, status, headers)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                await connection.close()
+                status, error = None, True
+            records.append((template.name, time.perf_counter() - started, status, error))
+            if think_time:
+                await asyncio.sleep(think_time)
+    finally:
+        await connection.close()
+
+
+def summarize(records, elapsed):
+    latencies = [duration * 1000 for _, duration, _, _ in records]
+    errors = sum(1 for record in records if record[3])
+    summary = {
+        'requests': len(records),
+        'throughput_rps': round(len(records) / elapsed, 2),
+        'error_rate': round(errors / len(records), 4) if records else 0.0,
+    }
+    if latencies:
+        summary.update({
+            'p50_ms': round(percentile(latencies, 0.50), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+        })
+    return summary
+
+
+async def run_stage(host, port, templates, stage, think_time, seed):
+    weights = [template.weight for template in templates]
+    records = []
+    started = time.perf_counter()
+    deadline = started + stage['duration_s']
+    await asyncio.gather(*(
+        virtual_user(host, port, templates, weights, deadline, think_time, random.Random(seed + user), records)
+        for user in range(stage['users'])
+    ))
+    elapsed = time.perf_counter() - started
+
+    result = {'users': stage['users'], 'duration_s': round(elapsed, 2), **summarize(records, elapsed)}
+    result['endpoints'] = {
+        template.name: summarize([record for record in records if record[0] == template.name], elapsed)
+        for template in templates
+    }
+    return result
+
+
+def find_saturation(stages, scenario, min_gain):
+    """First stage at which the server stops keeping up, or None"""
+    for previous, stage in zip([None] + stages, stages):
+        if stage['error_rate'] > scenario.get('max_error_rate', 0.01):
+            return {'users': stage['users'], 'reason': 'error_rate'}
+        if scenario.get('slo_p99_ms') and stage.get('p99_ms', 0) > scenario['slo_p99_ms']:
+            return {'users': stage['users'], 'reason': 'p99_slo'}
+        if previous and stage['throughput_rps'] < previous['throughput_rps'] * (1 + min_gain):
+            return {'users': stage['users'], 'reason': 'throughput_plateau'}
+    return None
+
+
+def run_scenario(url, scenario, min_gain):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    templates = [RequestTemplate(spec) for spec in scenario['requests']]
+    think_time = scenario.get('think_time_ms', 0) / 1000
+
+    # Warm up every worker process and its lazily created clients
+    warmup = {'users': scenario['stages'][0]['users'], 'duration_s': scenario.get('warmup_s', 3)}
+    asyncio.run(run_stage(host, port, templates, warmup, think_time, seed=0))
+
+    stages = []
+    for number, stage in enumerate(scenario['stages'], start=1):
+        result = asyncio.run(run_stage(host, port, templates, stage, think_time, seed=number * 1000))
+        stages.append(result)
+        print(f"  {result['users']:4d} users  {result['throughput_rps']:8.1f} req/s  "
+              f"errors {result['error_rate'] * 100:5.1f}%  p50 {result.get('p50_ms', 0):8.1f} ms  "
+              f"p99 {result.get('p99_ms', 0):8.1f} ms", file=sys.stderr)
+
+    best = max(stages, key=lambda stage: stage['throughput_rps'])
+    return {
+        'stages': stages,
+        'peak_throughput_rps': best['throughput_rps'],
+        'peak_throughput_users': best['users'],
+        'saturation': find_saturation(stages, scenario, min_gain),
+    }
+
+
+def start_server(workers, scenario, workdir):
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT, PORT=str(port), GCP_FAKES='1',
+               GCP_FAKE_STORAGE_DIR=os.path.join(workdir, 'gcs'),
+               HISTORY_SPOOL_DIR=os.path.join(workdir, 'history_spool'),
+               PROFILE_DIR=os.path.join(workdir, 'profiles'),
+               RESULT_CACHE_MAX_MB='0', PAGE_CACHE_MAX_MB='0',
+               PAGE_CACHE_DIR=os.path.join(workdir, 'page-cache'),
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'load.db')}")
+    env.setdefault('GOOGLE_CLOUD_PROJECT', 'loadtest')
+    env.setdefault('GOOGLE_CLOUD_STORAGE_BUCKET', 'loadtest')
+    env.update({key: str(value) for key, value in scenario.get('env', {}).items()})
+    if workers:
+        env['WEB_CONCURRENCY'] = str(workers)
+
+    subprocess.run([sys.executable, os.path.join(ROOT, 'migrations.py')], cwd=workdir, env=env,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return server, f'http://127.0.0.1:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenario', help='scenario JSON file')
+    parser.add_argument('--url', help='target a running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, action='append',
+                        help='gunicorn worker processes (repeat to compare; default WEB_CONCURRENCY)')
+    parser.add_argument('--saturation-gain', type=float, default=0.1,
+                        help='minimum relative throughput gain per stage before the server counts as saturated')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    options = parser.parse_args()
+
+    with open(options.scenario) as f:
+        scenario = json.load(f)
+
+    runs = []
+    if options.url:
+        print(f"{options.url}:", file=sys.stderr)
+        runs.append({'url': options.url, **run_scenario(options.url, scenario, options.saturation_gain)})
+    else:
+        for workers in options.workers or [None]:
+            with tempfile.TemporaryDirectory() as workdir:
+                server, url = start_server(workers, scenario, workdir)
+                try:
+                    print(f"workers={workers or os.environ.get('WEB_CONCURRENCY', 'default')}:", file=sys.stderr)
+                    result = run_scenario(url, scenario, options.saturation_gain)
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+            runs.append({'workers': workers, **result})
+
+    report = {
+        'scenario': os.path.basename(options.scenario),
+        'description': scenario.get('description'),
+        'runs': runs,
+    }
+    print(json.dumps(report, indent=2))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
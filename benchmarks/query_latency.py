@@ -0,0 +1,125 @@
+"""Query latency of the dashboard and listing endpoints on a large history table.
+
+Populates ``conversion_history`` with synthetic rows spread over a year,
+then times ``/api/stats``, ``/history`` (unfiltered, filtered by status and
+a deep page) and ``/my-files`` through the Flask test client, and reports
+p50/p99 per endpoint.
+
+    python -m benchmarks.query_latency --rows 1000000 --output query.json
+    python -m benchmarks.query_latency --rows 1000000 --drop-indexes   # baseline
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATUSES = ['completed'] * 90 + ['failed'] * 8 + ['pending'] * 2
+CONVERSION_TYPES = ['local_upload', 'cloud_upload', 'ocr_extraction', 'merge_pdf',
+                    'split_pdf', 'pdf_to_images', 'images_to_pdf']
+ENDPOINTS = [
+    '/api/stats',
+    '/history',
+    '/history?status=failed',
+    '/history?page=200',
+    '/my-files',
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def populate(db, rows, batch_size=50000):
+    from models import ConversionHistory
+
+    table = ConversionHistory.__table__
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    for start in range(0, rows, batch_size):
+        batch = []
+        for i in range(start, min(rows, start + batch_size)):
+            created_at = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+            batch.append({
+                'filename': f'{i:08x}-bench_{i}.pdf',
+                'original_filename': f'bench_{i}.pdf',
+                'file_type': 'pdf',
+                'conversion_type': rng.choice(CONVERSION_TYPES),
+                'file_size': rng.randrange(1024, 10 * 1024 * 1024),
+                'status': rng.choice(STATUSES),
+                'created_at': created_at,
+                'processed_at': created_at,
+            })
+        with db.engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--drop-indexes', action='store_true',
+                        help='measure without the conversion_history indexes')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+
+    from app import app
+    from extensions import db
+    from migrations import upgrade
+    from models import ConversionHistory
+
+    with app.app_context():
+        upgrade(db.engine)
+        started = time.perf_counter()
+        populate(db, options.rows)
+        populate_s = time.perf_counter() - started
+        if options.drop_indexes:
+            for index in ConversionHistory.__table__.indexes:
+                index.drop(db.engine, checkfirst=True)
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+        backend = db.engine.url.get_backend_name()
+
+    client = app.test_client()
+    results = {}
+    for endpoint in ENDPOINTS:
+        client.get(endpoint)  # warm up
+        timings = []
+        for _ in range(options.iterations):
+            started = time.perf_counter()
+            response = client.get(endpoint)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, (endpoint, response.status_code)
+        results[endpoint] = {
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'max_ms': round(max(timings), 2),
+        }
+
+    report = {
+        'rows': options.rows,
+        'indexes': not options.drop_indexes,
+        'database': backend,
+        'populate_s': round(populate_s, 1),
+        'endpoints': results,
+    }
+    print(json.dumps(report, indent=2))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Benchmark every conversion route on synthetic fixtures.
+
+Each scenario posts one fixture set to a conversion route through the Flask
+test client, with Vision and Cloud Storage replaced by the local fakes
+(``GCP_FAKES=1``). Scenarios run in separate interpreters so that peak RSS
+is attributable to one route; RSS of child processes (poppler,
+ghostscript) is reported separately. The result and page caches are
+disabled: the same fixtures are posted on every iteration, and cache hits
+would otherwise replace the conversions being measured. Results are written as JSON together
+with the commit they were measured on, and ``--compare`` prints the change
+against an earlier run.
+
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --only merge_pdf --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from benchmarks import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _text_pdf(pages):
+    return {'file': (fixtures.text_pdf(pages), f'text_{pages}p.pdf')}
+
+
+def _scanned_pdf(pages):
+    return {'file': (fixtures.scanned_pdf(pages), f'scanned_{pages}p.pdf')}
+
+
+def _image(width, height):
+    return {'file': (fixtures.image(width, height), f'image_{width}x{height}.png')}
+
+
+def _pdfs(count, pages):
+    return {'files': [(fixtures.text_pdf(pages, seed=i), f'part_{i}.pdf') for i in range(count)]}
+
+
+def _images(count, width, height):
+    return {'files': [(fixtures.image(width, height, 'JPEG', seed=i), f'page_{i}.jpg') for i in range(count)]}
+
+
+# name -> (route, fixture builder); a fixture maps form fields to (data, filename)
+SCENARIOS = {
+    'compress_pdf/text_10p': ('/compress-pdf', lambda: _text_pdf(10)),
+    'compress_pdf/scanned_5p': ('/compress-pdf', lambda: _scanned_pdf(5)),
+    'merge_pdf/5x10p': ('/merge-pdf', lambda: _pdfs(5, 10)),
+    'split_pdf/text_50p': ('/split-pdf', lambda: _text_pdf(50)),
+    'pdf_to_images/text_5p': ('/pdf-to-images', lambda: _text_pdf(5)),
+    'pdf_to_images/scanned_5p': ('/pdf-to-images', lambda: _scanned_pdf(5)),
+    'images_to_pdf/10x_a4_jpeg': ('/images-to-pdf', lambda: _images(10, 1240, 1754)),
+    'extract_text/png_1200x1600': ('/extract-text', lambda: _image(1200, 1600)),
+    'extract_text/scanned_3p': ('/extract-text', lambda: _scanned_pdf(3)),
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _max_rss_mb(who):
+    import resource
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(who).ru_maxrss / scale, 1)
+
+
+def run_scenario(name, iterations):
+    """Run one scenario in this process and return its measurements"""
+    import io
+    import logging
+    import resource
+
+    logging.disable(logging.CRITICAL)
+    from app import app
+    import routes  # noqa: F401  registers the views
+
+    route, build = SCENARIOS[name]
+    fixture = build()
+    input_bytes = sum(len(data) for value in fixture.values()
+                      for data, _ in (value if isinstance(value, list) else [value]))
+
+    def post():
+        payload = {key: [(io.BytesIO(data), filename) for data, filename in value]
+                   if isinstance(value, list) else (io.BytesIO(value[0]), value[1])
+                   for key, value in fixture.items()}
+        response = client.post(route, data=payload, content_type='multipart/form-data')
+        response.get_data()
+        # Routes report failures by redirecting back to the form with a flash
+        return response.status_code == 200
+
+    client = app.test_client()
+    baseline_rss = _max_rss_mb(resource.RUSAGE_SELF)
+    post()  # warm up
+
+    timings = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        request_started = time.perf_counter()
+        ok = post()
+        timings.append((time.perf_counter() - request_started) * 1000)
+        errors += not ok
+    elapsed = time.perf_counter() - started
+
+    return {
+        'route': route,
+        'iterations': iterations,
+        'errors': errors,
+        'input_bytes': input_bytes,
+        'throughput_rps': round(iterations / elapsed, 2),
+        'p50_ms': round(percentile(timings, 0.50), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'max_ms': round(max(timings), 2),
+        'baseline_rss_mb': baseline_rss,
+        'peak_rss_mb': _max_rss_mb(resource.RUSAGE_SELF),
+        'peak_child_rss_mb': _max_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Print the relative change of each metric against an earlier report"""
+    print(f"\nChange against {baseline.get('commit') or 'baseline'}:")
+    for name, result in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for metric in ('throughput_rps', 'p50_ms', 'p99_ms', 'peak_rss_mb'):
+            if before.get(metric):
+                changes.append(f"{metric} {(result[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+        print(f"  {name:32} {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--only', action='append', default=[],
+                        help='run scenarios whose name contains this (repeatable)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.scenario:
+        print(json.dumps(run_scenario(options.scenario, options.iterations)))
+        return
+
+    names = [name for name in SCENARIOS if not options.only or any(part in name for part in options.only)]
+    scenarios = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=ROOT, GCP_FAKES='1', HISTORY_WRITE_MODE='sync',
+                   GCP_FAKE_STORAGE_DIR=os.path.join(workdir, 'gcs'),
+                   RESULT_CACHE_MAX_MB='0', PAGE_CACHE_MAX_MB='0',
+                   PAGE_CACHE_DIR=os.path.join(workdir, 'page-cache'))
+        env.setdefault('GOOGLE_CLOUD_PROJECT', 'benchmark')
+        env.setdefault('GOOGLE_CLOUD_STORAGE_BUCKET', 'benchmark')
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        subprocess.run([sys.executable, os.path.join(ROOT, 'migrations.py')], cwd=workdir,
+                       env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        for name in names:
+            result = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.run_benchmarks', '--scenario', name,
+                 '--iterations', str(options.iterations)],
+                cwd=workdir, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"{name}: failed\n{result.stderr}", file=sys.stderr)
+                continue
+            scenarios[name] = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{name:32} {scenarios[name]['throughput_rps']:8.2f} req/s  "
+                  f"p50 {scenarios[name]['p50_ms']:8.1f} ms  p99 {scenarios[name]['p99_ms']:8.1f} ms  "
+                  f"rss {scenarios[name]['peak_rss_mb']:7.1f} MB  errors {scenarios[name]['errors']}")
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': options.iterations,
+        'scenarios': scenarios,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""WSGI entry point that stands in a fixed-latency OCR backend.
+
+Used by ``benchmarks/inflight_capacity.py`` to measure how many blocking
+Vision calls a gunicorn configuration can keep in flight.
+"""
+import os
+import time
+from app import app
+import routes
+
+OCR_LATENCY = float(os.environ.get("BENCH_OCR_LATENCY", "0.5"))
+
+
+class SlowOCRService:
+    """OCR stand-in that blocks like a Vision API round trip"""
+
+    def extract_text(self, file_path):
+        time.sleep(OCR_LATENCY)
+        return "benchmark text", 0.99
+
+    def is_configured(self):
+        return True
+
+
+routes.ocr_service = SlowOCRService()
@@ -0,0 +1,79 @@
+"""Cold-start benchmark: time to import the app and serve its first request.
+
+Every sample runs in a fresh interpreter, like a newly scheduled worker on
+an autoscaled instance. The schema is migrated once up front, as it would
+be at deploy time.
+
+    python -m benchmarks.startup_time --runs 10 --output startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, logging, time
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+logging.disable(logging.CRITICAL)
+response = app.test_client().get(PATH)
+finished = time.perf_counter()
+print(json.dumps({
+    'status': response.status_code,
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (finished - imported) * 1000,
+    'total_ms': (finished - started) * 1000,
+}))
+"""
+
+
+def summarize(samples, field):
+    values = sorted(sample[field] for sample in samples)
+    return {
+        'min': round(values[0], 1),
+        'p50': round(statistics.median(values), 1),
+        'max': round(values[-1], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/', help='first request to serve')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        subprocess.run([sys.executable, os.path.join(ROOT, 'migrations.py')], cwd=workdir,
+                       env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        samples = []
+        for _ in range(options.runs):
+            result = subprocess.run([sys.executable, '-c', f"PATH = {options.path!r}\n" + PROBE],
+                                    cwd=workdir, env=env, check=True, capture_output=True, text=True)
+            samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    report = {
+        'runs': options.runs,
+        'path': options.path,
+        'errors': sum(1 for sample in samples if sample['status'] >= 500),
+        'import_ms': summarize(samples, 'import_ms'),
+        'first_request_ms': summarize(samples, 'first_request_ms'),
+        'total_ms': summarize(samples, 'total_ms'),
+    }
+    print(json.dumps(report, indent=2))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
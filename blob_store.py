@@ -0,0 +1,116 @@
+import os
+import logging
+from datetime import datetime
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import StoredBlob
+
+
+class BlobStore:
+    """Uploads stored once per content hash, with reference counts.
+
+    Each distinct upload is kept once, in the uploads area under
+    ``<sha256><ext>``, and recorded in the ``blobs`` table with the number of
+    history rows referencing it. Uploading the same bytes again only bumps
+    the count: the streamed copy is dropped without being moved into place
+    and, once the blob is in Cloud Storage, it is not uploaded again.
+    Releasing the last reference deletes the file locally and remotely.
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage
+
+    def init_app(self, app, storage, history_writer=None):
+        self.storage = storage
+        app.extensions['blob_store'] = self
+        if history_writer is not None:
+            history_writer.on_reject(self._history_rejected)
+
+    def _history_rejected(self, table, values):
+        # The reference taken for a history row the database never stored
+        if table == 'conversion_history' and values.get('blob_sha256'):
+            self.release(values['blob_sha256'])
+
+    @staticmethod
+    def blob_key(sha256, filename):
+        extension = os.path.splitext(filename)[1].lower()
+        return f"{sha256}{extension}"
+
+    def acquire(self, file):
+        """Reference the blob holding an uploaded file, storing it if it is new.
+
+        Returns ``(blob, created)``; ``blob`` is a row of the blobs table.
+        """
+        sha256 = self.storage.content_hash(file)
+        table = StoredBlob.__table__
+        with db.engine.begin() as conn:
+            referenced = conn.execute(
+                update(table).where(table.c.sha256 == sha256).values(refcount=table.c.refcount + 1)
+            ).rowcount
+            blob = conn.execute(select(table).where(table.c.sha256 == sha256)).first() if referenced else None
+
+        if blob is not None:
+            if self.storage.locate(blob.storage_key) is None:
+                # The file went missing behind our back; restore it from this upload
+                logging.warning(f"Blob {sha256} was missing locally, storing it again")
+                self.storage.save(file, key=blob.storage_key)
+            return blob, False
+
+        key, path = self.storage.save(file, key=self.blob_key(sha256, file.filename))
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(table).values(
+                    sha256=sha256,
+                    storage_key=key,
+                    size=os.path.getsize(path),
+                    refcount=1,
+                    published=False,
+                    created_at=datetime.utcnow(),
+                ))
+                blob = conn.execute(select(table).where(table.c.sha256 == sha256)).first()
+            return blob, True
+        except IntegrityError:
+            # Another request stored the same content first
+            return self._reference(sha256), False
+
+    def _reference(self, sha256):
+        table = StoredBlob.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.sha256 == sha256).values(refcount=table.c.refcount + 1))
+            return conn.execute(select(table).where(table.c.sha256 == sha256)).first()
+
+    def publish(self, blob):
+        """Copy a blob to Cloud Storage unless it is there already"""
+        if blob.published:
+            return False
+        self.storage.publish(blob.storage_key)
+        table = StoredBlob.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.sha256 == blob.sha256).values(published=True))
+        return True
+
+    def release(self, sha256):
+        """Drop one reference; the last one deletes the blob everywhere.
+
+        The files are deleted before the transaction commits. The UPDATE
+        holds the row lock (the database write lock on SQLite) until then,
+        so a concurrent ``acquire`` of the same content waits and stores
+        its own copy afterwards, rather than having it deleted from under a
+        fresh row at the same deterministic key.
+        """
+        table = StoredBlob.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.sha256 == sha256).values(refcount=table.c.refcount - 1))
+            blob = conn.execute(
+                select(table).where(table.c.sha256 == sha256, table.c.refcount <= 0).with_for_update()
+            ).first()
+            if blob is None:
+                return False
+            conn.execute(delete(table).where(table.c.sha256 == sha256))
+            self.storage.delete(blob.storage_key, remote=blob.published)
+        logging.info(f"Deleted unreferenced blob {sha256}")
+        return True
+
+
+blob_store = BlobStore()
@@ -0,0 +1,132 @@
+import os
+import re
+import hashlib
+import logging
+import mimetypes
+from urllib.parse import quote
+from flask import current_app, abort, redirect, request, send_file, make_response, Response, stream_with_context
+from services.cloud_storage import ChecksumMismatch
+
+# Keys produced by FileStorage.new_key start with a UUID and are never rewritten
+IMMUTABLE_KEY = re.compile(r'^[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}_', re.I)
+
+
+def is_immutable(key):
+    """Check if a storage key names an immutable, UUID-named file"""
+    return IMMUTABLE_KEY.match(key) is not None
+
+
+def file_etag(key, path):
+    """Strong ETag for a stored file, derived from its key, size and mtime"""
+    stat = os.stat(path)
+    digest = hashlib.sha1(f"{key}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+def _cache_control(response, key):
+    if is_immutable(key):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['DOWNLOAD_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def _stream_cloud_file(cloud_storage, name, download_name, mimetype):
+    """Proxy a Cloud Storage object through the worker in chunks.
+
+    Supports conditional requests and a single byte range. Full downloads
+    are checksummed as they stream, and the last chunk is only sent once the
+    checksum matches (see ``CloudStorageService.iter_chunks``). On a
+    mismatch the connection is dropped short of ``Content-Length``, so the
+    client sees a failed download rather than a corrupt file. Ranged
+    responses cannot be verified.
+    """
+    blob = cloud_storage.stat(name)
+    if blob is None:
+        abort(404)
+
+    mimetype = mimetype or blob.content_type or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    etag = f"{blob.crc32c or ''}:{blob.generation}"
+    etag = hashlib.sha1(etag.encode('utf-8')).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    start, end, status = 0, blob.size - 1, 200
+    # Multiple ranges are answered with the whole file, as are stale If-Range validators
+    byte_range = request.range
+    if_range = request.if_range
+    if if_range.date is not None or if_range.etag not in (None, etag):
+        byte_range = None
+    if byte_range is not None and len(byte_range.ranges) == 1:
+        content_range = byte_range.range_for_length(blob.size)
+        if content_range is None:
+            response = make_response('', 416)
+            response.headers['Content-Range'] = f"bytes */{blob.size}"
+            return response
+        start, end, status = content_range[0], content_range[1] - 1, 206
+
+    def chunks():
+        try:
+            yield from cloud_storage.iter_chunks(name, start=start, end=end, blob=blob)
+        except ChecksumMismatch as e:
+            logging.error(f"Aborting download of {name}: {str(e)}")
+            raise
+
+    response = Response(stream_with_context(chunks()), status=status, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Content-Length'] = str(end - start + 1)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{end}/{blob.size}"
+    response.set_etag(etag)
+    return response
+
+
+def send_stored_file(storage, key, area='processed', download_name=None, mimetype=None, remote=False):
+    """Send a stored file according to the configured ``DOWNLOAD_MODE``.
+
+    ``direct`` streams the file from the worker (with conditional and range
+    request support), ``x-sendfile`` and ``x-accel-redirect`` hand the
+    transfer off to the front-end web server. Files held in Cloud Storage
+    (``remote=True``) are redirected to a signed URL, or streamed through
+    the worker when ``CLOUD_DOWNLOAD_MODE`` is ``stream``.
+    """
+    download_name = download_name or key.split('_', 1)[-1]
+
+    if remote and storage.cloud_enabled():
+        if current_app.config['CLOUD_DOWNLOAD_MODE'] == 'stream':
+            response = _stream_cloud_file(storage.cloud_storage, storage.remote_name(key), download_name, mimetype)
+            return _cache_control(response, key)
+        url = storage.cloud_storage.get_file_url(storage.remote_name(key))
+        return redirect(url)
+
+    path = storage.locate(key, area)
+    if path is None:
+        abort(404)
+
+    mode = current_app.config['DOWNLOAD_MODE']
+    if mode == 'x-accel-redirect':
+        mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        response = make_response('')
+        response.headers['Content-Type'] = mimetype
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+        rel_path = os.path.relpath(path, storage.folders[area]).replace(os.sep, '/')
+        prefix = current_app.config['X_ACCEL_REDIRECT_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f"{prefix}/{area}/{quote(rel_path)}"
+        response.set_etag(file_etag(key, path))
+    else:
+        # send_file emits X-Sendfile itself when USE_X_SENDFILE is enabled
+        response = send_file(
+            path,
+            as_attachment=True,
+            download_name=download_name,
+            mimetype=mimetype,
+            conditional=True,
+            etag=file_etag(key, path),
+        )
+    return _cache_control(response, key)
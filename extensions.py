@@ -1,7 +1,67 @@
+import os
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def engine_options(database_uri):
+    """Connection pool settings for the configured database and worker type.
+
+    Each gthread worker can run ``GUNICORN_THREADS`` requests at once, so its
+    pool holds that many connections; sync workers only ever need one.
+    ``pool_recycle`` already retires connections before server-side idle
+    timeouts, so the extra round trip of ``pool_pre_ping`` is opt-in.
+    """
+    options = {
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 300)),
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING"),
+    }
+
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite':
+        options["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if url.database in (None, '', ':memory:'):
+            # In-memory databases use a single shared connection
+            return options
+
+    if os.environ.get("GUNICORN_WORKER_CLASS", "gthread") == "gthread":
+        default_pool_size = int(os.environ.get("GUNICORN_THREADS", 8))
+    else:
+        default_pool_size = 1
+    options["pool_size"] = int(os.environ.get("DB_POOL_SIZE", default_pool_size))
+    options["max_overflow"] = int(os.environ.get("DB_MAX_OVERFLOW", 2))
+    options["pool_timeout"] = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    return options
+
+
+@event.listens_for(Engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Use WAL journaling and a busy timeout for the default SQLite database.
+
+    WAL lets readers proceed while a request is writing, and the busy
+    timeout makes concurrent writers wait for the lock instead of failing
+    with "database is locked".
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
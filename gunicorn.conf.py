@@ -0,0 +1,39 @@
+import os
+
+# Gunicorn configuration, picked up automatically from the working directory.
+#
+# OCR and Cloud Storage requests spend most of their time waiting on the
+# network, so the default worker class is gthread: each worker process serves
+# several requests at once from a thread pool instead of one at a time.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# With preload_app the application is imported once in the master and shared
+# copy-on-write by the workers. Google clients are created lazily, and the
+# registry is cleared again after fork so no gRPC channel crosses a fork.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "").lower() in ("1", "true", "yes")
+
+
+def post_fork(server, worker):
+    from services import clients
+    clients.reset()
+
+
+def on_starting(server):
+    # Metric files of a previous run would be summed into the new one
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for name in os.listdir(multiproc_dir):
+            if name.endswith(".db"):
+                os.remove(os.path.join(multiproc_dir, name))
+
+
+def child_exit(server, worker):
+    from services import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,357 @@
+import os
+import re
+import json
+import atexit
+import base64
+import logging
+import threading
+import uuid
+from datetime import datetime
+from flask import g, has_request_context
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from extensions import db
+from services import metrics
+
+# history-<pid>-<token>-<seq>.<state>[.recovering-<pid>-<token>]; the token
+# tells a writer's own files apart from those of an earlier process that
+# happened to have the same pid
+SPOOL_NAME = re.compile(
+    r'^(history-(\d+)-([0-9a-f]+)-\d+\.(?:open|flushing))(?:\.recovering-(\d+)-([0-9a-f]+))?$')
+
+# Rows the database keeps rejecting, one JSON object per line with the error;
+# never replayed automatically
+DEAD_LETTER = 'history-dead-letter.jsonl'
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if '__datetime__' in value:
+            return datetime.fromisoformat(value['__datetime__'])
+        if '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class HistoryWriter:
+    """Write-behind buffer for history records.
+
+    In ``sync`` mode ``record()`` adds the rows to the session and commits
+    before returning, like the routes used to. In ``deferred`` mode rows are
+    appended to a local spool file and buffered in memory; a background
+    thread inserts them in bulk (one executemany per table) every
+    ``HISTORY_FLUSH_INTERVAL_MS`` or as soon as ``HISTORY_FLUSH_ROWS`` rows are
+    waiting. Spool files left behind by a crashed process are replayed by
+    the next writer that starts.
+
+    A batch that fails to insert is retried with the next flush. After
+    ``HISTORY_FLUSH_RETRIES`` failures its rows are inserted one at a time
+    and those the database still rejects (a NULL in a required column, a
+    value too long for its column) are moved to the dead-letter spool, so a
+    single bad row cannot hold back everything recorded after it.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        self._pid = None
+        self._token = None
+        self._spool = None
+        self._spool_seq = 0
+        self._flushing = []
+        self._failures = 0
+        self._unrecovered = {}
+        self._reject_callbacks = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('HISTORY_WRITE_MODE', 'deferred')
+        app.config.setdefault('HISTORY_FLUSH_INTERVAL_MS', 200)
+        app.config.setdefault('HISTORY_FLUSH_ROWS', 500)
+        app.config.setdefault('HISTORY_FLUSH_RETRIES', 3)
+        app.config.setdefault('HISTORY_SPOOL_DIR', os.path.join(app.instance_path, 'history_spool'))
+        app.config.setdefault('HISTORY_SPOOL_FSYNC', False)
+        app.extensions['history_writer'] = self
+
+    def on_reject(self, callback):
+        """Call ``callback(table, values)`` for each row moved to the dead-letter spool"""
+        self._reject_callbacks.append(callback)
+
+    @property
+    def deferred(self):
+        return self.app.config['HISTORY_WRITE_MODE'] == 'deferred'
+
+    def record(self, *instances):
+        """Persist model instances, synchronously or through the buffer"""
+        profile_id = g.get('profile_id') if has_request_context() else None
+        if profile_id:
+            for instance in instances:
+                if hasattr(instance, 'profile_id') and instance.profile_id is None:
+                    instance.profile_id = profile_id
+        
+        if not self.deferred:
+            db.session.add_all(instances)
+            with metrics.stage('db_commit'):
+                db.session.commit()
+            return
+
+        rows = [(instance.__table__.name, self._row_values(instance)) for instance in instances]
+        with self._lock:
+            self._ensure_started()
+            line = json.dumps([[table, {k: _encode(v) for k, v in values.items()}] for table, values in rows])
+            self._spool.write(line + '\n')
+            self._spool.flush()
+            if self.app.config['HISTORY_SPOOL_FSYNC']:
+                os.fsync(self._spool.fileno())
+            self._buffer.extend(rows)
+            metrics.QUEUE_DEPTH.labels(queue='history').set(len(self._buffer))
+            if len(self._buffer) >= self.app.config['HISTORY_FLUSH_ROWS']:
+                self._wakeup.set()
+
+    @staticmethod
+    def _row_values(instance):
+        """Column values of an unsaved instance, with Python-side defaults applied now"""
+        values = {}
+        for column in instance.__table__.columns:
+            value = getattr(instance, column.key)
+            if value is None and column.default is not None and not column.primary_key:
+                default = column.default
+                value = default.arg(None) if default.is_callable else default.arg
+            if value is not None:
+                values[column.key] = value
+        return values
+
+    def flush(self):
+        """Insert everything buffered so far"""
+        with self._lock:
+            if self._pid != os.getpid() or not self._buffer:
+                return 0
+            rows, self._buffer = self._buffer, []
+            metrics.QUEUE_DEPTH.labels(queue='history').set(0)
+            self._flushing.append(self._rotate_spool())
+            flushing, self._flushing = self._flushing, []
+
+        remaining = self._store(rows, self._failures + 1)
+        if not remaining:
+            self._failures = 0
+            for path in flushing:
+                os.remove(path)
+            return len(rows)
+
+        self._failures += 1
+        if len(remaining) < len(rows):
+            # Part of the batch is stored; a crash replay must not repeat it
+            self._write_spool(flushing[0], remaining)
+            for path in flushing[1:]:
+                os.remove(path)
+            flushing = flushing[:1]
+        with self._lock:
+            # Keep the spool files until their rows are actually stored
+            self._buffer[:0] = remaining
+            metrics.QUEUE_DEPTH.labels(queue='history').set(len(self._buffer))
+            self._flushing[:0] = flushing
+        return len(rows) - len(remaining)
+
+    def _store(self, rows, attempt):
+        """Insert rows, returning those still to be stored"""
+        try:
+            with self.app.app_context(), metrics.stage('db_commit'):
+                self._bulk_insert(rows)
+            return []
+        except Exception as e:
+            if attempt < self.app.config['HISTORY_FLUSH_RETRIES']:
+                logging.error(f"History insert of {len(rows)} rows failed, will retry: {str(e)}")
+                return rows
+            logging.error(f"History insert of {len(rows)} rows failed {attempt} times, "
+                          f"inserting them one by one: {str(e)}")
+
+        rejected = []
+        for index, (table, values) in enumerate(rows):
+            try:
+                with self.app.app_context():
+                    self._bulk_insert([(table, values)])
+            except OperationalError as e:
+                # The database itself is unreachable, not this row; try again later
+                logging.error(f"History database unavailable, will retry: {str(e)}")
+                self._dead_letter(rejected)
+                return rows[index:]
+            except Exception as e:
+                rejected.append((table, values, str(e)))
+        self._dead_letter(rejected)
+        return []
+
+    def _dead_letter(self, rejected):
+        if not rejected:
+            return
+        path = os.path.join(self.app.config['HISTORY_SPOOL_DIR'], DEAD_LETTER)
+        with open(path, 'a', encoding='utf-8') as f:
+            for table, values, error in rejected:
+                f.write(json.dumps({
+                    'table': table,
+                    'values': {k: _encode(v) for k, v in values.items()},
+                    'error': error,
+                    'rejected_at': datetime.utcnow().isoformat(),
+                }) + '\n')
+        logging.error(f"Moved {len(rejected)} history rows the database rejected to {path}")
+        with self.app.app_context():
+            for table, values, _ in rejected:
+                for callback in self._reject_callbacks:
+                    try:
+                        callback(table, values)
+                    except Exception as e:
+                        logging.error(f"History reject callback failed: {str(e)}")
+
+    @staticmethod
+    def _write_spool(path, rows):
+        """Replace a spool file's content with ``rows``"""
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for table, values in rows:
+                f.write(json.dumps([[table, {k: _encode(v) for k, v in values.items()}]]) + '\n')
+        os.replace(temp_path, path)
+
+    def close(self):
+        """Flush, then drop this process's spool file if nothing is left in it"""
+        self.flush()
+        with self._lock:
+            if self._pid != os.getpid() or self._buffer or self._flushing:
+                return
+            self._spool.close()
+            path = self._spool_path(self._spool_seq)
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+            self._pid = None
+
+    @staticmethod
+    def _bulk_insert(rows):
+        tables = db.metadata.tables
+        by_table = {}
+        for table, values in rows:
+            by_table.setdefault(table, []).append(values)
+        with db.engine.begin() as conn:
+            for table, batch in by_table.items():
+                # Rows may omit different nullable columns; executemany needs one shape
+                keys = set().union(*batch)
+                conn.execute(insert(tables[table]), [{key: values.get(key) for key in keys} for values in batch])
+
+    def _ensure_started(self):
+        # Called with the lock held; (re)starts the writer in a new process
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex[:8]
+        self._buffer = []
+        self._flushing = []
+        self._failures = 0
+        self._unrecovered = {}
+        self._spool_seq = 0
+        os.makedirs(self.app.config['HISTORY_SPOOL_DIR'], exist_ok=True)
+        self._open_spool()
+        threading.Thread(target=self._recover_and_run, name='history-writer', daemon=True).start()
+        atexit.register(self.close)
+
+    def _spool_path(self, seq, suffix='open'):
+        return os.path.join(self.app.config['HISTORY_SPOOL_DIR'], f'history-{self._pid}-{self._token}-{seq}.{suffix}')
+
+    def _open_spool(self):
+        self._spool = open(self._spool_path(self._spool_seq), 'a', encoding='utf-8')
+
+    def _rotate_spool(self):
+        # Called with the lock held: close the spool holding the rows being
+        # flushed and start a new one for rows recorded meanwhile
+        self._spool.close()
+        flushing = self._spool_path(self._spool_seq, 'flushing')
+        os.rename(self._spool_path(self._spool_seq), flushing)
+        self._spool_seq += 1
+        self._open_spool()
+        return flushing
+
+    def _recover_and_run(self):
+        self.recover()
+        interval = self.app.config['HISTORY_FLUSH_INTERVAL_MS'] / 1000
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self.flush()
+            # Spool files whose replay failed are retried like a failed flush
+            for path, attempt in list(self._unrecovered.items()):
+                self._replay(path, attempt + 1)
+
+    def recover(self):
+        """Replay spool files left behind by processes that are gone"""
+        spool_dir = self.app.config['HISTORY_SPOOL_DIR']
+        for name in sorted(os.listdir(spool_dir)):
+            match = SPOOL_NAME.match(name)
+            if not match:
+                continue
+            if match.group(4):
+                owner, token = int(match.group(4)), match.group(5)
+            else:
+                owner, token = int(match.group(2)), match.group(3)
+            if token == self._token or (owner != os.getpid() and _pid_alive(owner)):
+                continue
+            path = os.path.join(spool_dir, name)
+            claimed = os.path.join(spool_dir, f'{match.group(1)}.recovering-{os.getpid()}-{self._token}')
+            try:
+                # Renaming claims the file, so only one process replays it
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            self._replay(claimed, 1)
+
+    def _replay(self, path, attempt):
+        name = os.path.basename(path)
+        try:
+            rows = self._read_spool(path)
+        except OSError as e:
+            logging.error(f"Could not read history spool {name}: {str(e)}")
+            self._unrecovered.pop(path, None)
+            return
+        remaining = self._store(rows, attempt)
+        if remaining:
+            if len(remaining) < len(rows):
+                self._write_spool(path, remaining)
+            self._unrecovered[path] = attempt
+            logging.error(f"Could not recover history spool {name}, will retry")
+            return
+        os.remove(path)
+        self._unrecovered.pop(path, None)
+        logging.info(f"Recovered {len(rows)} history rows from {name}")
+
+    @staticmethod
+    def _read_spool(path):
+        rows = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    continue
+                rows.extend((table, {k: _decode(v) for k, v in values.items()}) for table, values in entries)
+        return rows
+
+
+history_writer = HistoryWriter()
@@ -1,4 +1,8 @@
 from app import app
 
 if __name__ == "__main__":
+    from extensions import db
+    from migrations import upgrade
+    with app.app_context():
+        upgrade(db.engine)
     app.run(host="0.0.0.0", port=5000, debug=True)
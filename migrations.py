@@ -0,0 +1,205 @@
+"""Versioned database schema migrations.
+
+The application never inspects or creates tables while booting. Instead the
+schema is brought up to date once per deploy by running:
+
+    python migrations.py
+
+Each migration is a function registered with ``@migration(version, description)``
+that receives an open connection; applied versions are recorded in the
+``schema_migrations`` table, so running the script again is a no-op.
+"""
+import logging
+from datetime import datetime
+import sqlalchemy as sa
+
+MIGRATIONS = []
+
+schema_migrations = sa.Table(
+    'schema_migrations', sa.MetaData(),
+    sa.Column('version', sa.Integer, primary_key=True),
+    sa.Column('description', sa.String(255), nullable=False),
+    sa.Column('applied_at', sa.DateTime, nullable=False),
+)
+
+
+def migration(version, description):
+    """Register a schema migration"""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return decorator
+
+
+def create_indexes(conn, table_name, indexes):
+    """Create named indexes (``{name: [columns]}``) that do not exist yet"""
+    table = sa.Table(table_name, sa.MetaData(), autoload_with=conn)
+    for name, columns in indexes.items():
+        sa.Index(name, *(table.c[column] for column in columns)).create(conn, checkfirst=True)
+
+
+def add_columns(conn, table_name, columns):
+    """Add nullable columns that do not exist yet"""
+    existing = {column['name'] for column in sa.inspect(conn).get_columns(table_name)}
+    preparer = conn.dialect.identifier_preparer
+    for column in columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(
+            f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {preparer.quote(column.name)} {column_type}"
+        )
+
+
+@migration(1, 'Initial schema')
+def initial_schema(conn):
+    # Snapshot of the tables as they were first deployed. Later changes get
+    # their own migration instead of editing this one.
+    metadata = sa.MetaData()
+    sa.Table(
+        'conversion_history', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('filename', sa.String(255), nullable=False),
+        sa.Column('original_filename', sa.String(255), nullable=False),
+        sa.Column('file_type', sa.String(50), nullable=False),
+        sa.Column('conversion_type', sa.String(100), nullable=False),
+        sa.Column('file_size', sa.Integer),
+        sa.Column('status', sa.String(20)),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('processed_at', sa.DateTime),
+        sa.Column('error_message', sa.Text),
+    )
+    sa.Table(
+        'extracted_text', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('filename', sa.String(255), nullable=False),
+        sa.Column('original_filename', sa.String(255), nullable=False),
+        sa.Column('extracted_text', sa.Text),
+        sa.Column('confidence_score', sa.Float),
+        sa.Column('created_at', sa.DateTime),
+    )
+    sa.Table(
+        'app_settings', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('key', sa.String(100), unique=True, nullable=False),
+        sa.Column('value', sa.String(500)),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+    )
+    # Databases created before migrations existed already have these tables
+    metadata.create_all(conn, checkfirst=True)
+
+
+@migration(2, 'Indexes for conversion history queries')
+def conversion_history_indexes(conn):
+    create_indexes(conn, 'conversion_history', {
+        'ix_conversion_history_created_at': ['created_at'],
+        'ix_conversion_history_status_created_at': ['status', 'created_at'],
+        'ix_conversion_history_type_created_at': ['conversion_type', 'created_at'],
+        'ix_conversion_history_filename': ['filename'],
+    })
+
+
+@migration(3, 'Store extracted text compressed outside the hot columns')
+def compress_extracted_text(conn):
+    from services.compression import compress_text
+
+    add_columns(conn, 'extracted_text', [
+        sa.Column('text_blob', sa.LargeBinary),
+        sa.Column('text_codec', sa.String(10)),
+        sa.Column('text_length', sa.Integer),
+    ])
+    create_indexes(conn, 'extracted_text', {'ix_extracted_text_filename': ['filename']})
+
+    table = sa.Table('extracted_text', sa.MetaData(), autoload_with=conn)
+    while True:
+        rows = conn.execute(
+            sa.select(table.c.id, table.c.extracted_text)
+            .where(table.c.extracted_text.is_not(None))
+            .limit(500)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            codec, blob = compress_text(row.extracted_text)
+            conn.execute(table.update().where(table.c.id == row.id).values(
+                text_blob=blob,
+                text_codec=codec,
+                text_length=len(row.extracted_text),
+                extracted_text=None,
+            ))
+
+
+@migration(4, 'Link conversion history to request profiles')
+def conversion_history_profile_id(conn):
+    add_columns(conn, 'conversion_history', [sa.Column('profile_id', sa.String(32))])
+
+
+@migration(5, 'Conversion result cache')
+def result_cache(conn):
+    add_columns(conn, 'conversion_history', [sa.Column('cached', sa.Boolean)])
+    metadata = sa.MetaData()
+    sa.Table(
+        'result_cache', metadata,
+        sa.Column('cache_key', sa.String(64), primary_key=True),
+        sa.Column('operation', sa.String(50), nullable=False),
+        sa.Column('storage_key', sa.String(255), nullable=False),
+        sa.Column('size', sa.BigInteger, nullable=False),
+        sa.Column('hits', sa.Integer, nullable=False),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('last_used_at', sa.DateTime, index=True),
+    )
+    metadata.create_all(conn)
+
+
+@migration(6, 'Content-addressed upload blobs')
+def upload_blobs(conn):
+    add_columns(conn, 'conversion_history', [sa.Column('blob_sha256', sa.String(64))])
+    create_indexes(conn, 'conversion_history', {'ix_conversion_history_blob_sha256': ['blob_sha256']})
+    metadata = sa.MetaData()
+    sa.Table(
+        'blobs', metadata,
+        sa.Column('sha256', sa.String(64), primary_key=True),
+        sa.Column('storage_key', sa.String(255), nullable=False),
+        sa.Column('size', sa.BigInteger, nullable=False),
+        sa.Column('refcount', sa.Integer, nullable=False),
+        sa.Column('published', sa.Boolean, nullable=False),
+        sa.Column('created_at', sa.DateTime),
+    )
+    metadata.create_all(conn)
+
+
+def applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(sa.select(schema_migrations.c.version))}
+
+
+def upgrade(engine):
+    """Apply all pending migrations, each in its own transaction"""
+    with engine.begin() as conn:
+        applied = applied_versions(conn)
+
+    pending = [entry for entry in MIGRATIONS if entry[0] not in applied]
+    for version, description, fn in pending:
+        logging.info(f"Applying migration {version}: {description}")
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version,
+                description=description,
+                applied_at=datetime.utcnow(),
+            ))
+    return [version for version, _, _ in pending]
+
+
+if __name__ == '__main__':
+    from app import app
+    from extensions import db
+
+    with app.app_context():
+        applied = upgrade(db.engine)
+    if applied:
+        print(f"Applied migrations: {', '.join(str(version) for version in applied)}")
+    else:
+        print("Database schema is up to date")
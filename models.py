@@ -1,8 +1,18 @@
 from datetime import datetime
 from extensions import db
 from sqlalchemy import func
+from services.compression import compress_text, decompress_text
 
 class ConversionHistory(db.Model):
+    # Indexes match the dashboard and listing queries: newest-first listings,
+    # today's count, and listings/counts filtered by status or conversion type
+    __table_args__ = (
+        db.Index('ix_conversion_history_created_at', 'created_at'),
+        db.Index('ix_conversion_history_status_created_at', 'status', 'created_at'),
+        db.Index('ix_conversion_history_type_created_at', 'conversion_type', 'created_at'),
+        db.Index('ix_conversion_history_filename', 'filename'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
@@ -13,18 +23,40 @@ class ConversionHistory(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed_at = db.Column(db.DateTime)
     error_message = db.Column(db.Text)
+    profile_id = db.Column(db.String(32))  # request profile, when one was taken
+    cached = db.Column(db.Boolean, default=False)  # output served from the result cache
+    blob_sha256 = db.Column(db.String(64), index=True)  # deduplicated upload this row references
     
     def __repr__(self):
         return f'<ConversionHistory {self.filename}>'
 
 class ExtractedText(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False, index=True)
     original_filename = db.Column(db.String(255), nullable=False)
-    extracted_text = db.Column(db.Text)
+    # The OCR output is stored compressed and deferred, so queries over this
+    # table only transfer it when the text itself is accessed
+    text_blob = db.deferred(db.Column(db.LargeBinary))
+    text_codec = db.Column(db.String(10))
+    text_length = db.Column(db.Integer)
+    # Uncompressed text of rows written before text_blob existed
+    extracted_text = db.deferred(db.Column(db.Text))
     confidence_score = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @property
+    def text(self):
+        """The extracted text, loaded and decompressed on access"""
+        if self.text_blob is not None:
+            return decompress_text(self.text_codec, self.text_blob)
+        return self.extracted_text
+    
+    @text.setter
+    def text(self, value):
+        self.text_codec, self.text_blob = compress_text(value)
+        self.text_length = len(value)
+        self.extracted_text = None
+    
     def __repr__(self):
         return f'<ExtractedText {self.filename}>'
 
@@ -37,3 +69,32 @@ class AppSettings(db.Model):
     
     def __repr__(self):
         return f'<AppSettings {self.key}>'
+
+class ResultCacheEntry(db.Model):
+    """A conversion output that can be served again for identical input"""
+    __tablename__ = 'result_cache'
+    
+    cache_key = db.Column(db.String(64), primary_key=True)
+    operation = db.Column(db.String(50), nullable=False)
+    storage_key = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    hits = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<ResultCacheEntry {self.operation} {self.cache_key}>'
+
+class StoredBlob(db.Model):
+    """An uploaded file stored once under its content hash"""
+    __tablename__ = 'blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    storage_key = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, default=0, nullable=False)
+    published = db.Column(db.Boolean, default=False, nullable=False)  # copied to Cloud Storage
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StoredBlob {self.sha256} refs={self.refcount}>'
@@ -0,0 +1,86 @@
+import os
+import sys
+import uuid
+import random
+import functools
+import threading
+from collections import Counter
+from flask import current_app, g, request, make_response
+
+
+class StackSampler:
+    """Sample the Python stack of one thread at a fixed interval.
+
+    Samples are aggregated as "folded" stacks (``outer;inner;leaf count``),
+    the input format of flamegraph.pl, speedscope and inferno. Time spent
+    waiting on poppler, Vision or the database shows up under the Python
+    frame that is blocked on it.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _should_profile():
+    config = current_app.config
+    token = config['PROFILE_TOKEN']
+    if token and request.headers.get('X-Profile') == token:
+        return True
+    rate = config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def profile_path(profile_id):
+    return os.path.join(current_app.config['PROFILE_DIR'], f"{profile_id}.folded")
+
+
+def profiled(view):
+    """Profile a view when requested with ``X-Profile: <PROFILE_TOKEN>`` or sampled.
+
+    The profile id is exposed as ``g.profile_id`` (and stored on history rows
+    recorded during the request) and returned in the ``X-Profile-Id`` header.
+    When profiling is off this costs two config lookups per request.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _should_profile():
+            return view(*args, **kwargs)
+
+        g.profile_id = uuid.uuid4().hex
+        sampler = StackSampler(threading.get_ident(), current_app.config['PROFILE_INTERVAL_MS'] / 1000)
+        sampler.start()
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            sampler.stop()
+            os.makedirs(current_app.config['PROFILE_DIR'], exist_ok=True)
+            with open(profile_path(g.profile_id), 'w', encoding='utf-8') as f:
+                f.write(sampler.folded())
+        response.headers['X-Profile-Id'] = g.profile_id
+        return response
+    return wrapper
@@ -0,0 +1,189 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import logging
+import functools
+import subprocess
+from datetime import datetime
+from importlib import metadata
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import ResultCacheEntry
+from services import metrics
+
+# Bump when a route changes how it produces its output
+CACHE_FORMAT = 2
+
+# Libraries whose version is part of each operation's cache key
+OPERATION_TOOLS = {
+    'compress_pdf': ['pdf2image', 'img2pdf', 'pillow', 'poppler'],
+    'merge_pdf': ['PyPDF2'],
+    'split_pdf': ['PyPDF2'],
+    'pdf_to_images': ['pdf2image', 'pillow', 'poppler'],
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _tool_version(name):
+    if name == 'poppler':
+        try:
+            result = subprocess.run(['pdftoppm', '-v'], capture_output=True, text=True, timeout=5)
+            return (result.stderr or result.stdout).strip().splitlines()[0]
+        except (OSError, IndexError, subprocess.SubprocessError):
+            return None
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _link(source, target):
+    # Outputs are never modified, so a hard link shares the bytes for free.
+    # An existing target is never written to: it may be a link to the very
+    # inode other outputs (and downloads in progress) share.
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        # Hard links unsupported here; copy, still refusing to overwrite
+        with open(source, 'rb') as src, open(target, 'xb') as dst:
+            shutil.copyfileobj(src, dst)
+
+
+class ResultCache:
+    """Reuse conversion outputs for identical inputs and parameters.
+
+    Entries are keyed on the SHA-256 of the input file(s), the operation,
+    its normalized parameters and the versions of the tools producing the
+    output. The cached output is a hard link in the processed area under
+    ``<cache key>_<name>``, and each hit gets its own hard link under a new
+    storage key, so evicting an entry never breaks downloads of earlier
+    conversions. Entries live in the ``result_cache`` table and are evicted
+    least recently used first once their total size exceeds
+    ``RESULT_CACHE_MAX_MB``.
+    """
+
+    def __init__(self, app=None, storage=None):
+        self.app = None
+        self.storage = storage
+        if app is not None:
+            self.init_app(app, storage)
+
+    def init_app(self, app, storage):
+        self.app = app
+        self.storage = storage
+        app.config.setdefault('RESULT_CACHE_MAX_MB', 1024)
+        app.extensions['result_cache'] = self
+
+    @property
+    def max_bytes(self):
+        return self.app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(operation, input_hashes, params=None):
+        """Cache key for an operation on inputs (content hashes, in order)"""
+        tools = {name: _tool_version(name) for name in OPERATION_TOOLS.get(operation, [])}
+        description = json.dumps({
+            'format': CACHE_FORMAT,
+            'operation': operation,
+            'inputs': list(input_hashes),
+            'params': params or {},
+            'tools': tools,
+        }, sort_keys=True)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def get(self, cache_key, filename):
+        """Storage key of a fresh copy of the cached output, or None on a miss"""
+        if not self.enabled:
+            return None
+        table = ResultCacheEntry.__table__
+        with db.engine.connect() as conn:
+            entry = conn.execute(select(table).where(table.c.cache_key == cache_key)).first()
+        source = self.storage.locate(entry.storage_key, 'processed') if entry else None
+        if source is None:
+            if entry is not None:
+                self._forget(cache_key)
+            metrics.cache_lookup('results', False)
+            return None
+
+        output_key = self.storage.new_key(filename)
+        try:
+            _link(source, self.storage.path(output_key, 'processed'))
+        except FileNotFoundError:
+            # Evicted since the lookup
+            metrics.cache_lookup('results', False)
+            return None
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.cache_key == cache_key).values(
+                hits=table.c.hits + 1, last_used_at=datetime.utcnow()))
+        metrics.cache_lookup('results', True)
+        return output_key
+
+    def put(self, cache_key, operation, output_key):
+        """Add a conversion output (in the processed area) to the cache"""
+        if not self.enabled:
+            return
+        source = self.storage.locate(output_key, 'processed')
+        storage_key = f"{cache_key}_{output_key.split('_', 1)[-1]}"
+        target = self.storage.path(storage_key, 'processed')
+        try:
+            _link(source, target)
+        except FileExistsError:
+            # Another worker cached the same result meanwhile
+            return
+
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(ResultCacheEntry.__table__).values(
+                    cache_key=cache_key,
+                    operation=operation,
+                    storage_key=storage_key,
+                    size=os.path.getsize(target),
+                    hits=0,
+                    created_at=now,
+                    last_used_at=now,
+                ))
+        except IntegrityError:
+            os.remove(target)
+            return
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits its budget"""
+        table = ResultCacheEntry.__table__
+        with db.engine.connect() as conn:
+            total = conn.execute(select(func.coalesce(func.sum(table.c.size), 0))).scalar()
+            if total <= self.max_bytes:
+                return
+            entries = conn.execute(
+                select(table.c.cache_key, table.c.size).order_by(table.c.last_used_at)
+            ).all()
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            self._forget(entry.cache_key)
+            total -= entry.size
+
+    def _forget(self, cache_key):
+        table = ResultCacheEntry.__table__
+        with db.engine.begin() as conn:
+            storage_key = conn.execute(
+                select(table.c.storage_key).where(table.c.cache_key == cache_key)).scalar()
+            conn.execute(delete(table).where(table.c.cache_key == cache_key))
+        if storage_key:
+            path = self.storage.locate(storage_key, 'processed')
+            if path:
+                os.remove(path)
+            logging.info(f"Evicted cached result {storage_key}")
+
+
+result_cache = ResultCache()
@@ -1,13 +1,18 @@
 import os
-import uuid
+import re
 import subprocess
 import shutil
-from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file
+from datetime import datetime, timedelta
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, Response, abort, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from app import app
 from models import ConversionHistory, ExtractedText, AppSettings
 from extensions import db
+from history_writer import history_writer
+from result_cache import result_cache
+from blob_store import blob_store
+import batch
 
 # Import services
 try:
@@ -19,22 +24,71 @@ try:
     from services.cloud_storage import CloudStorageService
 except ImportError:
     CloudStorageService = None
-from sqlalchemy import func
+from services.storage import FileStorage
+from services import pdf_tools
+from services.office import OfficePool, OfficeBusyError, OfficeUnavailableError
+from downloads import send_stored_file
+import uploads
+from services import metrics
+from profiling import profiled, profile_path
 
 # Initialize services
 ocr_service = OCRService()
 cloud_storage_service = CloudStorageService()
+storage = FileStorage(app.config['UPLOAD_FOLDER'], app.config['PROCESSED_FOLDER'], cloud_storage_service)
+office_pool = OfficePool()
+uploads.init_app(app, storage)
+result_cache.init_app(app, storage)
+blob_store.init_app(app, storage, history_writer)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'txt'}
 
+# Conversion types whose stored file is the original upload rather than an output
+UPLOAD_CONVERSION_TYPES = {'cloud_upload', 'local_upload', 'ocr_extraction'}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def cached_response(operation, cache_key, download_name, original_filename):
+    """Serve a cached conversion output and record the hit, or return None on a miss"""
+    output_key = result_cache.get(cache_key, download_name)
+    if output_key is None:
+        return None
+    
+    conversion = ConversionHistory(
+        filename=output_key,
+        original_filename=original_filename,
+        file_type='pdf',
+        conversion_type=operation,
+        file_size=os.path.getsize(storage.locate(output_key, 'processed')),
+        status='completed',
+        processed_at=datetime.utcnow(),
+        cached=True
+    )
+    history_writer.record(conversion)
+    return send_stored_file(storage, output_key, download_name=download_name)
+
+def paginate_history(query):
+    """Return one newest-first page of a ConversionHistory query.
+
+    Fetches a single extra row to tell whether an older page exists, so no
+    COUNT(*) over the whole table is needed.
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['LISTING_PAGE_SIZE']
+    rows = (query.order_by(ConversionHistory.created_at.desc())
+            .offset((page - 1) * per_page)
+            .limit(per_page + 1)
+            .all())
+    return rows[:per_page], page, len(rows) > per_page
+
 def get_stats():
     """Get conversion statistics"""
-    today = datetime.utcnow().date()
+    # Compare against a range rather than func.date() so the created_at index is used
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
     today_count = ConversionHistory.query.filter(
-        func.date(ConversionHistory.created_at) == today
+        ConversionHistory.created_at >= today,
+        ConversionHistory.created_at < today + timedelta(days=1)
     ).count()
     
     total_count = ConversionHistory.query.count()
@@ -58,6 +112,7 @@ def upload_page():
     return render_template('upload.html')
 
 @app.route('/upload', methods=['POST'])
+@profiled
 def upload_file():
     """Handle file upload to Google Cloud Storage"""
     if 'file' not in request.files:
@@ -70,69 +125,45 @@ def upload_file():
         return redirect(request.url)
     
     if file and allowed_file(file.filename):
-        # Generate unique filename
-        filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        try:
+            # Store the content once; identical uploads share one blob
+            blob, _ = blob_store.acquire(file)
+        except Exception as e:
+            flash(f'Error uploading file: {str(e)}', 'error')
+            return redirect(request.url)
         
         try:
-            # Ensure upload directory exists
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            file.save(filepath)
+            conversion = ConversionHistory(
+                filename=blob.storage_key,
+                original_filename=file.filename,
+                file_type=file.filename.rsplit('.', 1)[1].lower(),
+                conversion_type='local_upload',
+                file_size=blob.size,
+                status='completed',
+                processed_at=datetime.utcnow(),
+                blob_sha256=blob.sha256
+            )
             
-            # Upload to Google Cloud Storage
-            if cloud_storage_service.is_configured():
+            # Upload to Google Cloud Storage, unless this content is there already
+            if storage.cloud_enabled():
                 try:
-                    cloud_storage_service.upload_file(filepath, filename)
+                    blob_store.publish(blob)
+                    conversion.conversion_type = 'cloud_upload'
                     flash('File uploaded to Google Cloud Storage successfully!', 'success')
-                    
-                    # Save to database
-                    conversion = ConversionHistory(
-                        filename=filename,
-                        original_filename=file.filename,
-                        file_type=file.filename.rsplit('.', 1)[1].lower(),
-                        conversion_type='cloud_upload',
-                        file_size=os.path.getsize(filepath),
-                        status='completed',
-                        processed_at=datetime.utcnow()
-                    )
-                    db.session.add(conversion)
-                    db.session.commit()
-                    
                 except Exception as e:
                     app.logger.error(f'Cloud storage upload error: {str(e)}')
+                    metrics.BACKEND_FALLBACKS.labels(service='storage').inc()
                     flash(f'Error uploading to cloud: {str(e)}', 'error')
-                    
-                    # Save locally as fallback
-                    conversion = ConversionHistory(
-                        filename=filename,
-                        original_filename=file.filename,
-                        file_type=file.filename.rsplit('.', 1)[1].lower(),
-                        conversion_type='local_upload',
-                        file_size=os.path.getsize(filepath),
-                        status='completed',
-                        processed_at=datetime.utcnow()
-                    )
-                    db.session.add(conversion)
-                    db.session.commit()
             else:
                 flash('Google Cloud Storage not configured. File saved locally.', 'warning')
-                
-                # Save to database
-                conversion = ConversionHistory(
-                    filename=filename,
-                    original_filename=file.filename,
-                    file_type=file.filename.rsplit('.', 1)[1].lower(),
-                    conversion_type='local_upload',
-                    file_size=os.path.getsize(filepath),
-                    status='completed',
-                    processed_at=datetime.utcnow()
-                )
-                db.session.add(conversion)
-                db.session.commit()
+            
+            history_writer.record(conversion)
             
             return redirect(url_for('my_files'))
             
         except Exception as e:
+            # No history row references the blob after all
+            blob_store.release(blob.sha256)
             flash(f'Error uploading file: {str(e)}', 'error')
             return redirect(request.url)
     
@@ -145,6 +176,7 @@ def extract_text_page():
     return render_template('extract_text.html')
 
 @app.route('/extract-text', methods=['POST'])
+@profiled
 def extract_text():
     """Handle OCR text extraction"""
     if 'file' not in request.files:
@@ -157,14 +189,9 @@ def extract_text():
         return redirect(request.url)
     
     if file and file.filename.rsplit('.', 1)[1].lower() in ['png', 'jpg', 'jpeg', 'gif', 'pdf']:
-        # Generate unique filename
-        filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
         try:
-            # Ensure upload directory exists
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            file.save(filepath)
+            # Save under a unique, sharded storage key
+            filename, filepath = storage.save(file)
             
             # Extract text using OCR
             extracted_text, confidence = ocr_service.extract_text(filepath)
@@ -174,10 +201,9 @@ def extract_text():
                 text_record = ExtractedText(
                     filename=filename,
                     original_filename=file.filename,
-                    extracted_text=extracted_text,
+                    text=extracted_text,
                     confidence_score=confidence
                 )
-                db.session.add(text_record)
                 
                 # Save to conversion history
                 conversion = ConversionHistory(
@@ -189,8 +215,7 @@ def extract_text():
                     status='completed',
                     processed_at=datetime.utcnow()
                 )
-                db.session.add(conversion)
-                db.session.commit()
+                history_writer.record(text_record, conversion)
                 
                 return render_template('extract_text.html', 
                                      extracted_text=extracted_text, 
@@ -221,17 +246,15 @@ def save_text():
     try:
         # Generate filename for text file
         text_filename = f"{original_filename.rsplit('.', 1)[0]}_extracted.txt"
-        text_filepath = os.path.join(app.config['PROCESSED_FOLDER'], text_filename)
-        
-        # Ensure processed directory exists
-        os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
+        text_key = storage.new_key(text_filename)
+        text_filepath = storage.path(text_key, 'processed')
         
         # Save text to file
         with open(text_filepath, 'w', encoding='utf-8') as f:
             f.write(text_content)
         
         flash('Text saved successfully!', 'success')
-        return send_file(text_filepath, as_attachment=True, download_name=text_filename)
+        return send_stored_file(storage, text_key, download_name=text_filename, mimetype='text/plain')
         
     except Exception as e:
         app.logger.error(f'Error saving text: {str(e)}')
@@ -241,14 +264,107 @@ def save_text():
 @app.route('/my-files')
 def my_files():
     """Display user's uploaded files"""
-    files = ConversionHistory.query.order_by(ConversionHistory.created_at.desc()).all()
-    return render_template('my_files.html', files=files)
+    files, page, has_next = paginate_history(ConversionHistory.query)
+    
+    # Link cloud files straight to their signed URLs, signed in one batch
+    download_urls = {}
+    cloud_files = {file.id: storage.remote_name(file.filename) for file in files
+                   if file.conversion_type == 'cloud_upload'}
+    if cloud_files and storage.cloud_enabled() and app.config['CLOUD_DOWNLOAD_MODE'] == 'redirect':
+        try:
+            urls = cloud_storage_service.get_file_urls(cloud_files.values())
+            download_urls = {file_id: urls[name] for file_id, name in cloud_files.items()}
+        except Exception as e:
+            app.logger.warning(f'Could not sign download URLs: {str(e)}')
+    
+    return render_template('my_files.html', files=files, page=page, has_next=has_next,
+                           download_urls=download_urls)
+
+@app.route('/files/<int:file_id>/download')
+def download_file(file_id):
+    """Download the stored file behind a history record"""
+    record = db.get_or_404(ConversionHistory, file_id)
+    is_upload = record.conversion_type in UPLOAD_CONVERSION_TYPES
+    return send_stored_file(
+        storage,
+        record.filename,
+        area='uploads' if is_upload else 'processed',
+        download_name=record.original_filename if is_upload else None,
+        remote=record.conversion_type == 'cloud_upload',
+    )
+
+@app.route('/files/<int:file_id>/delete', methods=['POST'])
+def delete_file(file_id):
+    """Delete a history record and its file, unless other records share the file"""
+    record = db.get_or_404(ConversionHistory, file_id)
+    ExtractedText.query.filter_by(filename=record.filename).delete()
+    db.session.delete(record)
+    db.session.commit()
+    
+    if record.blob_sha256:
+        blob_store.release(record.blob_sha256)
+    elif record.conversion_type in UPLOAD_CONVERSION_TYPES:
+        storage.delete(record.filename, 'uploads', remote=record.conversion_type == 'cloud_upload')
+    else:
+        storage.delete(record.filename, 'processed', remote=False)
+    
+    flash(f'Deleted {record.original_filename}', 'success')
+    return redirect(request.referrer or url_for('my_files'))
+
+def get_extracted_text_or_404(file_id):
+    """Return the OCR result behind a history record"""
+    record = db.get_or_404(ConversionHistory, file_id)
+    return (ExtractedText.query
+            .filter_by(filename=record.filename)
+            .order_by(ExtractedText.id.desc())
+            .first_or_404())
+
+@app.route('/files/<int:file_id>/text')
+def view_extracted_text(file_id):
+    """Display stored OCR text"""
+    text_record = get_extracted_text_or_404(file_id)
+    return render_template('extract_text.html',
+                         extracted_text=text_record.text,
+                         confidence=text_record.confidence_score or 0.0,
+                         filename=text_record.original_filename)
+
+@app.route('/files/<int:file_id>/text/download')
+def download_extracted_text(file_id):
+    """Download stored OCR text as a .txt file"""
+    text_record = get_extracted_text_or_404(file_id)
+    text_filename = f"{text_record.original_filename.rsplit('.', 1)[0]}_extracted.txt"
+    return Response(
+        text_record.text,
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename="{secure_filename(text_filename)}"'}
+    )
+
+@app.route('/profiles/<profile_id>')
+def download_profile(profile_id):
+    """Download a request profile as folded stacks for flamegraph tools"""
+    if not re.fullmatch(r'[0-9a-f]{32}', profile_id) or not os.path.isfile(profile_path(profile_id)):
+        abort(404)
+    return send_file(profile_path(profile_id), as_attachment=True,
+                     download_name=f'profile-{profile_id}.folded', mimetype='text/plain')
+
+@app.route('/files/<int:file_id>/profile')
+def download_file_profile(file_id):
+    """Download the profile taken while a history record was produced"""
+    record = db.get_or_404(ConversionHistory, file_id)
+    if not record.profile_id:
+        abort(404)
+    return download_profile(record.profile_id)
 
 @app.route('/history')
 def history():
     """Display conversion history"""
-    history_records = ConversionHistory.query.order_by(ConversionHistory.created_at.desc()).all()
-    return render_template('history.html', history=history_records)
+    status = request.args.get('status')
+    query = ConversionHistory.query
+    if status:
+        query = query.filter_by(status=status)
+    history_records, page, has_next = paginate_history(query)
+    return render_template('history.html', history=history_records, status=status,
+                           page=page, has_next=has_next)
 
 # PDF Tools Routes
 
@@ -344,6 +460,7 @@ def test_ghostscript():
         }), 500
 
 @app.route('/compress-pdf', methods=['POST'])
+@profiled
 def compress_pdf():
     """Better PDF compression using img2pdf with quality control"""
     try:
@@ -359,59 +476,45 @@ def compress_pdf():
             return jsonify({'error': 'Please upload a PDF file'}), 400
         
         try:
-            import os
-            import io
-            import tempfile
-            import img2pdf
-            from pdf2image import convert_from_bytes
-            from PIL import Image
+            download_name = f'compressed_{file.filename}'
+            cache_key = result_cache.key('compress_pdf', [storage.content_hash(file)],
+                                         {'dpi': 200, 'quality': 70})
+            cached = cached_response('compress_pdf', cache_key, download_name, file.filename)
+            if cached:
+                return cached
             
-            # Save the input file to get its size
             input_data = file.read()
             input_size = len(input_data)
             
-            # Convert PDF to images with 200 DPI (good balance between quality and size)
-            images = convert_from_bytes(
-                input_data,
-                dpi=200,
-                fmt='jpeg',
-                jpegopt={
-                    'quality': 70,  # Adjust quality (1-100, lower = smaller file)
-                    'progressive': True,
-                    'optimize': True
-                }
-            )
-            
-            # Convert images back to PDF with img2pdf
-            output = io.BytesIO()
-            
-            # Convert each image to PDF with compression
-            with tempfile.TemporaryDirectory() as temp_dir:
-                img_paths = []
-                for i, image in enumerate(images):
-                    img_path = os.path.join(temp_dir, f'page_{i}.jpg')
-                    # Save with quality setting
-                    image.save(img_path, 'JPEG', quality=70, optimize=True, progressive=True)
-                    img_paths.append(img_path)
-                
-                # Convert all images to a single PDF
-                pdf_bytes = img2pdf.convert(img_paths)
-                output.write(pdf_bytes)
+            # Re-encode pages as JPEGs at 200 DPI (good balance between quality and size)
+            document = pdf_tools.Document(file.filename, pdf=input_data)
+            compressed, = pdf_tools.compress([document], dpi=200, quality=70)
+            output = compressed.pdf_bytes()
             
             # Get output size and calculate compression ratio
-            output_size = output.getbuffer().nbytes
+            output_size = len(output)
             ratio = (1 - (output_size / input_size)) * 100
             
             app.logger.info(f"PDF compressed: {input_size} -> {output_size} bytes ({ratio:.1f}% reduction)")
             
-            # Prepare the response
-            output.seek(0)
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f'compressed_{file.filename}',
-                mimetype='application/pdf'
+            # Store the output so identical requests can be served from the cache
+            output_key = storage.new_key(download_name)
+            with open(storage.path(output_key, 'processed'), 'wb') as f:
+                f.write(output)
+            result_cache.put(cache_key, 'compress_pdf', output_key)
+            
+            conversion = ConversionHistory(
+                filename=output_key,
+                original_filename=file.filename,
+                file_type='pdf',
+                conversion_type='compress_pdf',
+                file_size=output_size,
+                status='completed',
+                processed_at=datetime.utcnow()
             )
+            history_writer.record(conversion)
+            
+            return send_stored_file(storage, output_key, download_name=download_name)
             
         except ImportError as e:
             app.logger.error(f"Import error: {str(e)}")
@@ -427,6 +530,8 @@ def compress_pdf():
                 'details': str(e)
             }), 500
     
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         return jsonify({
@@ -445,35 +550,38 @@ def images_to_pdf_page():
     return render_template('pdf_tools/images_to_pdf.html')
 
 @app.route('/merge-pdf', methods=['POST'])
+@profiled
 def merge_pdf():
     """Handle PDF merging"""
-    from PyPDF2 import PdfMerger
-    
     files = request.files.getlist('files')
     if not files or len(files) < 2:
         flash('Please select at least 2 PDF files to merge', 'error')
         return redirect(request.url)
     
     try:
-        merger = PdfMerger()
+        pdfs = [file for file in files if file and file.filename.lower().endswith('.pdf')]
+        cache_key = result_cache.key('merge_pdf', [storage.content_hash(file) for file in pdfs])
+        cached = cached_response('merge_pdf', cache_key, 'merged.pdf', 'merged_pdf')
+        if cached:
+            flash('PDFs merged successfully!', 'success')
+            return cached
+        
+        documents = []
         temp_files = []
         
         # Save uploaded files temporarily
-        for file in files:
-            if file and file.filename.lower().endswith('.pdf'):
-                filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                merger.append(filepath)
-                temp_files.append(filepath)
+        for file in pdfs:
+            filename, filepath = storage.save(file)
+            documents.append(pdf_tools.Document.open(filepath, file.filename))
+            temp_files.append(filepath)
         
         # Create merged PDF
-        merged_filename = f"merged_{uuid.uuid4().hex[:8]}.pdf"
-        merged_path = os.path.join(app.config['PROCESSED_FOLDER'], merged_filename)
-        
-        os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
-        merger.write(merged_path)
-        merger.close()
+        merged, = pdf_tools.merge(documents)
+        merged_filename = storage.new_key('merged.pdf')
+        merged_path = storage.path(merged_filename, 'processed')
+        with open(merged_path, 'wb') as merged_file:
+            merged_file.write(merged.pdf_bytes())
+        result_cache.put(cache_key, 'merge_pdf', merged_filename)
         
         # Clean up temp files
         for temp_file in temp_files:
@@ -489,11 +597,10 @@ def merge_pdf():
             status='completed',
             processed_at=datetime.utcnow()
         )
-        db.session.add(conversion)
-        db.session.commit()
+        history_writer.record(conversion)
         
         flash('PDFs merged successfully!', 'success')
-        return send_file(merged_path, as_attachment=True, download_name='merged.pdf')
+        return send_stored_file(storage, merged_filename, download_name='merged.pdf')
         
     except Exception as e:
         app.logger.error(f'PDF merge error: {str(e)}')
@@ -501,11 +608,9 @@ def merge_pdf():
         return redirect(request.url)
 
 @app.route('/split-pdf', methods=['POST'])
+@profiled
 def split_pdf():
     """Handle PDF splitting"""
-    from PyPDF2 import PdfReader, PdfWriter
-    import zipfile
-    
     if 'file' not in request.files:
         flash('No PDF file selected', 'error')
         return redirect(request.url)
@@ -516,41 +621,24 @@ def split_pdf():
         return redirect(request.url)
     
     try:
-        # Save uploaded file
-        filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Split PDF
-        reader = PdfReader(filepath)
-        output_dir = os.path.join(app.config['PROCESSED_FOLDER'], f"split_{uuid.uuid4().hex[:8]}")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        page_files = []
-        for page_num in range(len(reader.pages)):
-            writer = PdfWriter()
-            writer.add_page(reader.pages[page_num])
-            
-            page_filename = f"page_{page_num + 1}.pdf"
-            page_path = os.path.join(output_dir, page_filename)
-            
-            with open(page_path, 'wb') as output_file:
-                writer.write(output_file)
-            page_files.append(page_path)
+        cache_key = result_cache.key('split_pdf', [storage.content_hash(file)])
+        cached = cached_response('split_pdf', cache_key, 'split_pages.zip', file.filename)
+        if cached:
+            flash('PDF split successfully!', 'success')
+            return cached
         
-        # Create zip file
-        zip_filename = f"split_pages_{uuid.uuid4().hex[:8]}.zip"
-        zip_path = os.path.join(app.config['PROCESSED_FOLDER'], zip_filename)
+        # Save uploaded file
+        filename, filepath = storage.save(file)
         
-        with zipfile.ZipFile(zip_path, 'w') as zip_file:
-            for page_file in page_files:
-                zip_file.write(page_file, os.path.basename(page_file))
+        # Split PDF into one file per page, zipped
+        pages = pdf_tools.split([pdf_tools.Document.open(filepath, file.filename)])
+        zip_filename = storage.new_key('split_pages.zip')
+        zip_path = storage.path(zip_filename, 'processed')
+        pdf_tools.write_archive(pages, zip_path)
+        result_cache.put(cache_key, 'split_pdf', zip_filename)
         
         # Clean up
         os.remove(filepath)
-        for page_file in page_files:
-            os.remove(page_file)
-        os.rmdir(output_dir)
         
         # Save to database
         conversion = ConversionHistory(
@@ -562,11 +650,10 @@ def split_pdf():
             status='completed',
             processed_at=datetime.utcnow()
         )
-        db.session.add(conversion)
-        db.session.commit()
+        history_writer.record(conversion)
         
         flash('PDF split successfully!', 'success')
-        return send_file(zip_path, as_attachment=True, download_name='split_pages.zip')
+        return send_stored_file(storage, zip_filename, download_name='split_pages.zip')
         
     except Exception as e:
         app.logger.error(f'PDF split error: {str(e)}')
@@ -574,11 +661,9 @@ def split_pdf():
         return redirect(request.url)
 
 @app.route('/pdf-to-images', methods=['POST'])
+@profiled
 def pdf_to_images():
     """Convert PDF pages to images"""
-    import pdf2image
-    import zipfile
-    
     if 'file' not in request.files:
         flash('No PDF file selected', 'error')
         return redirect(request.url)
@@ -589,36 +674,24 @@ def pdf_to_images():
         return redirect(request.url)
     
     try:
+        cache_key = result_cache.key('pdf_to_images', [storage.content_hash(file)], {'dpi': 200, 'format': 'png'})
+        cached = cached_response('pdf_to_images', cache_key, 'pdf_images.zip', file.filename)
+        if cached:
+            flash('PDF converted to images successfully!', 'success')
+            return cached
+        
         # Save uploaded file
-        filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Convert PDF to images
-        images = pdf2image.convert_from_path(filepath)
-        output_dir = os.path.join(app.config['PROCESSED_FOLDER'], f"images_{uuid.uuid4().hex[:8]}")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        image_files = []
-        for i, image in enumerate(images):
-            image_filename = f"page_{i + 1}.png"
-            image_path = os.path.join(output_dir, image_filename)
-            image.save(image_path, 'PNG')
-            image_files.append(image_path)
-        
-        # Create zip file
-        zip_filename = f"pdf_images_{uuid.uuid4().hex[:8]}.zip"
-        zip_path = os.path.join(app.config['PROCESSED_FOLDER'], zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w') as zip_file:
-            for image_file in image_files:
-                zip_file.write(image_file, os.path.basename(image_file))
+        filename, filepath = storage.save(file)
+        
+        # Convert PDF pages to PNGs, zipped
+        images = pdf_tools.rasterize([pdf_tools.Document.open(filepath, file.filename)], dpi=200)
+        zip_filename = storage.new_key('pdf_images.zip')
+        zip_path = storage.path(zip_filename, 'processed')
+        pdf_tools.write_archive(images, zip_path)
+        result_cache.put(cache_key, 'pdf_to_images', zip_filename)
         
         # Clean up
         os.remove(filepath)
-        for image_file in image_files:
-            os.remove(image_file)
-        os.rmdir(output_dir)
         
         # Save to database
         conversion = ConversionHistory(
@@ -630,11 +703,10 @@ def pdf_to_images():
             status='completed',
             processed_at=datetime.utcnow()
         )
-        db.session.add(conversion)
-        db.session.commit()
+        history_writer.record(conversion)
         
         flash('PDF converted to images successfully!', 'success')
-        return send_file(zip_path, as_attachment=True, download_name='pdf_images.zip')
+        return send_stored_file(storage, zip_filename, download_name='pdf_images.zip')
         
     except Exception as e:
         app.logger.error(f'PDF to images error: {str(e)}')
@@ -642,10 +714,9 @@ def pdf_to_images():
         return redirect(request.url)
 
 @app.route('/images-to-pdf', methods=['POST'])
+@profiled
 def images_to_pdf():
     """Convert images to PDF"""
-    from PIL import Image
-    
     files = request.files.getlist('files')
     if not files:
         flash('Please select image files', 'error')
@@ -656,16 +727,9 @@ def images_to_pdf():
         temp_files = []
         
         for file in files:
-            if file and file.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                
-                # Open and convert image
-                image = Image.open(filepath)
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                images.append(image)
+            if file and file.filename.lower().endswith(pdf_tools.IMAGE_EXTENSIONS):
+                filename, filepath = storage.save(file)
+                images.append(pdf_tools.Document.open(filepath, file.filename))
                 temp_files.append(filepath)
         
         if not images:
@@ -673,11 +737,11 @@ def images_to_pdf():
             return redirect(request.url)
         
         # Create PDF
-        pdf_filename = f"images_to_pdf_{uuid.uuid4().hex[:8]}.pdf"
-        pdf_path = os.path.join(app.config['PROCESSED_FOLDER'], pdf_filename)
-        
-        os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
-        images[0].save(pdf_path, save_all=True, append_images=images[1:])
+        combined, = pdf_tools.images_to_pdf(images)
+        pdf_filename = storage.new_key('images_to_pdf.pdf')
+        pdf_path = storage.path(pdf_filename, 'processed')
+        with open(pdf_path, 'wb') as pdf_file:
+            pdf_file.write(combined.pdf_bytes())
         
         # Clean up temp files
         for temp_file in temp_files:
@@ -693,17 +757,169 @@ def images_to_pdf():
             status='completed',
             processed_at=datetime.utcnow()
         )
-        db.session.add(conversion)
-        db.session.commit()
+        history_writer.record(conversion)
         
         flash('Images converted to PDF successfully!', 'success')
-        return send_file(pdf_path, as_attachment=True, download_name='images.pdf')
+        return send_stored_file(storage, pdf_filename, download_name='images.pdf')
         
     except Exception as e:
         app.logger.error(f'Images to PDF error: {str(e)}')
         flash(f'Error converting images to PDF: {str(e)}', 'error')
         return redirect(request.url)
 
+@app.route('/api/pipeline', methods=['POST'])
+@profiled
+def run_pipeline():
+    """Run a chain of PDF operations over the uploaded files as one job.
+
+    ``operations`` is a JSON list such as ``[{"op": "merge"}, {"op":
+    "compress", "dpi": 150}, {"op": "split", "pages_per_file": 10}]``; see
+    ``services.pdf_tools.STAGES`` for the available operations.
+    """
+    import json
+    
+    files = [file for file in request.files.getlist('files') if file and file.filename]
+    if not files:
+        return jsonify({'error': 'No files selected'}), 400
+    if any(not file.filename.lower().endswith(('.pdf',) + pdf_tools.IMAGE_EXTENSIONS) for file in files):
+        return jsonify({'error': 'Only PDF and image files are supported'}), 400
+    
+    try:
+        operations = json.loads(request.form.get('operations', ''))
+        pdf_tools.validate(operations)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid operations: {str(e)}'}), 400
+    
+    original_filename = files[0].filename if len(files) == 1 else f'{len(files)} files'
+    conversion_type = 'pipeline:' + '+'.join(step['op'] if isinstance(step, dict) else step for step in operations)
+    try:
+        documents = []
+        for file in files:
+            filename, filepath = storage.save(file)
+            documents.append(pdf_tools.Document.open(filepath, file.filename))
+            os.remove(filepath)
+        
+        results = pdf_tools.run(documents, operations, ocr_service=ocr_service)
+        data, download_name, file_type = pdf_tools.deliverable(results)
+        
+        output_key = storage.new_key(download_name)
+        with open(storage.path(output_key, 'processed'), 'wb') as output_file:
+            output_file.write(data)
+        
+        conversion = ConversionHistory(
+            filename=output_key,
+            original_filename=original_filename,
+            file_type=file_type,
+            conversion_type=conversion_type[:100],
+            file_size=len(data),
+            status='completed',
+            processed_at=datetime.utcnow()
+        )
+        history_writer.record(conversion)
+        
+        return send_stored_file(storage, output_key, download_name=download_name)
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f'Pipeline error: {str(e)}', exc_info=True)
+        return jsonify({
+            'error': 'Failed to run pipeline',
+            'details': str(e)
+        }), 500
+
+@app.route('/api/batch', methods=['POST'])
+def run_batch():
+    """Apply one operation to many files and stream a ZIP of the results.
+
+    Takes ``files`` (PDFs, images or ZIPs of them) and ``operation`` (one of
+    ``batch.BATCH_OPERATIONS``). Results are added to the ZIP as the files
+    complete; the archive ends with ``summary.json``.
+    """
+    operation = request.form.get('operation')
+    if operation not in batch.BATCH_OPERATIONS:
+        return jsonify({'error': f"operation must be one of: {', '.join(batch.BATCH_OPERATIONS)}"}), 400
+    
+    files = [file for file in request.files.getlist('files') if file and file.filename]
+    try:
+        items, saved = batch.collect_items(files, storage, app.config['BATCH_MAX_FILES'],
+                                           app.config['BATCH_MAX_MEMBER_MB'] * 1024 * 1024)
+    except batch.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    if not items:
+        for path in saved:
+            os.remove(path)
+        return jsonify({'error': 'No PDF or image files found'}), 400
+    
+    output_key = storage.new_key(f'batch_{operation}.zip')
+    body = batch.stream(items, operation, ocr_service, storage, output_key,
+                        workers=app.config['BATCH_WORKERS'], cleanup=saved)
+    response = Response(stream_with_context(body), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=batch_{operation}.zip'
+    return response
+
+OFFICE_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt', 'odt'}
+
+@app.route('/convert')
+def convert_page():
+    """Office document conversion page"""
+    return render_template('convert.html')
+
+@app.route('/convert', methods=['POST'])
+@profiled
+def convert_file():
+    """Convert a document between PDF, DOCX, ODT and TXT with LibreOffice"""
+    file = request.files.get('file')
+    target_format = request.form.get('conversion_type', 'pdf')
+    if not file or file.filename == '':
+        flash('Please select a file', 'error')
+        return redirect(request.url)
+
+    source_format = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if source_format not in OFFICE_EXTENSIONS:
+        flash('Unsupported file type. Upload a DOC, DOCX, ODT, TXT or PDF file.', 'error')
+        return redirect(request.url)
+    if source_format == target_format:
+        flash(f'The file is already {target_format.upper()}', 'error')
+        return redirect(request.url)
+
+    try:
+        source_key, source_path = storage.save(file)
+        base_name = os.path.splitext(secure_filename(file.filename))[0] or 'document'
+        output_key = storage.new_key(f'{base_name}.{target_format}')
+        output_path = storage.path(output_key, 'processed')
+
+        try:
+            with metrics.stage('office_convert'):
+                office_pool.convert(source_path, output_path, target_format)
+        finally:
+            storage.delete(source_key, 'uploads', remote=False)
+
+        conversion = ConversionHistory(
+            filename=output_key,
+            original_filename=file.filename,
+            file_type=target_format,
+            conversion_type=f'{source_format}_to_{target_format}',
+            file_size=os.path.getsize(output_path),
+            status='completed',
+            processed_at=datetime.utcnow()
+        )
+        history_writer.record(conversion)
+
+        return send_stored_file(storage, output_key, download_name=f'{base_name}.{target_format}')
+
+    except OfficeUnavailableError as e:
+        app.logger.error(f'Document conversion unavailable: {str(e)}')
+        flash('Document conversion is not available on this server', 'error')
+        return redirect(request.url)
+    except OfficeBusyError:
+        flash('The converter is busy, please try again in a moment', 'error')
+        return redirect(request.url)
+    except Exception as e:
+        app.logger.error(f'Document conversion error: {str(e)}')
+        flash(f'Error converting file: {str(e)}', 'error')
+        return redirect(request.url)
+
 @app.route('/settings')
 def settings():
     """Display settings page"""
@@ -715,9 +931,22 @@ def api_stats():
     stats = get_stats()
     return jsonify(stats)
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.errorhandler(413)
 def too_large(e):
-    flash('File too large. Maximum file size is 16MB.', 'error')
+    limit_mb = uploads.upload_limit(request.endpoint) // uploads.MB
+    message = f'File too large. Maximum file size is {limit_mb}MB.'
+    if request.endpoint == 'compress_pdf':
+        return jsonify({'error': message}), 413
+    flash(message, 'error')
+    # Back to the form the file was posted from
+    if request.endpoint in app.view_functions:
+        return redirect(request.url)
     return redirect(url_for('upload_page'))
 
 @app.errorhandler(404)
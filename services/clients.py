@@ -0,0 +1,139 @@
+import os
+import logging
+import threading
+
+# Process-wide registry of Google Cloud clients.
+#
+# Clients are created lazily on first use and shared by every thread of the
+# process, so a worker boots without doing auth discovery or opening gRPC
+# channels. Channels and connection pools cannot be shared across fork(), so
+# the registry is cleared in forked children (e.g. gunicorn workers started
+# with --preload) and rebuilt there on demand.
+#
+# With GCP_FAKES=1 the registry hands out the local stand-ins from
+# services/fakes.py instead, for benchmarks and load tests;
+# GCP_VISION_ENDPOINT points the real Vision client at another endpoint
+# (such as the fake Vision server) over REST.
+
+_lock = threading.RLock()
+_clients = {}
+_failures = {}
+
+
+def _get(name, factory):
+    """Return the client registered under ``name``, creating it on first use.
+
+    A failed creation is remembered and reported as ``None`` until
+    ``reset()`` is called, so a missing credential is logged once per
+    process instead of on every request.
+    """
+    if name in _clients or name in _failures:
+        return _clients.get(name)
+
+    with _lock:
+        if name in _clients or name in _failures:
+            return _clients.get(name)
+        try:
+            client = factory()
+        except Exception as e:
+            logging.error(f"Failed to initialize {name} client: {str(e)}")
+            _failures[name] = e
+            return None
+        _clients[name] = client
+        return client
+
+
+def reset():
+    """Forget all clients so they are recreated on next use"""
+    with _lock:
+        _clients.clear()
+        _failures.clear()
+
+
+def _load_credentials():
+    from google.oauth2 import service_account
+
+    credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    if credentials_path:
+        return service_account.Credentials.from_service_account_file(
+            credentials_path,
+            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        )
+    # Let each client fall back to application default credentials
+    return None
+
+
+def credentials():
+    """Service account credentials shared by all clients, if configured"""
+    return _get('credentials', _load_credentials)
+
+
+def _create_vision_client():
+    from services import fakes
+    if fakes.enabled():
+        return fakes.FakeVisionClient()
+
+    from google.cloud import vision
+
+    endpoint = os.environ.get("GCP_VISION_ENDPOINT")
+    if endpoint:
+        # e.g. the fake Vision server from services/fakes.py
+        from google.auth.credentials import AnonymousCredentials
+        client = vision.ImageAnnotatorClient(
+            credentials=AnonymousCredentials(),
+            transport="rest",
+            client_options={"api_endpoint": endpoint},
+        )
+        logging.info(f"Google Cloud Vision API using endpoint {endpoint}")
+        return client
+
+    client = vision.ImageAnnotatorClient(credentials=credentials())
+    logging.info("Google Cloud Vision API initialized successfully")
+    return client
+
+
+def vision_client():
+    """Shared Vision client; one gRPC channel per process"""
+    return _get('vision', _create_vision_client)
+
+
+def _create_storage_client():
+    from services import fakes
+    if fakes.enabled():
+        return fakes.FakeStorageClient()
+
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    creds = credentials()
+    if creds is None:
+        creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+    # Size the HTTP connection pool to the number of threads per worker
+    pool_size = int(os.environ.get("GUNICORN_THREADS", 8))
+    session = AuthorizedSession(creds)
+    session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+    client = storage.Client(project=project_id, credentials=creds, _http=session)
+    logging.info(f"Google Cloud Storage initialized for project: {project_id}")
+    return client
+
+
+def storage_client():
+    """Shared Cloud Storage client with a pooled HTTP session"""
+    return _get('storage', _create_storage_client)
+
+
+def _reset_after_fork():
+    # The parent's lock may have been held by another thread at fork time
+    global _lock
+    _lock = threading.RLock()
+    _clients.clear()
+    _failures.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,34 +1,116 @@
 import os
+import math
+import base64
+import hashlib
+import time
 import logging
-from google.cloud import storage
-from google.oauth2 import service_account
+import itertools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from google.api_core.exceptions import NotFound
+from services import clients, metrics, resilience
+
+# Deletes per batch request; the JSON API accepts up to 100 calls per batch
+DELETE_BATCH_SIZE = 100
+
+# Bytes per ranged request when streaming objects
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ChecksumMismatch(Exception):
+    """Downloaded bytes do not match the object's stored checksum"""
+
+
+class _Checksum:
+    """Incremental CRC32C (or MD5 for objects without one) of a download"""
+    
+    def __init__(self, blob):
+        self.expected = None
+        if blob.crc32c:
+            import google_crc32c
+            self.kind, self.expected, self.hash = 'crc32c', blob.crc32c, google_crc32c.Checksum()
+        elif blob.md5_hash:
+            self.kind, self.expected, self.hash = 'md5', blob.md5_hash, hashlib.md5()
+    
+    def update(self, data):
+        if self.expected is not None:
+            self.hash.update(data)
+    
+    def verify(self, name):
+        if self.expected is None:
+            return
+        actual = base64.b64encode(self.hash.digest()).decode('ascii')
+        if actual != self.expected:
+            raise ChecksumMismatch(f"{self.kind} mismatch for {name}: expected {self.expected}, got {actual}")
+
+
+# V4 signed URLs are valid for at most 7 days
+MAX_SIGNED_URL_SECONDS = 7 * 24 * 60 * 60
+
+
+class SignedUrlCache:
+    """Signed URLs reused until close to expiry.
+    
+    Expiry times are rounded up to a multiple of ``bucket_seconds``, so every
+    request for the same object and method within one bucket gets the same
+    expiry and can share one signature. A URL handed out always stays valid
+    for at least the requested lifetime, and at most ``bucket_seconds``
+    longer, except that lifetimes reaching the 7-day limit are capped just
+    below it.
+    """
+    
+    def __init__(self, bucket_seconds=None, max_entries=None):
+        self.bucket_seconds = bucket_seconds or int(os.environ.get("SIGNED_URL_BUCKET_S", 900))
+        self.max_entries = max_entries or int(os.environ.get("SIGNED_URL_CACHE_SIZE", 10000))
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def expiry(self, lifetime):
+        """Absolute expiry shared by all requests for ``lifetime`` seconds in this bucket"""
+        now = time.time()
+        bucket = self.bucket_seconds
+        expires = math.ceil((now + lifetime) / bucket) * bucket
+        if expires > now + MAX_SIGNED_URL_SECONDS - 60:
+            # Capped at the 7-day limit: round down so the cap stays shared too
+            expires = math.floor((now + MAX_SIGNED_URL_SECONDS - 60) / bucket) * bucket
+        return datetime.fromtimestamp(expires, tz=timezone.utc)
+    
+    def get(self, name, method, expires_at):
+        with self._lock:
+            url = self._urls.get((name, method, expires_at))
+            if url is not None:
+                self._urls.move_to_end((name, method, expires_at))
+        metrics.cache_lookup('signed_urls', url is not None)
+        return url
+    
+    def put(self, name, method, expires_at, url):
+        with self._lock:
+            self._urls[(name, method, expires_at)] = url
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+
+
+signed_urls = SignedUrlCache()
+
 
 class CloudStorageService:
     def __init__(self):
         self.project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
         self.bucket_name = os.environ.get("GOOGLE_CLOUD_STORAGE_BUCKET")
-        self.client = None
-        self.bucket = None
-        
-        if self.project_id and self.bucket_name:
-            try:
-                # Initialize the client
-                credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-                if credentials_path:
-                    credentials = service_account.Credentials.from_service_account_file(credentials_path)
-                    self.client = storage.Client(credentials=credentials, project=self.project_id)
-                else:
-                    # Use default credentials
-                    self.client = storage.Client(project=self.project_id)
-                
-                self.bucket = self.client.bucket(self.bucket_name)
-                logging.info(f"Google Cloud Storage initialized for project: {self.project_id}")
-            except Exception as e:
-                logging.error(f"Failed to initialize Google Cloud Storage: {str(e)}")
-                self.client = None
-                self.bucket = None
-        else:
-            logging.warning("Google Cloud Storage not configured - missing project ID or bucket name")
+    
+    @property
+    def client(self):
+        """Shared Cloud Storage client, created on first use"""
+        if not (self.project_id and self.bucket_name):
+            return None
+        return clients.storage_client()
+    
+    @property
+    def bucket(self):
+        client = self.client
+        return client.bucket(self.bucket_name) if client else None
     
     def upload_file(self, local_file_path, remote_file_name):
         """Upload a file to Google Cloud Storage"""
@@ -37,7 +119,7 @@ class CloudStorageService:
         
         try:
             blob = self.bucket.blob(remote_file_name)
-            blob.upload_from_filename(local_file_path)
+            resilience.storage.call('upload', blob.upload_from_filename, local_file_path, retry=None)
             logging.info(f"File {local_file_path} uploaded to {remote_file_name}")
             return True
         except Exception as e:
@@ -51,13 +133,84 @@ class CloudStorageService:
         
         try:
             blob = self.bucket.blob(remote_file_name)
-            blob.download_to_filename(local_file_path)
+            resilience.storage.call('download', blob.download_to_filename, local_file_path, retry=None)
             logging.info(f"File {remote_file_name} downloaded to {local_file_path}")
             return True
         except Exception as e:
             logging.error(f"Error downloading file from Cloud Storage: {str(e)}")
             raise e
     
+    def stat(self, remote_file_name):
+        """Metadata of a stored object (size, checksums, generation), or None if missing"""
+        if not self.client or not self.bucket:
+            raise Exception("Google Cloud Storage not properly configured")
+        return resilience.storage.call('stat', self.bucket.get_blob, remote_file_name, retry=None)
+    
+    def download_bytes(self, remote_file_name, start=None, end=None, generation=None):
+        """Download an object, or the byte range ``start``..``end`` (inclusive), into memory.
+        
+        Whole-object downloads are checksummed by the client library; ranges
+        cannot be, see ``iter_chunks`` for verified streaming.
+        """
+        if not self.client or not self.bucket:
+            raise Exception("Google Cloud Storage not properly configured")
+        
+        blob = self.bucket.blob(remote_file_name)
+        ranged = start is not None or end is not None
+        with metrics.stage('gcs_download'):
+            return resilience.storage.call(
+                'download', blob.download_as_bytes, start=start, end=end,
+                if_generation_match=generation, checksum=None if ranged else 'auto', retry=None)
+    
+    def open_file(self, remote_file_name, chunk_size=CHUNK_SIZE):
+        """Seekable, read-only file object over an object, fetched ``chunk_size`` bytes at a time.
+        
+        Can be handed straight to ``PdfReader`` or anything else that reads
+        files, without a local copy.
+        """
+        blob = self.stat(remote_file_name)
+        if blob is None:
+            raise NotFound(f"No such object: {remote_file_name}")
+        return blob.open('rb', chunk_size=chunk_size, if_generation_match=blob.generation)
+    
+    def iter_chunks(self, remote_file_name, start=0, end=None, chunk_size=CHUNK_SIZE, blob=None):
+        """Yield an object (or the range ``start``..``end``, inclusive) in chunks.
+        
+        Each chunk is its own ranged request, pinned to one generation so a
+        concurrent overwrite cannot mix two versions. When the whole object
+        is read, its CRC32C (or MD5) is computed as the chunks go by, and the
+        last chunk is held back until it matches the stored one: on a
+        mismatch ``ChecksumMismatch`` is raised instead, so a consumer never
+        receives the complete body of a corrupt download.
+        """
+        blob = blob or self.stat(remote_file_name)
+        if blob is None:
+            raise NotFound(f"No such object: {remote_file_name}")
+        last = blob.size - 1 if end is None else min(end, blob.size - 1)
+        checksum = _Checksum(blob) if start == 0 and last == blob.size - 1 else None
+        
+        position = start
+        held = None
+        while position <= last:
+            chunk_end = min(position + chunk_size - 1, last)
+            data = self.download_bytes(remote_file_name, start=position, end=chunk_end,
+                                       generation=blob.generation)
+            if not data:
+                break
+            position += len(data)
+            if checksum is None:
+                yield data
+                continue
+            checksum.update(data)
+            if held is not None:
+                yield held
+            held = data
+        
+        if checksum is not None:
+            checksum.verify(remote_file_name)
+            if held is not None:
+                yield held
+    
     def delete_file(self, remote_file_name):
         """Delete a file from Google Cloud Storage"""
         if not self.client or not self.bucket:
@@ -65,41 +218,176 @@ class CloudStorageService:
         
         try:
             blob = self.bucket.blob(remote_file_name)
-            blob.delete()
+            resilience.storage.call('delete', blob.delete, retry=None)
             logging.info(f"File {remote_file_name} deleted from Cloud Storage")
             return True
         except Exception as e:
             logging.error(f"Error deleting file from Cloud Storage: {str(e)}")
             raise e
     
-    def list_files(self, prefix=None):
-        """List files in Google Cloud Storage bucket"""
+    @staticmethod
+    def _field_mask(fields):
+        """Partial-response mask for listing only the given blob fields"""
+        if not fields:
+            return None
+        return f"items({','.join(fields)}),prefixes,nextPageToken"
+    
+    def list_page(self, prefix=None, page_token=None, page_size=1000, delimiter=None,
+                  start_offset=None, end_offset=None, fields=None):
+        """Fetch one page of a listing: ``(blobs, prefixes, next_page_token)``.
+        
+        ``fields`` restricts the blob properties fetched (e.g. ``['name',
+        'size']``); ``prefixes`` holds the "directories" found when a
+        ``delimiter`` is given. Pass ``next_page_token`` back to continue.
+        """
         if not self.client or not self.bucket:
             raise Exception("Google Cloud Storage not properly configured")
         
+        def fetch(timeout):
+            iterator = self.bucket.list_blobs(
+                prefix=prefix, page_token=page_token, page_size=page_size, delimiter=delimiter,
+                start_offset=start_offset, end_offset=end_offset, fields=self._field_mask(fields),
+                timeout=timeout, retry=None)
+            page = next(iterator.pages, None)
+            if page is None:
+                return [], [], None
+            return list(page), list(page.prefixes), iterator.next_page_token
+        
         try:
-            blobs = self.bucket.list_blobs(prefix=prefix)
-            return [blob.name for blob in blobs]
+            return resilience.storage.call('list', fetch)
         except Exception as e:
             logging.error(f"Error listing files from Cloud Storage: {str(e)}")
             raise e
     
-    def get_file_url(self, remote_file_name, expiration_minutes=60):
-        """Get a signed URL for a file"""
-        if not self.client or not self.bucket:
-            raise Exception("Google Cloud Storage not properly configured")
+    def iter_blobs(self, prefix=None, page_size=1000, delimiter=None, start_offset=None,
+                   end_offset=None, fields=None, page_token=None):
+        """Yield blobs page by page; each page is its own call, with its own deadline"""
+        while True:
+            blobs, _, page_token = self.list_page(
+                prefix, page_token, page_size, delimiter, start_offset, end_offset, fields)
+            yield from blobs
+            if not page_token:
+                return
+    
+    def list_files(self, prefix=None, **kwargs):
+        """Yield the names of the files in the bucket, fetching one page at a time"""
+        for blob in self.iter_blobs(prefix, fields=['name'], **kwargs):
+            yield blob.name
+    
+    def _delete_chunk(self, names):
+        """Delete up to ``DELETE_BATCH_SIZE`` blobs: one batch request when the client supports it"""
+        result = {'deleted': 0, 'not_found': 0, 'failed': []}
+        
+        if not hasattr(self.client, 'batch'):
+            for name in names:
+                try:
+                    resilience.storage.call('delete', self.bucket.delete_blob, name, retry=None)
+                    result['deleted'] += 1
+                except NotFound:
+                    result['not_found'] += 1
+                except Exception as e:
+                    logging.error(f"Error deleting {name} from Cloud Storage: {str(e)}")
+                    result['failed'].append(name)
+            return result
+        
+        def delete_batch(timeout):
+            batch = self.client.batch(raise_exception=False)
+            with batch:
+                for name in names:
+                    self.bucket.delete_blob(name, timeout=timeout, retry=None)
+            # Per-object responses, in request order. The library keeps them
+            # only in a private attribute; refuse to guess if that changes
+            responses = batch._responses
+            if len(responses) != len(names):
+                raise RuntimeError(f"Batch delete returned {len(responses)} responses for {len(names)} requests")
+            return [response.status_code for response in responses]
         
         try:
-            blob = self.bucket.blob(remote_file_name)
-            url = blob.generate_signed_url(
-                version="v4",
-                expiration=f"{expiration_minutes}m",
-                method="GET"
-            )
-            return url
+            statuses = resilience.storage.call('batch_delete', delete_batch)
         except Exception as e:
-            logging.error(f"Error generating signed URL: {str(e)}")
-            raise e
+            logging.error(f"Error deleting {len(names)} files from Cloud Storage: {str(e)}")
+            result['failed'] = names
+            return result
+        for name, status in zip(names, statuses):
+            if 200 <= status < 300:
+                result['deleted'] += 1
+            elif status == 404:
+                result['not_found'] += 1
+            else:
+                result['failed'].append(name)
+        return result
+    
+    def delete_files(self, names, concurrency=8):
+        """Delete many blobs; ``names`` may be any iterable, e.g. ``list_files()``.
+        
+        Names are grouped into batch requests of ``DELETE_BATCH_SIZE``, with
+        at most ``concurrency`` batches in flight. Returns counts of deleted
+        and already missing objects and the names that could not be deleted.
+        """
+        if not self.client or not self.bucket:
+            raise Exception("Google Cloud Storage not properly configured")
+        
+        totals = {'deleted': 0, 'not_found': 0, 'failed': []}
+        names = iter(names)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='gcs-delete') as pool:
+            running = set()
+            while True:
+                chunk = list(itertools.islice(names, DELETE_BATCH_SIZE))
+                if not chunk:
+                    break
+                if len(running) >= concurrency * 2:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    self._add_delete_results(totals, done)
+                running.add(pool.submit(self._delete_chunk, chunk))
+            self._add_delete_results(totals, running)
+        logging.info(f"Deleted {totals['deleted']} files from Cloud Storage "
+                     f"({totals['not_found']} already gone, {len(totals['failed'])} failed)")
+        return totals
+    
+    @staticmethod
+    def _add_delete_results(totals, futures):
+        for future in futures:
+            result = future.result()
+            totals['deleted'] += result['deleted']
+            totals['not_found'] += result['not_found']
+            totals['failed'].extend(result['failed'])
+    
+    def _sign(self, remote_file_name, expires_at, method):
+        blob = self.bucket.blob(remote_file_name)
+        kwargs = {}
+        creds = clients.credentials()
+        if creds is not None:
+            # Reuse the service account key parsed once per process
+            kwargs['credentials'] = creds
+        with metrics.stage('url_signing'):
+            return blob.generate_signed_url(version="v4", expiration=expires_at, method=method, **kwargs)
+    
+    def get_file_url(self, remote_file_name, expiration_minutes=60, method="GET"):
+        """Get a signed URL for a file, valid for at least ``expiration_minutes``"""
+        return self.get_file_urls([remote_file_name], expiration_minutes, method)[remote_file_name]
+    
+    def get_file_urls(self, remote_file_names, expiration_minutes=60, method="GET"):
+        """Signed URLs for many files at once, e.g. a listing page: ``{name: url}``.
+        
+        URLs come from the process-wide signed URL cache when possible; only
+        the misses are signed.
+        """
+        if not self.client or not self.bucket:
+            raise Exception("Google Cloud Storage not properly configured")
+        
+        expires_at = signed_urls.expiry(expiration_minutes * 60)
+        urls = {}
+        for name in remote_file_names:
+            url = signed_urls.get(name, method, expires_at)
+            if url is None:
+                try:
+                    url = self._sign(name, expires_at, method)
+                except Exception as e:
+                    logging.error(f"Error generating signed URL: {str(e)}")
+                    raise e
+                signed_urls.put(name, method, expires_at, url)
+            urls[name] = url
+        return urls
     
     def is_configured(self):
         """Check if Cloud Storage is properly configured"""
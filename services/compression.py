@@ -0,0 +1,17 @@
+import zlib
+
+# Codec name stored next to compressed text, so other codecs can be added
+# later without rewriting existing rows
+ZLIB = 'zlib'
+
+
+def compress_text(text):
+    """Compress text with zlib. Returns ``(codec, data)``"""
+    return ZLIB, zlib.compress(text.encode('utf-8'), 6)
+
+
+def decompress_text(codec, data):
+    """Inverse of ``compress_text``"""
+    if codec == ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    raise ValueError(f"Unknown text codec: {codec}")
@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from urllib.parse import quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-ins for the Vision and Cloud Storage backends, used by the
+# benchmarks and load tests so OCR and cloud paths run offline.
+#
+# - With GCP_FAKES=1 the client registry returns the in-process fakes below
+#   instead of the real clients.
+# - ``python -m services.fakes vision --port 9090`` serves the Vision REST
+#   API; point the real client at it with GCP_VISION_ENDPOINT to exercise
+#   the client library and HTTP stack as well.
+#
+# Latency, jitter and failures are injected per service from the
+# environment, e.g. GCP_FAKE_VISION_LATENCY_MS=300,
+# GCP_FAKE_VISION_JITTER_MS=100, GCP_FAKE_VISION_ERROR_RATE=0.05 (likewise
+# GCP_FAKE_STORAGE_*). Failures raise ServiceUnavailable, the same error a
+# Vision or GCS outage produces. Set GCP_FAKE_SEED for a repeatable
+# sequence of delays and failures.
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit',
+         'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore']
+
+
+def enabled():
+    return os.environ.get('GCP_FAKES', '').lower() in ('1', 'true', 'yes')
+
+
+class FaultInjector:
+    """Delay and fail backend calls as configured for one service"""
+
+    def __init__(self, service, environ=None):
+        environ = os.environ if environ is None else environ
+        prefix = f"GCP_FAKE_{service.upper()}_"
+        self.service = service
+        self.latency = float(environ.get(prefix + "LATENCY_MS", 0)) / 1000
+        self.jitter = float(environ.get(prefix + "JITTER_MS", 0)) / 1000
+        self.error_rate = float(environ.get(prefix + "ERROR_RATE", 0))
+        seed = environ.get("GCP_FAKE_SEED")
+        self._random = random.Random(int(seed) if seed else None)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0
+        return max(0.0, self.latency + jitter)
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def __call__(self, method):
+        """Wait out the simulated latency, then maybe raise an injected failure"""
+        delay = self.delay()
+        if delay:
+            time.sleep(delay)
+        if self.should_fail():
+            from google.api_core.exceptions import ServiceUnavailable
+            raise ServiceUnavailable(f"Injected {self.service} failure in {method}")
+
+
+def fake_text(content, words=40):
+    """Deterministic pseudo-text derived from the image bytes"""
+    digest = hashlib.sha256(content).digest()
+    return ' '.join(WORDS[digest[i % len(digest)] % len(WORDS)] for i in range(words))
+
+
+def annotate(content, feature):
+    """Deterministic ``AnnotateImageResponse`` for TEXT_DETECTION or DOCUMENT_TEXT_DETECTION"""
+    from google.cloud import vision
+
+    text = fake_text(content)
+    if feature == 'DOCUMENT_TEXT_DETECTION':
+        words = [vision.Word(symbols=[vision.Symbol(text=char) for char in word]) for word in text.split()]
+        page = vision.Page(blocks=[vision.Block(paragraphs=[vision.Paragraph(words=words)])])
+        return vision.AnnotateImageResponse(full_text_annotation=vision.TextAnnotation(text=text, pages=[page]))
+
+    vertices = [vision.Vertex(x=0, y=0), vision.Vertex(x=100, y=0),
+                vision.Vertex(x=100, y=20), vision.Vertex(x=0, y=20)]
+    annotations = [vision.EntityAnnotation(description=text,
+                                           bounding_poly=vision.BoundingPoly(vertices=vertices))]
+    annotations += [vision.EntityAnnotation(description=word) for word in text.split()]
+    return vision.AnnotateImageResponse(text_annotations=annotations)
+
+
+class FakeVisionClient:
+    """Answers text detection requests with deterministic annotations"""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector('vision')
+
+    def text_detection(self, image, **kwargs):
+        self.faults('text_detection')
+        return annotate(image.content, 'TEXT_DETECTION')
+
+    def document_text_detection(self, image, **kwargs):
+        self.faults('document_text_detection')
+        return annotate(image.content, 'DOCUMENT_TEXT_DETECTION')
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def path(self):
+        return os.path.join(self.bucket.root, self.name)
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else None
+
+    @property
+    def generation(self):
+        return os.stat(self.path).st_mtime_ns if os.path.exists(self.path) else None
+
+    @property
+    def crc32c(self):
+        if not os.path.exists(self.path):
+            return None
+        import google_crc32c
+        checksum = google_crc32c.Checksum()
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                checksum.update(chunk)
+        return base64.b64encode(checksum.digest()).decode('ascii')
+
+    md5_hash = None
+    content_type = None
+
+    def exists(self, **kwargs):
+        return os.path.exists(self.path)
+
+    def reload(self, **kwargs):
+        if not os.path.exists(self.path):
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+    def upload_from_filename(self, filename, **kwargs):
+        self.bucket.client.faults('upload')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def download_to_filename(self, filename, **kwargs):
+        self.bucket.client.faults('download')
+        if not os.path.exists(self.path):
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        shutil.copyfile(self.path, filename)
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None, **kwargs):
+        self.bucket.client.faults('download')
+        self.reload()
+        if if_generation_match is not None and if_generation_match != self.generation:
+            from google.api_core.exceptions import PreconditionFailed
+            raise PreconditionFailed(f"Generation mismatch for {self.bucket.name}/{self.name}")
+        with open(self.path, 'rb') as f:
+            f.seek(start or 0)
+            return f.read() if end is None else f.read(max(0, end + 1 - (start or 0)))
+
+    def open(self, mode='rb', chunk_size=None, **kwargs):
+        from google.cloud.storage.fileio import BlobReader
+        if mode != 'rb':
+            raise ValueError("The fake only supports reading ('rb')")
+        return BlobReader(self, chunk_size=chunk_size, **kwargs)
+
+    def delete(self, **kwargs):
+        self.bucket.client.faults('delete')
+        if not os.path.exists(self.path):
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        os.remove(self.path)
+
+    def generate_signed_url(self, version='v4', expiration=None, method='GET', **kwargs):
+        return f"http://fake-storage.invalid/{self.bucket.name}/{quote(self.name)}?X-Goog-Expires={expiration}"
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.root = os.path.join(client.root, name)
+
+    def blob(self, name, **kwargs):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name, **kwargs):
+        blob = FakeBlob(self, name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None, **kwargs):
+        return self.client.list_blobs(self, prefix=prefix, **kwargs)
+
+    def delete_blob(self, name, **kwargs):
+        self.blob(name).delete()
+
+
+class FakeStorageClient:
+    """Keeps objects as files under GCP_FAKE_STORAGE_DIR, shared by all processes"""
+
+    def __init__(self, root=None, faults=None):
+        self.faults = faults or FaultInjector('storage')
+        self.root = root or os.environ.get('GCP_FAKE_STORAGE_DIR') or os.path.join(tempfile.gettempdir(), 'fake-gcs')
+        os.makedirs(self.root, exist_ok=True)
+        logging.info(f"Using fake Cloud Storage at {self.root}")
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket, prefix=None, delimiter=None, start_offset=None, end_offset=None,
+                   page_token=None, page_size=None, max_results=None, **kwargs):
+        if isinstance(bucket, str):
+            bucket = self.bucket(bucket)
+        self.faults('list')
+        names = []
+        for directory, _, files in os.walk(bucket.root):
+            for filename in files:
+                name = os.path.relpath(os.path.join(directory, filename), bucket.root).replace(os.sep, '/')
+                if prefix is None or name.startswith(prefix):
+                    names.append(name)
+
+        # Same ordering and paging rules as the JSON API: items and prefixes
+        # sorted together, page tokens resume after the last entry returned
+        entries = {}
+        for name in names:
+            if (start_offset and name < start_offset) or (end_offset and name >= end_offset):
+                continue
+            rest = name[len(prefix or ''):]
+            if delimiter and delimiter in rest:
+                common = (prefix or '') + rest.split(delimiter, 1)[0] + delimiter
+                entries[common] = None
+            else:
+                entries[name] = bucket.blob(name)
+        keys = [key for key in sorted(entries) if page_token is None or key > page_token]
+        if max_results is not None:
+            keys = keys[:max_results]
+        return FakeBlobIterator([(key, entries[key]) for key in keys], page_size or 1000)
+
+
+class FakePage(list):
+    """One page of blobs, with the prefixes returned alongside them"""
+
+    def __init__(self, blobs, prefixes):
+        super().__init__(blobs)
+        self.prefixes = tuple(prefixes)
+
+
+class FakeBlobIterator:
+    """Mimics the listing iterator: iterate blobs, or ``pages`` one at a time"""
+
+    def __init__(self, entries, page_size):
+        self.entries = entries
+        self.page_size = page_size
+        self.next_page_token = None
+        self.prefixes = set()
+
+    @property
+    def pages(self):
+        for start in range(0, len(self.entries), self.page_size):
+            chunk = self.entries[start:start + self.page_size]
+            more = start + self.page_size < len(self.entries)
+            self.next_page_token = chunk[-1][0] if more else None
+            prefixes = [key for key, blob in chunk if blob is None]
+            self.prefixes.update(prefixes)
+            yield FakePage([blob for _, blob in chunk if blob is not None], prefixes)
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class VisionRequestHandler(BaseHTTPRequestHandler):
+    """``POST /v1/images:annotate`` of the Vision REST API"""
+
+    faults = None
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/v1/images:annotate':
+            return self._reply(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        delay = self.faults.delay()
+        if delay:
+            time.sleep(delay)
+        if self.faults.should_fail():
+            return self._reply(503, {'error': {'code': 503, 'message': 'Injected vision failure',
+                                               'status': 'UNAVAILABLE'}})
+
+        from google.cloud import vision
+        responses = []
+        for entry in body.get('requests', []):
+            content = base64.b64decode(entry.get('image', {}).get('content', ''))
+            feature = (entry.get('features') or [{}])[0].get('type', 'TEXT_DETECTION')
+            if isinstance(feature, int):
+                # The client sends enums as integers
+                feature = vision.Feature.Type(feature).name
+            responses.append(json.loads(vision.AnnotateImageResponse.to_json(annotate(content, feature))))
+        self._reply(200, {'responses': responses})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def serve_vision(host='127.0.0.1', port=9090):
+    """Serve the fake Vision REST API until interrupted"""
+    handler = type('Handler', (VisionRequestHandler,), {'faults': FaultInjector('vision')})
+    server = ThreadingHTTPServer((host, port), handler)
+    logging.info(f"Fake Vision API listening on http://{host}:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a fake Google Cloud API over HTTP')
+    parser.add_argument('service', choices=['vision'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090)
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    serve_vision(options.host, options.port)
@@ -0,0 +1,152 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:
+    prometheus_client = None
+
+# Prometheus metrics for request latency, conversion stages and backend calls.
+#
+# Under gunicorn every worker process keeps its own counters. Set
+# PROMETHEUS_MULTIPROC_DIR to a writable, empty directory so the values are
+# shared through the prometheus_client multiprocess mode and /metrics
+# reports the sum over all workers. Without prometheus_client installed all
+# metrics are no-ops.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram(
+        'http_request_duration_seconds', 'HTTP request latency by route',
+        ['method', 'endpoint', 'status'], buckets=LATENCY_BUCKETS)
+    STAGE_LATENCY = Histogram(
+        'conversion_stage_duration_seconds', 'Time spent in each conversion stage',
+        ['stage'], buckets=LATENCY_BUCKETS)
+    TRANSFER_BYTES = Counter(
+        'http_transfer_bytes_total', 'Request and response body bytes by route',
+        ['endpoint', 'direction'])
+    QUEUE_DEPTH = Gauge(
+        'queue_depth', 'Items waiting in internal queues',
+        ['queue'], multiprocess_mode='livesum')
+    BACKEND_REQUESTS = Counter(
+        'backend_requests_total', 'Calls to external services by outcome',
+        ['service', 'method', 'outcome'])
+    BACKEND_LATENCY = Histogram(
+        'backend_request_duration_seconds', 'Latency of calls to external services',
+        ['service', 'method'], buckets=LATENCY_BUCKETS)
+    CACHE_REQUESTS = Counter(
+        'cache_requests_total', 'Cache lookups by result',
+        ['cache', 'result'])
+    BACKEND_RETRIES = Counter(
+        'backend_retries_total', 'Calls to external services that were retried',
+        ['service', 'method'])
+    BACKEND_FALLBACKS = Counter(
+        'backend_fallbacks_total', 'Work done locally because an external service was unavailable',
+        ['service'])
+    CIRCUIT_STATE = Gauge(
+        'circuit_breaker_state', 'Circuit breaker state per backend (0 closed, 1 half-open, 2 open)',
+        ['service'], multiprocess_mode='livemax')
+else:
+    REQUEST_LATENCY = STAGE_LATENCY = TRANSFER_BYTES = QUEUE_DEPTH = _NoopMetric()
+    BACKEND_REQUESTS = BACKEND_LATENCY = CACHE_REQUESTS = _NoopMetric()
+    BACKEND_RETRIES = BACKEND_FALLBACKS = CIRCUIT_STATE = _NoopMetric()
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work as a conversion stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage=name).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def backend_call(service, method):
+    """Time a call to an external service and count its outcome"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        BACKEND_REQUESTS.labels(service=service, method=method, outcome='error').inc()
+        raise
+    else:
+        BACKEND_REQUESTS.labels(service=service, method=method, outcome='success').inc()
+    finally:
+        BACKEND_LATENCY.labels(service=service, method=method).observe(time.perf_counter() - started)
+
+
+def cache_lookup(cache, hit):
+    """Count a cache hit or miss"""
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def init_app(app):
+    """Record latency and transferred bytes for every request"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.labels(
+            method=request.method, endpoint=endpoint, status=response.status_code
+        ).observe(time.perf_counter() - started)
+        if request.content_length:
+            TRANSFER_BYTES.labels(endpoint=endpoint, direction='in').inc(request.content_length)
+        if response.content_length:
+            TRANSFER_BYTES.labels(endpoint=endpoint, direction='out').inc(response.content_length)
+        return response
+
+
+def render():
+    """Return ``(body, content_type)`` for the /metrics endpoint"""
+    if prometheus_client is None:
+        return "# prometheus_client is not installed\n", "text/plain; charset=utf-8"
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop live gauges of an exited worker (gunicorn child_exit hook)"""
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        try:
+            multiprocess.mark_process_dead(pid)
+        except Exception as e:
+            logging.warning(f"Could not mark metrics of process {pid} dead: {str(e)}")
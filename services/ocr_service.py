@@ -1,29 +1,25 @@
-import os
 import io
+import os
+import shutil
 import logging
 from google.cloud import vision
-from google.oauth2 import service_account
 from PIL import Image
-import pdf2image
+from services import clients, metrics, resilience
+from services.page_cache import page_cache
 
 class OCRService:
-    def __init__(self):
-        self.client = None
-        
-        try:
-            # Initialize Google Cloud Vision client
-            credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-            if credentials_path:
-                credentials = service_account.Credentials.from_service_account_file(credentials_path)
-                self.client = vision.ImageAnnotatorClient(credentials=credentials)
-            else:
-                # Use default credentials
-                self.client = vision.ImageAnnotatorClient()
-            
-            logging.info("Google Cloud Vision API initialized successfully")
-        except Exception as e:
-            logging.error(f"Failed to initialize Google Cloud Vision API: {str(e)}")
-            self.client = None
+    @property
+    def client(self):
+        """Shared Vision client, created on first use"""
+        return clients.vision_client()
+    
+    def _annotate(self, method, image):
+        """Call a Vision annotation method, recording latency and errors"""
+        with metrics.stage('ocr_rpc'):
+            response = resilience.vision.call(method, getattr(self.client, method), image=image, retry=None)
+            if response.error.message:
+                raise Exception(f'Google Cloud Vision API error: {response.error.message}')
+        return response
     
     def extract_text(self, file_path):
         """Extract text from an image or PDF file"""
@@ -37,9 +33,60 @@ class OCRService:
             else:
                 return self._extract_text_from_image(file_path)
         except Exception as e:
+            if self._should_fall_back(e):
+                logging.warning(f"Vision unavailable, using local OCR for {file_path}: {str(e)}")
+                metrics.BACKEND_FALLBACKS.labels(service='vision').inc()
+                return self._extract_text_locally(file_path)
             logging.error(f"Error extracting text from {file_path}: {str(e)}")
             raise e
     
+    @staticmethod
+    def _should_fall_back(error):
+        """Use local OCR when Vision is down, if tesseract is installed"""
+        if os.environ.get("OCR_FALLBACK", "tesseract") != "tesseract":
+            return False
+        if not (isinstance(error, resilience.CircuitOpenError) or resilience.is_retryable(error)):
+            return False
+        try:
+            import pytesseract  # noqa: F401
+        except ImportError:
+            return False
+        return shutil.which("tesseract") is not None
+    
+    def _extract_text_locally(self, file_path):
+        """Extract text with tesseract; same output shape as the Vision path"""
+        if file_path.lower().endswith('.pdf'):
+            images = page_cache.render_path(file_path)
+        else:
+            images = [Image.open(file_path)]
+        
+        pages, confidence = self._ocr_images_locally(images)
+        if len(pages) == 1 and not file_path.lower().endswith('.pdf'):
+            return pages[0], confidence
+        full_text = "\n\n".join(f"--- Page {i+1} ---\n{text}" for i, text in enumerate(pages) if text)
+        return full_text, confidence
+    
+    def _ocr_images_locally(self, images):
+        """Per-page tesseract text and the mean word confidence"""
+        import pytesseract
+        
+        pages = []
+        confidences = []
+        for image in images:
+            with metrics.stage('local_ocr'):
+                data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+            lines = {}
+            for i, word in enumerate(data['text']):
+                confidence = float(data['conf'][i])
+                if word.strip() and confidence >= 0:
+                    line = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+                    lines.setdefault(line, []).append(word)
+                    confidences.append(confidence / 100)
+            pages.append("\n".join(" ".join(words) for words in lines.values()))
+        
+        confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        return pages, confidence
+    
     def _extract_text_from_image(self, image_path):
         """Extract text from an image file"""
         try:
@@ -50,12 +97,9 @@ class OCRService:
             image = vision.Image(content=content)
             
             # Perform text detection
-            response = self.client.text_detection(image=image)
+            response = self._annotate('text_detection', image)
             texts = response.text_annotations
             
-            if response.error.message:
-                raise Exception(f'Google Cloud Vision API error: {response.error.message}')
-            
             if texts:
                 # The first text annotation contains the entire detected text
                 extracted_text = texts[0].description
@@ -74,44 +118,67 @@ class OCRService:
         """Extract text from a PDF file by converting to images first"""
         try:
             # Convert PDF to images
-            images = pdf2image.convert_from_path(pdf_path)
+            images = page_cache.render_path(pdf_path)
             
-            all_text = []
-            total_confidence = 0.0
+            return self._extract_text_from_pages(images)
             
-            for i, image in enumerate(images):
-                # Convert PIL Image to bytes
+        except Exception as e:
+            logging.error(f"Error extracting text from PDF: {str(e)}")
+            raise e
+    
+    def extract_text_from_images(self, images):
+        """Extract text from already rendered pages (PIL images).
+        
+        Used by the PDF pipeline, which renders pages once and shares them
+        between stages. Falls back to local OCR like ``extract_text``.
+        """
+        if not self.client:
+            raise Exception("Google Cloud Vision API not properly configured")
+        
+        try:
+            return self._extract_text_from_pages(images)
+        except Exception as e:
+            if self._should_fall_back(e):
+                logging.warning(f"Vision unavailable, using local OCR for {len(images)} pages: {str(e)}")
+                metrics.BACKEND_FALLBACKS.labels(service='vision').inc()
+                pages, confidence = self._ocr_images_locally(images)
+                full_text = "\n\n".join(f"--- Page {i+1} ---\n{text}" for i, text in enumerate(pages) if text)
+                return full_text, confidence
+            logging.error(f"Error extracting text from {len(images)} pages: {str(e)}")
+            raise e
+    
+    def _extract_text_from_pages(self, images):
+        """Vision text detection on each page image"""
+        all_text = []
+        total_confidence = 0.0
+        
+        for i, image in enumerate(images):
+            # Convert PIL Image to bytes
+            with metrics.stage('encode'):
                 img_byte_arr = io.BytesIO()
                 image.save(img_byte_arr, format='PNG')
                 img_byte_arr = img_byte_arr.getvalue()
-                
-                # Create Vision API image object
-                vision_image = vision.Image(content=img_byte_arr)
-                
-                # Perform text detection
-                response = self.client.text_detection(image=vision_image)
-                texts = response.text_annotations
-                
-                if response.error.message:
-                    raise Exception(f'Google Cloud Vision API error: {response.error.message}')
-                
-                if texts:
-                    page_text = texts[0].description
-                    all_text.append(f"--- Page {i+1} ---\n{page_text}")
-                    
-                    # Calculate confidence for this page
-                    page_confidence = sum([vertex.confidence for vertex in texts[0].bounding_poly.vertices if hasattr(vertex, 'confidence')]) / len(texts[0].bounding_poly.vertices) if texts[0].bounding_poly.vertices else 0.0
-                    total_confidence += page_confidence
             
-            # Combine all text
-            full_text = "\n\n".join(all_text) if all_text else ""
-            average_confidence = total_confidence / len(images) if images else 0.0
+            # Create Vision API image object
+            vision_image = vision.Image(content=img_byte_arr)
             
-            return full_text, average_confidence
+            # Perform text detection
+            response = self._annotate('text_detection', vision_image)
+            texts = response.text_annotations
             
-        except Exception as e:
-            logging.error(f"Error extracting text from PDF: {str(e)}")
-            raise e
+            if texts:
+                page_text = texts[0].description
+                all_text.append(f"--- Page {i+1} ---\n{page_text}")
+                
+                # Calculate confidence for this page
+                page_confidence = sum([vertex.confidence for vertex in texts[0].bounding_poly.vertices if hasattr(vertex, 'confidence')]) / len(texts[0].bounding_poly.vertices) if texts[0].bounding_poly.vertices else 0.0
+                total_confidence += page_confidence
+        
+        # Combine all text
+        full_text = "\n\n".join(all_text) if all_text else ""
+        average_confidence = total_confidence / len(images) if images else 0.0
+        
+        return full_text, average_confidence
     
     def is_configured(self):
         """Check if OCR service is properly configured"""
@@ -129,12 +196,9 @@ class OCRService:
             image = vision.Image(content=content)
             
             # Perform document text detection
-            response = self.client.document_text_detection(image=image)
+            response = self._annotate('document_text_detection', image)
             document = response.full_text_annotation
             
-            if response.error.message:
-                raise Exception(f'Google Cloud Vision API error: {response.error.message}')
-            
             # Extract text with structure
             text_blocks = []
             for page in document.pages:
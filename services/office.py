@@ -0,0 +1,259 @@
+import os
+import queue
+import shutil
+import socket
+import atexit
+import logging
+import tempfile
+import threading
+import subprocess
+import time
+
+# Office document conversion on a pool of warm headless LibreOffice
+# instances.
+#
+# Starting soffice takes seconds, so each worker process keeps
+# OFFICE_POOL_SIZE instances running, each listening on its own UNO socket
+# with its own user profile. A conversion checks out an idle instance,
+# drives it over UNO (with LibreOffice's Python ``uno`` module) or, when
+# that module is not importable, through ``unoconv --connection`` against
+# the same socket. An instance is restarted after OFFICE_MAX_CONVERSIONS
+# conversions, after a failure, or when a conversion exceeds
+# OFFICE_TIMEOUT_S. When every instance is busy for OFFICE_QUEUE_TIMEOUT_S
+# the request fails with OfficeBusyError instead of queueing without bound.
+
+# Output format -> (LibreOffice export filter, filter options)
+EXPORT_FILTERS = {
+    'pdf': ('writer_pdf_Export', None),
+    'docx': ('MS Word 2007 XML', None),
+    'odt': ('writer8', None),
+    'txt': ('Text (encoded)', 'UTF8'),
+}
+
+# PDFs are opened as editable Writer documents rather than Draw drawings
+IMPORT_FILTERS = {
+    'pdf': 'writer_pdf_import',
+}
+
+
+class OfficeUnavailableError(Exception):
+    """LibreOffice is not installed or could not be started"""
+
+
+class OfficeBusyError(Exception):
+    """Every instance stayed busy longer than the queue timeout"""
+
+
+def find_soffice():
+    return shutil.which('soffice') or shutil.which('libreoffice')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _file_url(path):
+    from pathlib import Path
+    return Path(os.path.abspath(path)).as_uri()
+
+
+class OfficeInstance:
+    """One headless soffice process listening on a UNO socket"""
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.port = None
+        self.process = None
+        self.profile_dir = None
+        self.conversions = 0
+        # The conversion watchdog calls stop() from its own thread
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        return f"socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+
+    def start(self, timeout=30):
+        self.port = _free_port()
+        self.profile_dir = tempfile.mkdtemp(prefix='soffice-profile-')
+        self.conversions = 0
+        self.process = subprocess.Popen(
+            [self.binary, '--headless', '--invisible', '--nologo', '--nodefault', '--norestore',
+             '--nolockcheck', f'--accept={self.connection}',
+             f'-env:UserInstallation={_file_url(self.profile_dir)}'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    logging.info(f"LibreOffice instance ready on port {self.port}")
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise OfficeUnavailableError("LibreOffice did not start listening")
+
+    def alive(self):
+        process = self.process
+        return process is not None and process.poll() is None
+
+    def stop(self):
+        with self._lock:
+            process, self.process = self.process, None
+            profile_dir, self.profile_dir = self.profile_dir, None
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    def convert(self, source, target, fmt, timeout):
+        if _uno_available():
+            self._convert_uno(source, target, fmt, timeout)
+        else:
+            self._convert_unoconv(source, target, fmt, timeout)
+        self.conversions += 1
+
+    def _convert_uno(self, source, target, fmt, timeout):
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def props(**values):
+            result = []
+            for name, value in values.items():
+                prop = PropertyValue()
+                prop.Name, prop.Value = name, value
+                result.append(prop)
+            return tuple(result)
+
+        # A UNO call cannot be interrupted; killing the instance aborts it
+        watchdog = threading.Timer(timeout, self.stop)
+        watchdog.start()
+        try:
+            local = uno.getComponentContext()
+            resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+            context = resolver.resolve(f"uno:{self.connection}")
+            desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+
+            load_options = {'Hidden': True}
+            import_filter = IMPORT_FILTERS.get(os.path.splitext(source)[1].lower().lstrip('.'))
+            if import_filter:
+                load_options['FilterName'] = import_filter
+            document = desktop.loadComponentFromURL(_file_url(source), '_blank', 0, props(**load_options))
+            try:
+                filter_name, filter_options = EXPORT_FILTERS[fmt]
+                store_options = {'FilterName': filter_name, 'Overwrite': True}
+                if filter_options:
+                    store_options['FilterOptions'] = filter_options
+                document.storeToURL(_file_url(target), props(**store_options))
+            finally:
+                document.close(True)
+        except Exception as e:
+            if not self.alive():
+                raise TimeoutError(f"LibreOffice conversion exceeded {timeout}s") from e
+            raise
+        finally:
+            watchdog.cancel()
+
+    def _convert_unoconv(self, source, target, fmt, timeout):
+        unoconv = shutil.which('unoconv')
+        if unoconv is None:
+            raise OfficeUnavailableError("Neither the uno module nor unoconv is available")
+        _, filter_options = EXPORT_FILTERS[fmt]
+        command = [unoconv, '--connection', self.connection, '--format', fmt, '--output', target]
+        import_filter = IMPORT_FILTERS.get(os.path.splitext(source)[1].lower().lstrip('.'))
+        if import_filter:
+            command.append(f'--import-filter-name={import_filter}')
+        if filter_options:
+            command += ['-e', f'FilterOptions={filter_options}']
+        try:
+            result = subprocess.run(command + [source], capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            raise TimeoutError(f"LibreOffice conversion exceeded {timeout}s") from e
+        if result.returncode != 0 or not os.path.exists(target):
+            raise Exception(f"unoconv failed: {result.stderr.strip() or result.returncode}")
+
+
+_uno_checked = None
+
+
+def _uno_available():
+    global _uno_checked
+    if _uno_checked is None:
+        try:
+            import uno  # noqa: F401
+            _uno_checked = True
+        except ImportError:
+            _uno_checked = False
+    return _uno_checked
+
+
+class OfficePool:
+    """Warm soffice instances shared by the threads of one process"""
+
+    def __init__(self, size=None, max_conversions=None, timeout=None, queue_timeout=None):
+        cpus = os.cpu_count() or 1
+        workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+        self.size = size or int(os.environ.get('OFFICE_POOL_SIZE', max(1, cpus // workers)))
+        self.max_conversions = max_conversions or int(os.environ.get('OFFICE_MAX_CONVERSIONS', 200))
+        self.timeout = timeout or float(os.environ.get('OFFICE_TIMEOUT_S', 60))
+        self.queue_timeout = queue_timeout or float(os.environ.get('OFFICE_QUEUE_TIMEOUT_S', 30))
+        self._lock = threading.Lock()
+        self._pid = None
+        self._idle = None
+
+    def is_available(self):
+        return find_soffice() is not None
+
+    def _ensure_started(self):
+        # Instances are created lazily, and again in each forked worker
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            binary = find_soffice()
+            if binary is None:
+                raise OfficeUnavailableError("LibreOffice (soffice) is not installed")
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue()
+            for _ in range(self.size):
+                # Started on first checkout, so an idle worker costs nothing
+                self._idle.put(OfficeInstance(binary))
+            atexit.register(self.shutdown)
+
+    def convert(self, source, target, fmt):
+        """Convert ``source`` to ``target`` in format ``fmt`` (a key of EXPORT_FILTERS)"""
+        if fmt not in EXPORT_FILTERS:
+            raise ValueError(f"Unsupported output format: {fmt}")
+        self._ensure_started()
+        try:
+            instance = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise OfficeBusyError("All document converters are busy")
+
+        try:
+            if not instance.alive():
+                instance.start()
+            instance.convert(source, target, fmt, self.timeout)
+        except Exception:
+            # The instance may be wedged or half-dead; start fresh next time
+            instance.stop()
+            raise
+        finally:
+            if instance.alive() and instance.conversions >= self.max_conversions:
+                logging.info(f"Recycling LibreOffice instance after {instance.conversions} conversions")
+                instance.stop()
+            self._idle.put(instance)
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
@@ -0,0 +1,217 @@
+import io
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from PIL import Image
+from services import metrics
+
+# Rendered PDF pages shared by every consumer that rasterizes.
+#
+# Compression, PDF-to-images and OCR all render the same uploads, each at
+# its own DPI. Pages are cached on local disk under
+# ``<PAGE_CACHE_DIR>/<sha[:2]>/<sha>/p<page>_<dpi>_<mode>.<ext>``, keyed by the
+# document's SHA-256, page number, DPI, colorspace and format. Renders are
+# stored as lossless PNG, so a hit returns exactly what a miss would have.
+# Callers that re-encode the pages as JPEG anyway (compression) may ask for
+# ``lossy`` renders instead, stored as JPEG (quality 90) and much cheaper to
+# encode; those are kept apart from the PNGs and a lossy miss returns the
+# decoded JPEG, so its pixels are the same as on a later hit. The page count
+# is kept next to the renders, so a hit does not parse the PDF again. A request for a DPI
+# below one already cached is served by downsampling the larger render
+# instead of running poppler again. The directory is shared by all worker
+# processes; when it grows past PAGE_CACHE_MAX_MB the least recently used
+# renders (by modification time, refreshed on every hit) are deleted.
+
+DEFAULT_DPI = 200
+
+# PIL format, file extension and save options of lossless and lossy renders
+FORMATS = {
+    False: ('PNG', 'png', {'compress_level': 6}),
+    True: ('JPEG', 'jpg', {'quality': 90}),
+}
+
+PAGE_COUNT_FILE = 'pages'
+
+
+class PageCache:
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.environ.get('PAGE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'page-cache')
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('PAGE_CACHE_MAX_MB', 512)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _document_dir(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def _name(self, page, dpi, mode, extension):
+        return f"p{page}_{dpi}_{mode}.{extension}"
+
+    def _cached_dpis(self, sha256, mode, extension):
+        """{page: [dpi, ...]} of the renders cached for a document"""
+        try:
+            names = os.listdir(self._document_dir(sha256))
+        except FileNotFoundError:
+            return {}
+        renders = {}
+        suffix = f"_{mode}.{extension}"
+        for name in names:
+            if name.startswith('p') and name.endswith(suffix):
+                page, dpi = name[1:-len(suffix)].split('_')
+                renders.setdefault(int(page), []).append(int(dpi))
+        return renders
+
+    def _load(self, sha256, page, dpi, mode, extension):
+        path = os.path.join(self._document_dir(sha256), self._name(page, dpi, mode, extension))
+        try:
+            image = Image.open(path)
+            image.load()
+        except (FileNotFoundError, OSError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def _store(self, sha256, page, dpi, mode, extension, data):
+        directory = self._document_dir(sha256)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self._name(page, dpi, mode, extension))
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+
+    def _page_count(self, sha256, pdf):
+        """Number of pages, parsed once per document and kept with its renders"""
+        path = os.path.join(self._document_dir(sha256), PAGE_COUNT_FILE)
+        try:
+            with open(path) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            pass
+        from PyPDF2 import PdfReader
+        page_count = len(PdfReader(io.BytesIO(pdf)).pages)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(str(page_count))
+        os.replace(temp_path, path)
+        return page_count
+
+    def render(self, pdf, dpi=DEFAULT_DPI, grayscale=False, sha256=None, page_count=None, lossy=False):
+        """Pages of a PDF (bytes) as PIL images, from the cache where possible.
+
+        Pass ``page_count`` when the caller has parsed the PDF already, and
+        ``lossy`` only when the pages are going to be JPEG-encoded anyway.
+        """
+        from pdf2image import convert_from_bytes
+
+        if not self.enabled:
+            with metrics.stage('rasterize'):
+                return convert_from_bytes(pdf, dpi=dpi, grayscale=grayscale)
+
+        sha256 = sha256 or hashlib.sha256(pdf).hexdigest()
+        mode = 'L' if grayscale else 'RGB'
+        image_format, extension, save_options = FORMATS[lossy]
+        page_count = page_count or self._page_count(sha256, pdf)
+        cached = self._cached_dpis(sha256, mode, extension)
+
+        pages = [None] * page_count
+        for number in range(1, page_count + 1):
+            dpis = cached.get(number, [])
+            if dpi in dpis:
+                pages[number - 1] = self._load(sha256, number, dpi, mode, extension)
+            elif any(d > dpi for d in dpis):
+                source_dpi = min(d for d in dpis if d > dpi)
+                source = self._load(sha256, number, source_dpi, mode, extension)
+                if source is not None:
+                    scale = dpi / source_dpi
+                    size = (max(1, round(source.width * scale)), max(1, round(source.height * scale)))
+                    with metrics.stage('downsample'):
+                        pages[number - 1] = source.resize(size, Image.LANCZOS)
+            metrics.cache_lookup('pages', pages[number - 1] is not None)
+
+        # Render the missing pages in contiguous runs
+        number = 1
+        while number <= page_count:
+            if pages[number - 1] is not None:
+                number += 1
+                continue
+            last = number
+            while last < page_count and pages[last] is None:
+                last += 1
+            with metrics.stage('rasterize'):
+                rendered = convert_from_bytes(pdf, dpi=dpi, grayscale=grayscale, first_page=number, last_page=last)
+            for offset, image in enumerate(rendered):
+                buffer = io.BytesIO()
+                image.save(buffer, image_format, **save_options)
+                if lossy:
+                    image = Image.open(buffer)
+                    image.load()
+                pages[number - 1 + offset] = image
+                try:
+                    self._store(sha256, number + offset, dpi, mode, extension, buffer.getvalue())
+                except OSError as e:
+                    logging.warning(f"Could not cache rendered page: {str(e)}")
+            number = last + 1
+
+        self.evict()
+        return pages
+
+    def render_path(self, path, dpi=DEFAULT_DPI, grayscale=False):
+        """``render`` for a PDF on disk"""
+        with open(path, 'rb') as f:
+            return self.render(f.read(), dpi=dpi, grayscale=grayscale)
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(('.png', '.jpg')):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """Delete least recently used renders once the cache is over budget"""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            if self._size <= self.max_bytes:
+                return
+            # Other workers write to the same directory; count what is there
+            entries = sorted(self._entries())
+            self._size = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if self._size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+                directory = os.path.dirname(path)
+                try:
+                    if os.listdir(directory) == [PAGE_COUNT_FILE]:
+                        os.remove(os.path.join(directory, PAGE_COUNT_FILE))
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+
+
+page_cache = PageCache()
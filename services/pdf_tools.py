@@ -0,0 +1,311 @@
+import io
+import os
+import inspect
+import zipfile
+from PIL import Image
+from services import metrics
+from services.page_cache import DEFAULT_DPI, page_cache
+
+# PDF operations as composable stages.
+#
+# A stage takes a list of ``Document`` objects and returns a new list, so
+# operations chain without touching the disk: ``run(documents, [{'op':
+# 'merge'}, {'op': 'compress', 'dpi': 150}, {'op': 'split'}])``. A document
+# holds whichever representations have been produced so far -- PDF bytes,
+# the parsed reader, rendered pages at a given DPI, OCR text -- and derives
+# the others on demand, once. Rasterizing for ``compress`` and then running
+# ``ocr`` renders the pages a single time; ``split`` after ``rasterize``
+# hands each chunk its slice of the already rendered pages, and renders are
+# shared across requests through ``services.page_cache``. The single-tool
+# routes call the same stages.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# What a document is delivered as when it leaves the pipeline
+PDF = 'pdf'
+IMAGES = 'images'
+TEXT = 'text'
+
+
+class Document:
+    """A PDF or a sequence of page images flowing between stages"""
+
+    def __init__(self, name, pdf=None, pages=None, dpi=None, kind=PDF):
+        self.name = name
+        self.kind = kind
+        self.text = None
+        self._pdf = pdf
+        self._reader = None
+        self._pages = pages
+        self._dpi = dpi
+
+    @classmethod
+    def open(cls, path, name=None):
+        """Load a PDF or image file"""
+        name = name or os.path.basename(path)
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            image = Image.open(path)
+            image.load()
+            return cls(name, pages=[image], kind=IMAGES)
+        with open(path, 'rb') as f:
+            return cls(name, pdf=f.read())
+
+    @classmethod
+    def from_bytes(cls, name, data):
+        """Load a PDF or image already in memory (a ZIP member, a Cloud Storage object)"""
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            return cls(name, pages=[image], kind=IMAGES)
+        return cls(name, pdf=data)
+
+    @property
+    def dpi(self):
+        """Resolution of the rendered pages, None for images loaded as-is"""
+        return self._dpi
+
+    @property
+    def stem(self):
+        return os.path.splitext(self.name)[0]
+
+    def pdf_bytes(self):
+        """The document as PDF, encoding its page images if it has no PDF yet"""
+        if self._pdf is None:
+            pages = [page if page.mode == 'RGB' else page.convert('RGB') for page in self._pages]
+            buffer = io.BytesIO()
+            with metrics.stage('encode'):
+                pages[0].save(buffer, 'PDF', save_all=True, append_images=pages[1:],
+                              resolution=float(self._dpi or 72))
+            self._pdf = buffer.getvalue()
+        return self._pdf
+
+    def reader(self):
+        """Parsed PDF, shared by every stage that needs page structure"""
+        if self._reader is None:
+            from PyPDF2 import PdfReader
+            self._reader = PdfReader(io.BytesIO(self.pdf_bytes()))
+        return self._reader
+
+    def pages(self, dpi=None, lossy=False):
+        """Page images at ``dpi``, rendered once and reused by later stages.
+
+        Without a DPI, pages rendered earlier are reused at whatever
+        resolution they have (``DEFAULT_DPI`` if none were). Documents that started as
+        images keep their pixels whatever the DPI. ``lossy`` lets the page
+        cache hand out JPEG renders, for stages that JPEG-encode the pages.
+        """
+        if self._pages is not None and (dpi is None or self._dpi is None or self._dpi == dpi):
+            return self._pages
+        dpi = dpi or DEFAULT_DPI
+        page_count = len(self._reader.pages) if self._reader is not None else None
+        self._pages = page_cache.render(self.pdf_bytes(), dpi=dpi, page_count=page_count, lossy=lossy)
+        self._dpi = dpi
+        return self._pages
+
+    def derive(self, name, pdf=None, pages=None, kind=None):
+        """New document carrying over rendered pages when they still apply"""
+        return Document(name, pdf=pdf, pages=pages, dpi=self.dpi if pages is not None else None,
+                        kind=kind or self.kind)
+
+    def cached_pages(self):
+        return self._pages
+
+
+def merge(documents):
+    """Concatenate all documents into one PDF, keeping their outlines"""
+    from PyPDF2 import PdfMerger
+    if len(documents) < 2:
+        return documents
+    merger = PdfMerger()
+    for document in documents:
+        merger.append(document.reader())
+    buffer = io.BytesIO()
+    with metrics.stage('encode'):
+        merger.write(buffer)
+    merger.close()
+
+    # Keep rendered pages when every input has them at the same DPI
+    pages = None
+    if all(d.cached_pages() is not None and d.dpi == documents[0].dpi for d in documents):
+        pages = [page for document in documents for page in document.cached_pages()]
+    merged = documents[0].derive('merged.pdf', pdf=buffer.getvalue(), pages=pages)
+    return [merged]
+
+
+def split(documents, pages_per_file=1):
+    """Split each document into chunks of ``pages_per_file`` pages"""
+    from PyPDF2 import PdfWriter
+    pages_per_file = int(pages_per_file)
+    if pages_per_file < 1:
+        raise ValueError("pages_per_file must be at least 1")
+
+    chunks = []
+    for document in documents:
+        reader = document.reader()
+        rendered = document.cached_pages()
+        count = len(reader.pages)
+        for start in range(0, count, pages_per_file):
+            end = min(start + pages_per_file, count)
+            writer = PdfWriter()
+            for page in reader.pages[start:end]:
+                writer.add_page(page)
+            buffer = io.BytesIO()
+            with metrics.stage('encode'):
+                writer.write(buffer)
+            label = f"page_{start + 1}" if end - start == 1 else f"pages_{start + 1}-{end}"
+            name = label if len(documents) == 1 else f"{document.stem}_{label}"
+            chunks.append(document.derive(f"{name}.pdf", pdf=buffer.getvalue(),
+                                          pages=rendered[start:end] if rendered is not None else None))
+    return chunks
+
+
+def compress(documents, dpi=200, quality=70):
+    """Re-encode every page as a JPEG at ``dpi`` and ``quality``"""
+    import img2pdf
+    dpi, quality = int(dpi), int(quality)
+    compressed = []
+    for document in documents:
+        pages = document.pages(dpi, lossy=True)
+        encoded = []
+        with metrics.stage('encode'):
+            for page in pages:
+                buffer = io.BytesIO()
+                page.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+                encoded.append(buffer.getvalue())
+            pdf = img2pdf.convert(encoded)
+        compressed.append(document.derive(document.name, pdf=pdf, pages=pages, kind=PDF))
+    return compressed
+
+
+def rasterize(documents, dpi=200):
+    """Render pages to images; the pipeline then delivers them as PNGs"""
+    dpi = int(dpi)
+    return [document.derive(document.name, pdf=document.pdf_bytes(), pages=document.pages(dpi), kind=IMAGES)
+            for document in documents]
+
+
+def images_to_pdf(documents):
+    """Combine the pages of all documents into one PDF made of their images"""
+    pages = [page for document in documents for page in document.pages()]
+    if not pages:
+        raise ValueError("No pages to convert")
+    combined = Document('images.pdf', pages=pages, dpi=documents[0].dpi)
+    combined.pdf_bytes()
+    return [combined]
+
+
+def ocr(documents, service, dpi=None):
+    """Attach recognized text to each document; the pipeline delivers it as text"""
+    recognized = []
+    for document in documents:
+        text, _ = service.extract_text_from_images(document.pages(int(dpi) if dpi else None))
+        result = document.derive(document.name, pdf=document._pdf, pages=document.cached_pages(), kind=TEXT)
+        result.text = text
+        recognized.append(result)
+    return recognized
+
+
+STAGES = {
+    'merge': merge,
+    'split': split,
+    'compress': compress,
+    'rasterize': rasterize,
+    'images_to_pdf': images_to_pdf,
+    'ocr': ocr,
+}
+
+# Stages that need services supplied by the caller rather than the request
+SERVICE_STAGES = {'ocr'}
+
+# Accepted range of each numeric parameter; rendering cost grows with dpi squared
+PARAM_LIMITS = {
+    'dpi': (36, 600),
+    'quality': (1, 95),
+    'pages_per_file': (1, 10000),
+}
+
+
+def _check_param(op, key, value):
+    if key not in PARAM_LIMITS:
+        return value
+    low, high = PARAM_LIMITS[key]
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{op}: {key} must be an integer")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{op}: {key} must be an integer")
+    if not low <= value <= high:
+        raise ValueError(f"{op}: {key} must be between {low} and {high}")
+    return value
+
+
+def validate(operations):
+    """Check a list of ``{'op': name, **params}`` steps before running anything"""
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations must be a non-empty list")
+    steps = []
+    for step in operations:
+        if isinstance(step, str):
+            step = {'op': step}
+        if not isinstance(step, dict) or step.get('op') not in STAGES:
+            raise ValueError(f"Unknown operation: {step!r}. Available: {', '.join(STAGES)}")
+        params = {key: _check_param(step['op'], key, value) for key, value in step.items() if key != 'op'}
+        stage = STAGES[step['op']]
+        extra = {'service': None} if step['op'] in SERVICE_STAGES else {}
+        try:
+            inspect.signature(stage).bind([], **params, **extra)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for {step['op']}: {e}")
+        steps.append((step['op'], params))
+    return steps
+
+
+def run(documents, operations, ocr_service=None):
+    """Run the operations in order over the input documents"""
+    for name, params in validate(operations):
+        if name in SERVICE_STAGES:
+            if ocr_service is None:
+                raise ValueError("OCR is not available")
+            params = dict(params, service=ocr_service)
+        documents = STAGES[name](documents, **params)
+    return documents
+
+
+def _entries(document, prefix=''):
+    """(archive name, bytes) of a document's deliverable files"""
+    if document.kind == TEXT:
+        yield f"{prefix}{document.stem}.txt", (document.text or '').encode('utf-8')
+    elif document.kind == IMAGES:
+        for number, page in enumerate(document.pages(), 1):
+            buffer = io.BytesIO()
+            page.save(buffer, 'PNG')
+            yield f"{prefix}page_{number}.png", buffer.getvalue()
+    else:
+        yield f"{prefix}{document.name}", document.pdf_bytes()
+
+
+def output_files(documents, per_document_folders=None):
+    """(archive name, bytes) of every file the documents are delivered as"""
+    if per_document_folders is None:
+        per_document_folders = len(documents) > 1 and any(d.kind == IMAGES for d in documents)
+    for document in documents:
+        prefix = f"{document.stem}/" if per_document_folders else ''
+        yield from _entries(document, prefix)
+
+
+def write_archive(documents, target, per_document_folders=None):
+    """Write the deliverables of ``documents`` as a ZIP to a path or file object"""
+    with zipfile.ZipFile(target, 'w') as archive, metrics.stage('archive'):
+        for name, data in output_files(documents, per_document_folders):
+            archive.writestr(name, data)
+
+
+def deliverable(documents):
+    """``(bytes, download name, file type)`` of a pipeline result"""
+    if len(documents) == 1 and documents[0].kind != IMAGES:
+        (name, data), = _entries(documents[0])
+        return data, name, 'txt' if documents[0].kind == TEXT else 'pdf'
+    buffer = io.BytesIO()
+    write_archive(documents, buffer)
+    return buffer.getvalue(), 'pipeline_output.zip', 'zip'
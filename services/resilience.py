@@ -0,0 +1,178 @@
+import os
+import time
+import random
+import logging
+import threading
+from services import metrics
+
+# Deadlines, retries and circuit breaking for calls to Vision and Cloud
+# Storage.
+#
+# Every call gets a per-attempt timeout, and all attempts together must
+# finish within the call's deadline. Transient failures (503, 429, 5xx,
+# deadline exceeded, connection errors) are retried with exponential
+# backoff and full jitter; anything else is raised at once. The client
+# libraries' own retries are switched off by the callers so this policy is
+# the only one in effect.
+#
+# After CIRCUIT_FAILURE_THRESHOLD consecutive failed calls a backend's
+# circuit opens and calls fail immediately with CircuitOpenError, so an
+# outage costs a request nothing instead of tying up a worker thread until
+# gunicorn kills it. After CIRCUIT_RESET_TIMEOUT_S one probe call is let
+# through (half-open); its outcome closes or reopens the circuit.
+#
+# Limits per backend come from the environment, e.g. VISION_TIMEOUT_S,
+# VISION_DEADLINE_S, VISION_MAX_ATTEMPTS, VISION_BACKOFF_S (and STORAGE_*).
+
+DEFAULTS = {
+    'vision': {'timeout': 20.0, 'deadline': 45.0, 'max_attempts': 3, 'backoff': 0.5},
+    'storage': {'timeout': 30.0, 'deadline': 60.0, 'max_attempts': 3, 'backoff': 0.5},
+}
+
+MAX_BACKOFF = 8.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open"""
+
+
+def is_retryable(error):
+    """Whether a failed call may succeed when tried again"""
+    from google.api_core import exceptions as api_exceptions
+    from google.auth.exceptions import TransportError
+    import requests
+
+    return isinstance(error, (
+        api_exceptions.TooManyRequests,
+        api_exceptions.InternalServerError,
+        api_exceptions.BadGateway,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.GatewayTimeout,
+        api_exceptions.DeadlineExceeded,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        TransportError,
+        ConnectionError,
+        TimeoutError,
+    ))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker shared by all threads of a process"""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.CIRCUIT_STATE.labels(service=self.name).set(state)
+
+    def allow(self):
+        """Whether a call may go out now; at most one probe while half-open"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                logging.info(f"Circuit for {self.name} half-open, probing")
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                logging.info(f"Circuit for {self.name} closed")
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"Circuit for {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+class Backend:
+    """Retry policy and circuit breaker for one external service"""
+
+    def __init__(self, name, timeout, deadline, max_attempts, backoff, breaker):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.breaker = breaker
+
+    @classmethod
+    def from_env(cls, name):
+        prefix = name.upper() + '_'
+        defaults = DEFAULTS[name]
+        breaker = CircuitBreaker(
+            name,
+            failure_threshold=int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5)),
+            reset_timeout=float(os.environ.get('CIRCUIT_RESET_TIMEOUT_S', 30)),
+        )
+        return cls(
+            name,
+            timeout=float(os.environ.get(prefix + 'TIMEOUT_S', defaults['timeout'])),
+            deadline=float(os.environ.get(prefix + 'DEADLINE_S', defaults['deadline'])),
+            max_attempts=int(os.environ.get(prefix + 'MAX_ATTEMPTS', defaults['max_attempts'])),
+            backoff=float(os.environ.get(prefix + 'BACKOFF_S', defaults['backoff'])),
+            breaker=breaker,
+        )
+
+    @property
+    def available(self):
+        """False while the circuit is open and calls would be rejected"""
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def call(self, method, fn, *args, **kwargs):
+        """Call ``fn(*args, timeout=..., **kwargs)`` under this backend's policy"""
+        if not self.breaker.allow():
+            metrics.BACKEND_REQUESTS.labels(service=self.name, method=method, outcome='rejected').inc()
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            remaining = self.deadline - (time.monotonic() - started)
+            try:
+                with metrics.backend_call(self.name, method):
+                    result = fn(*args, timeout=max(0.1, min(self.timeout, remaining)), **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The backend answered; the request itself was bad
+                    self.breaker.record_success()
+                    raise
+                delay = random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** (attempt - 1)))
+                remaining = self.deadline - (time.monotonic() - started)
+                if attempt >= self.max_attempts or delay >= remaining:
+                    self.breaker.record_failure()
+                    raise
+                logging.warning(f"{self.name} {method} failed (attempt {attempt}), retrying: {str(e)}")
+                metrics.BACKEND_RETRIES.labels(service=self.name, method=method).inc()
+                time.sleep(delay)
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+
+vision = Backend.from_env('vision')
+storage = Backend.from_env('storage')
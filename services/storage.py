@@ -0,0 +1,171 @@
+import os
+import uuid
+import string
+import hashlib
+import logging
+from werkzeug.utils import secure_filename
+from services import metrics
+
+HEX_DIGITS = set(string.hexdigits.lower())
+
+
+class StagedUpload:
+    """Writable file for one uploaded part, hashed as it is written.
+
+    The multipart parser writes the part straight into ``<final path>.part``
+    in its shard directory, and ``FileStorage.save`` then renames it into
+    place, so an upload is written to disk once and hashed in the same
+    pass. Reads and seeks go to the underlying file, so views that read
+    the upload directly still work.
+    """
+
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path + '.part'
+        self.size = 0
+        self.committed = False
+        self._hash = hashlib.sha256()
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        """Hex digest of everything written so far"""
+        return self._hash.hexdigest()
+
+    def commit(self, path):
+        """Move the staged file to ``path``; the open handle stays readable"""
+        self._file.flush()
+        os.replace(self.path, path)
+        self.path = path
+        self.committed = True
+        self._file.seek(0)
+
+    def discard(self):
+        """Close the file and delete it unless it was committed"""
+        self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class FileStorage:
+    """Sharded file storage for uploads and processed outputs.
+
+    Files are addressed by a key such as ``<uuid>_<name>`` and stored under
+    ``<area folder>/ab/cd/<key>``, where ``ab/cd`` is taken from the UUID
+    prefix of the key, so no single directory grows without bound. When a
+    ``CloudStorageService`` is configured, files can be published to the
+    bucket under the same sharded name.
+    """
+
+    def __init__(self, upload_folder, processed_folder, cloud_storage=None):
+        self.folders = {
+            'uploads': os.path.abspath(upload_folder),
+            'processed': os.path.abspath(processed_folder),
+        }
+        self.cloud_storage = cloud_storage
+
+    @staticmethod
+    def new_key(filename):
+        """Generate a unique storage key for a filename"""
+        return str(uuid.uuid4()) + '_' + secure_filename(filename)
+
+    @staticmethod
+    def shard(key):
+        """Return the two-level shard directory (``ab/cd``) for a key"""
+        prefix = key[:4].lower()
+        if len(prefix) < 4 or not set(prefix) <= HEX_DIGITS:
+            # Keys without a UUID prefix are spread by their hash instead
+            prefix = hashlib.md5(key.encode('utf-8')).hexdigest()[:4]
+        return os.path.join(prefix[:2], prefix[2:4])
+
+    def relative_path(self, key):
+        """Sharded path of a key relative to its area folder"""
+        return os.path.join(self.shard(key), key)
+
+    def path(self, key, area='uploads'):
+        """Return the local path for a key, creating its shard directory"""
+        path = os.path.join(self.folders[area], self.relative_path(key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def locate(self, key, area='uploads'):
+        """Return the local path of an existing file, or None if missing.
+
+        Files written before sharding was introduced live directly in the
+        area folder and are still found here.
+        """
+        key = os.path.basename(key)
+        for path in (os.path.join(self.folders[area], self.relative_path(key)),
+                     os.path.join(self.folders[area], key)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def stage(self, filename):
+        """Open a ``StagedUpload`` for an incoming file, under a new key"""
+        key = self.new_key(filename or 'upload')
+        return StagedUpload(key, self.path(key, 'uploads'))
+
+    def save(self, file, area='uploads', key=None):
+        """Save an uploaded ``FileStorage`` object and return ``(key, path)``.
+
+        Uploads already streamed to a ``StagedUpload`` are moved into place
+        instead of being copied.
+        """
+        staged = file.stream if isinstance(file.stream, StagedUpload) and not file.stream.committed else None
+        key = key or (staged.key if staged else self.new_key(file.filename))
+        path = self.path(key, area)
+        with metrics.stage('upload_save'):
+            if staged:
+                staged.commit(path)
+            else:
+                file.save(path)
+        return key, path
+
+    @staticmethod
+    def content_hash(file):
+        """SHA-256 of an uploaded file, computed while it was received if possible"""
+        if isinstance(file.stream, StagedUpload):
+            return file.stream.sha256
+        position = file.stream.tell()
+        file.stream.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+            digest.update(chunk)
+        file.stream.seek(position)
+        return digest.hexdigest()
+
+    def delete(self, key, area='uploads', remote=True):
+        """Delete a file locally and, when published, from the bucket"""
+        path = self.locate(key, area)
+        if path:
+            os.remove(path)
+        if remote and self.cloud_enabled():
+            try:
+                self.cloud_storage.delete_file(self.remote_name(key))
+            except Exception as e:
+                logging.warning(f"Could not delete {key} from Cloud Storage: {str(e)}")
+
+    def remote_name(self, key):
+        """Object name used for a key in the Cloud Storage bucket"""
+        return self.relative_path(key).replace(os.sep, '/')
+
+    def cloud_enabled(self):
+        """Check if files can be published to Cloud Storage"""
+        return self.cloud_storage is not None and self.cloud_storage.is_configured()
+
+    def publish(self, key, area='uploads'):
+        """Upload a locally stored file to Cloud Storage"""
+        path = self.locate(key, area)
+        if path is None:
+            raise FileNotFoundError(f"No stored file for key {key}")
+        with metrics.stage('gcs_upload'):
+            return self.cloud_storage.upload_file(path, self.remote_name(key))
@@ -37,9 +37,13 @@ app.config['GOOGLE_CLOUD_STORAGE_BUCKET'] = os.environ.get("GOOGLE_CLOUD_STORAGE
 # Initialize the app with the extension
 db.init_app(app)
 
-with app.app_context():
-    # Import models to ensure tables are created
-    import models
+# Import models; tables are created once with `flask --app app init-db`
+# rather than on every import, so booting a worker does no database I/O
+import models
+
+@app.cli.command('init-db')
+def init_db():
+    """Create any missing database tables"""
     db.create_all()
 
 # Import routes
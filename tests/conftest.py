@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The app reads its configuration at import and keeps files relative to the
+# working directory, so point both at a scratch directory first
+_WORK_DIR = tempfile.mkdtemp(prefix='smart-converter-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_WORK_DIR, 'test.db')}")
+os.environ.setdefault('HISTORY_WRITE_MODE', 'sync')
+os.chdir(_WORK_DIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    from extensions import db
+    from migrations import upgrade
+    import routes  # noqa: F401  (registers routes and wires up storage)
+    app.config['TESTING'] = True
+    app.config['HISTORY_SPOOL_DIR'] = os.path.join(_WORK_DIR, 'history_spool')
+    with app.app_context():
+        upgrade(db.engine)
+    return app
@@ -0,0 +1,104 @@
+import io
+import os
+import hashlib
+import time
+import threading
+from werkzeug.datastructures import FileStorage as Upload
+from blob_store import blob_store
+from extensions import db
+from history_writer import history_writer
+from models import ConversionHistory, StoredBlob
+
+
+def _upload(data, filename='notes.txt'):
+    return Upload(stream=io.BytesIO(data), filename=filename)
+
+
+def _row(sha256):
+    return db.session.get(StoredBlob, sha256)
+
+
+def _in_thread(app, target, *args):
+    def run():
+        with app.app_context():
+            target(*args)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_release_deletes_file_before_a_concurrent_acquire_stores_it(app):
+    data = b'release race'
+    with app.app_context():
+        blob, created = blob_store.acquire(_upload(data))
+        assert created
+        path = blob_store.storage.locate(blob.storage_key)
+
+        deleting = threading.Event()
+        resume = threading.Event()
+        delete = blob_store.storage.delete
+
+        def slow_delete(*args, **kwargs):
+            deleting.set()
+            resume.wait(5)
+            return delete(*args, **kwargs)
+
+        blob_store.storage.delete = slow_delete
+        try:
+            releaser = _in_thread(app, blob_store.release, blob.sha256)
+            assert deleting.wait(5)
+
+            acquired = []
+            acquirer = _in_thread(app, lambda: acquired.append(blob_store.acquire(_upload(data))))
+            # The acquire must wait for the release to finish deleting
+            time.sleep(0.3)
+            assert not acquired
+            resume.set()
+            releaser.join(5)
+            acquirer.join(5)
+        finally:
+            blob_store.storage.delete = delete
+
+        assert acquired and acquired[0][1]
+        assert os.path.exists(path)
+        db.session.expire_all()
+        assert _row(blob.sha256).refcount == 1
+        assert blob_store.release(blob.sha256)
+        assert not os.path.exists(path)
+
+
+def test_rejected_history_row_releases_its_blob(app):
+    data = b'history insert fails'
+    app.config['HISTORY_WRITE_MODE'] = 'deferred'
+    app.config['HISTORY_FLUSH_RETRIES'] = 1
+    try:
+        with app.app_context():
+            blob, _ = blob_store.acquire(_upload(data))
+            path = blob_store.storage.locate(blob.storage_key)
+            # filename is NOT NULL: the database rejects the row
+            history_writer.record(ConversionHistory(
+                filename=None, original_filename='notes.txt', file_type='txt',
+                conversion_type='local_upload', status='completed', blob_sha256=blob.sha256))
+            deadline = time.monotonic() + 5
+            while os.path.exists(path) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            db.session.expire_all()
+            assert _row(blob.sha256) is None
+            assert not os.path.exists(path)
+    finally:
+        app.config['HISTORY_WRITE_MODE'] = 'sync'
+
+
+def test_failed_upload_releases_its_blob(app, monkeypatch):
+    data = b'history commit fails'
+
+    def fail(*instances):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(history_writer, 'record', fail)
+    client = app.test_client()
+    response = client.post('/upload', data={'file': (io.BytesIO(data), 'notes.txt')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    with app.app_context():
+        assert _row(hashlib.sha256(data).hexdigest()) is None
@@ -0,0 +1,70 @@
+import pytest
+import requests
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+from google.cloud.storage import batch
+from services import clients
+from services.cloud_storage import CloudStorageService
+
+BOUNDARY = 'batch_boundary'
+
+
+def _batch_response(statuses):
+    """A multipart/mixed batch response with one part per status"""
+    parts = []
+    for number, status in enumerate(statuses, 1):
+        parts.append(
+            f"--{BOUNDARY}\nContent-Type: application/http\nContent-ID: <response-{number}>\n\n"
+            f"HTTP/1.1 {status} Status\nContent-Type: application/json\n\n{{}}\n")
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['content-type'] = f'multipart/mixed; boundary={BOUNDARY}'
+    response._content = (''.join(parts) + f"--{BOUNDARY}--\n").encode('utf-8')
+    return response
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv('GOOGLE_CLOUD_PROJECT', 'project')
+    monkeypatch.setenv('GOOGLE_CLOUD_STORAGE_BUCKET', 'bucket')
+    client = storage.Client(project='project', credentials=AnonymousCredentials())
+    monkeypatch.setattr(clients, 'storage_client', lambda: client)
+    return client, CloudStorageService()
+
+
+def test_delete_files_counts_batch_responses(service, monkeypatch):
+    client, cloud = service
+    requests_sent = []
+
+    def make_request(method, url, data=None, headers=None, timeout=None, **kwargs):
+        # The client also fetches bucket metadata in the background
+        if url.endswith('/batch/storage/v1'):
+            requests_sent.append(data)
+        return _batch_response([204, 404, 503])
+
+    monkeypatch.setattr(client._base_connection, '_make_request', make_request)
+    result = cloud.delete_files(['a', 'b', 'c'])
+
+    assert len(requests_sent) == 1
+    assert requests_sent[0].count('/storage/v1/b/bucket/o/') == 3
+    assert result['deleted'] == 1
+    assert result['not_found'] == 1
+    assert result['failed'] == ['c']
+
+
+def test_delete_files_fails_loudly_without_batch_responses(service, monkeypatch):
+    client, cloud = service
+    monkeypatch.setattr(client._base_connection, '_make_request',
+                        lambda *args, **kwargs: _batch_response([204, 204, 204]))
+    finish = batch.Batch.finish
+
+    def finish_without_responses(self, *args, **kwargs):
+        # As if a library release stopped keeping the responses
+        finish(self, *args, **kwargs)
+        del self._responses
+
+    monkeypatch.setattr(batch.Batch, 'finish', finish_without_responses)
+    result = cloud.delete_files(['a', 'b', 'c'])
+
+    assert result['deleted'] == 0
+    assert sorted(result['failed']) == ['a', 'b', 'c']
@@ -0,0 +1,50 @@
+import io
+import os
+import pytest
+import pdf2image
+from PIL import Image
+from PyPDF2 import PdfWriter
+from services.page_cache import PageCache
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Stub poppler with noisy pages that a lossy format cannot reproduce"""
+    calls = []
+
+    def convert_from_bytes(pdf, dpi=200, grayscale=False, first_page=1, last_page=None):
+        calls.append((dpi, first_page, last_page))
+        return [Image.effect_noise((dpi, dpi), 64).convert('RGB') for _ in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(pdf2image, 'convert_from_bytes', convert_from_bytes)
+    return calls
+
+
+def _pdf(pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(612, 792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('lossy', [False, True])
+def test_hits_return_the_same_pixels_as_the_miss(tmp_path, renders, lossy):
+    cache = PageCache(str(tmp_path), 64 * 1024 * 1024)
+    pdf = _pdf(2)
+    missed = cache.render(pdf, dpi=100, lossy=lossy)
+    hit = cache.render(pdf, dpi=100, lossy=lossy)
+    assert len(renders) == 1
+    assert [page.tobytes() for page in hit] == [page.tobytes() for page in missed]
+
+
+def test_lossy_and_lossless_renders_are_kept_apart(tmp_path, renders):
+    cache = PageCache(str(tmp_path), 64 * 1024 * 1024)
+    pdf = _pdf(1)
+    cache.render(pdf, dpi=100, lossy=True)
+    exact = cache.render(pdf, dpi=100)
+    assert len(renders) == 2
+    assert cache.render(pdf, dpi=100)[0].tobytes() == exact[0].tobytes()
+    names = sorted(name for _, _, files in os.walk(tmp_path) for name in files)
+    assert names == ['p1_100_RGB.jpg', 'p1_100_RGB.png', 'pages']
@@ -0,0 +1,26 @@
+from datetime import datetime
+from extensions import db
+from models import ConversionHistory
+
+HOSTILE = "x');alert(document.cookie);('.pdf"
+
+
+def test_my_files_does_not_put_filenames_into_script(app):
+    with app.app_context():
+        record = ConversionHistory(
+            filename='hostile.pdf', original_filename=HOSTILE, file_type='pdf',
+            conversion_type='local_upload', status='completed', processed_at=datetime.utcnow())
+        db.session.add(record)
+        db.session.commit()
+        try:
+            html = app.test_client().get('/my-files').get_data(as_text=True)
+        finally:
+            db.session.delete(record)
+            db.session.commit()
+
+    assert 'onsubmit' not in html
+    assert HOSTILE not in html
+    assert 'data-filename="x&#39;);alert(document.cookie);(&#39;.pdf"' in html
+    # Inline scripts do not contain the name in any form
+    for script in html.split('<script')[1:]:
+        assert 'alert(document.cookie)' not in script.split('</script>')[0]
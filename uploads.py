@@ -0,0 +1,55 @@
+from flask import Request, current_app, request
+
+MB = 1024 * 1024
+
+
+class StreamingRequest(Request):
+    """Request that streams uploaded files straight into upload storage.
+
+    Werkzeug parses multipart bodies incrementally; by default each file
+    part goes to a spooled temporary file that views then copy to its final
+    place. Here each part is written to a ``StagedUpload`` in its final
+    shard directory instead and hashed on the way, so memory per request
+    stays constant and ``FileStorage.save`` only has to rename it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.staged_uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        storage = current_app.extensions.get('upload_storage')
+        if storage is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        staged = storage.stage(filename)
+        self.staged_uploads.append(staged)
+        return staged
+
+
+def upload_limit(endpoint):
+    """Maximum request size in bytes for an endpoint"""
+    limits = current_app.config['UPLOAD_LIMITS_MB']
+    if endpoint in limits:
+        return limits[endpoint] * MB
+    return current_app.config['MAX_CONTENT_LENGTH']
+
+
+def init_app(app, storage):
+    """Stream uploads into ``storage`` and apply per-route size limits"""
+    app.request_class = StreamingRequest
+    app.extensions['upload_storage'] = storage
+
+    @app.before_request
+    def _apply_upload_limit():
+        # Set before the body is read; werkzeug raises 413 past this size
+        request.max_content_length = upload_limit(request.endpoint)
+
+    @app.context_processor
+    def _upload_limits():
+        return {'upload_limit_mb': lambda endpoint: upload_limit(endpoint) // MB}
+
+    @app.teardown_request
+    def _discard_staged_uploads(exc=None):
+        # Parts the view did not save, or that were cut off by a 413
+        for staged in getattr(request, 'staged_uploads', ()):
+            staged.discard()